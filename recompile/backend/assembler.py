@@ -7,6 +7,7 @@ class Opcode(IntEnum):
     Branch = 0b00
     Split = 0b01
     Save = 0b10
+    Class = 0b11
 
 _opcode_shift = 30
 
@@ -39,15 +40,31 @@ _dest2_shift = 4
 
 '''
 ===============================================
-Save <match> <index>
+Save <match> <index> <pattern>
 -----------------------------------------------
-| 31:30 |  29   |  28:22   | 21:16 |   15:0   |
-+-------+-------+----------+-------+----------+
-| 0b10  | match | reserved | index | reserved |
+| 31:30 |  29   |  28:22   | 21:16 |  15:0   |
++-------+-------+----------+-------+---------+
+| 0b10  | match | reserved | index | pattern |
 -----------------------------------------------
 '''
 _match_shift = 29
 _save_index_shift = 16
+_pattern_shift = 0
+
+'''
+===============================================
+Class <table>
+-----------------------------------------------
+| 31:30 |  29:16   |  15:0  |
++-------+----------+--------+
+| 0b11  | reserved | table  |
+-----------------------------------------------
+`table` is the word address of the class's 256-bit bitmap. Bitmaps are stored after the last
+instruction of the program as 8 words each, with bit `c % 32` of word `c // 32` set if the class
+contains byte `c`.
+'''
+_table_shift = 0
+TABLE_WORDS = 8
 
 # Returns a 32-bit number
 @singledispatch
@@ -57,7 +74,7 @@ def assemble(val) -> int:
 @assemble.register
 def _(val: inst.Save) -> int:
     asm = (Opcode.Save.value << _opcode_shift) | (int(val.is_match) << _match_shift) \
-        | (val.index << _save_index_shift)
+        | (val.index << _save_index_shift) | (val.pattern << _pattern_shift)
     return asm & 0xFFFF_FFFF
 
 @assemble.register
@@ -72,3 +89,76 @@ def _(val: inst.AluOp) -> int:
         | (int(val.consume) << _consume_shift) | (val.dest << _dest_shift) \
         | (val.c_min << _char_min_shift) | (val.c_max << _char_max_shift)
     return asm & 0xFFFF_FFFF
+
+@assemble.register
+def _(val: inst.ClassLookup) -> int:
+    raise AssertionError("Class instructions need a table, use assemble_program")
+
+def assemble_program(code: list[inst.Instruction]) -> list[int]:
+    '''
+    Assemble a whole program, followed by the bitmaps of its Class instructions.
+    Classes with the same bitmap share a table.
+    '''
+    words: list[int] = []
+    tables: dict[int, int] = {}
+    for i in code:
+        if isinstance(i, inst.ClassLookup):
+            address = len(code) + TABLE_WORDS * tables.setdefault(i.bitmap, len(tables))
+            words.append((Opcode.Class.value << _opcode_shift) | (address << _table_shift))
+        else:
+            words.append(assemble(i))
+    for bitmap in tables:
+        words += [(bitmap >> (32 * k)) & 0xFFFF_FFFF for k in range(TABLE_WORDS)]
+    return words
+
+def code_length(words) -> int:
+    '''
+    The number of instructions at the start of an assembled program, before its tables.
+    '''
+    # Tables are numbered in the order the instructions use them, so the first Class
+    # instruction always points at the end of the code.
+    for word in words:
+        if is_class(word):
+            return (word >> _table_shift) & 0xFFFF
+    return len(words)
+
+def is_class(word: int) -> bool:
+    return word >> _opcode_shift == Opcode.Class
+
+def disassemble_class(words, word: int) -> inst.ClassLookup:
+    '''
+    Decode a Class instruction, reading its bitmap from the assembled program `words`.
+    '''
+    address = (word >> _table_shift) & 0xFFFF
+    return inst.ClassLookup(sum(words[address + k] << (32 * k) for k in range(TABLE_WORDS)))
+
+def disassemble_program(words) -> list[inst.Instruction]:
+    '''
+    Decode the output of `assemble_program` back into instructions.
+    '''
+    return [disassemble_class(words, word) if is_class(word) else disassemble(word)
+            for word in words[:code_length(words)]]
+
+def disassemble(word: int) -> inst.Instruction:
+    '''
+    Decode a 32-bit word produced by `assemble` back into an instruction.
+    Class instructions need their table, see `disassemble_program`.
+    '''
+    opcode = word >> _opcode_shift
+    match opcode:
+        case Opcode.Branch:
+            return inst.AluOp(
+                consume=bool((word >> _consume_shift) & 1),
+                inverted=bool((word >> _inverted_shift) & 1),
+                dest=(word >> _dest_shift) & 0xFFF,
+                c_min=(word >> _char_min_shift) & 0xFF,
+                c_max=(word >> _char_max_shift) & 0xFF)
+        case Opcode.Split:
+            return inst.Split((word >> _dest1_shift) & 0xFFF, (word >> _dest2_shift) & 0xFFF)
+        case Opcode.Save:
+            return inst.Save(
+                index=(word >> _save_index_shift) & 0x3F,
+                is_match=bool((word >> _match_shift) & 1),
+                pattern=(word >> _pattern_shift) & 0xFFFF)
+        case _:
+            raise AssertionError(f"Unexpected opcode in {word:#010x}")
@@ -1,85 +1,147 @@
-from ..frontend import syntax as syn
+from ..frontend import syntax as syn, transform
 from . import instruction as inst
+from dataclasses import dataclass
 from functools import singledispatch
 
-def compile(val: syn.Construction) -> list[inst.Instruction]:
-    code, _ = compile_helper(val, 0)
+# Destinations are 12 bits wide in the binary encoding.
+MAX_PROGRAM_SIZE = 1 << 12
+
+class ProgramTooLarge(ValueError):
+    '''
+    Raised when a program would have more instructions than its destinations can address.
+    '''
+
+@dataclass(frozen=True)
+class Options:
+    '''
+    Choices about the code that gets generated.
+    '''
+    # Lower character sets that need more than one AluOp to a single Class instruction.
+    class_table: bool = False
+
+def compile(val: syn.Construction, max_size: int = MAX_PROGRAM_SIZE,
+            opts: Options = Options()) -> list[inst.Instruction]:
+    size = code_size(val, opts)
+    if size > max_size:
+        raise ProgramTooLarge(
+            f"Program would have {size} instructions, more than the limit of {max_size}")
+    # Equal subtrees are shared first, so that the code for each is only generated once.
+    code, _ = compile_helper(transform.share(val), 0, opts, {})
     return code
 
+def _relocate(code: list[inst.Instruction], offset: int) -> list[inst.Instruction]:
+    '''
+    Move code that was generated to start at pc 0 so that it starts at `offset` instead.
+    '''
+    def move(i: inst.Instruction) -> inst.Instruction:
+        if isinstance(i, inst.Split):
+            return inst.Split(i.dest1 + offset, i.dest2 + offset)
+        elif isinstance(i, inst.AluOp) and not i.consume:
+            return inst.AluOp(False, i.inverted, i.dest + offset, i.c_min, i.c_max)
+        return i
+    return [move(i) for i in code]
+
+# Code generated for each node so far, by id, with the node and the pc the code starts at.
+# Keeping the node stops its id being reused while the memo is in use.
+_Memo = dict[int, tuple[syn.Construction, list[inst.Instruction], int]]
+
+def compile_helper(val: syn.Construction, pc: int, opts: Options,
+                   memo: _Memo | None = None) -> tuple[list[inst.Instruction], int]:
+    '''
+    Generate the code for a construction starting at `pc`, and return it with the pc after it.
+    Nodes that already have code in `memo` get a copy of it moved to `pc`.
+    '''
+    if memo is None:
+        memo = {}
+    found = memo.get(id(val))
+    if found is not None:
+        _, code, start = found
+        return (_relocate(code, pc - start), pc + len(code))
+    code, end = _generate(val, pc, opts, memo)
+    memo[id(val)] = (val, code, pc)
+    return (code, end)
+
 @singledispatch
-def compile_helper(val, _:int) -> tuple[list[inst.Instruction], int]:
+def _generate(val, _: int, opts: Options, memo: _Memo) -> tuple[list[inst.Instruction], int]:
     raise AssertionError(f"Unexpected type for val {val.type}")
 
-@compile_helper.register
-def _(val: syn.Literal, pc: int) -> tuple[list[inst.Instruction], int]:
+@_generate.register
+def _(val: syn.Literal, pc: int, opts: Options, memo: _Memo) -> tuple[list[inst.Instruction], int]:
     return ([inst.Literal(ord(val.val), False)], pc+1)
 
-@compile_helper.register
-def _(val: syn.Group, pc: int) -> tuple[list[inst.Instruction], int]:
+@_generate.register
+def _(val: syn.Group, pc: int, opts: Options, memo: _Memo) -> tuple[list[inst.Instruction], int]:
     save_index = val.expression_index*2
-    exp_code, pc2 = compile_helper(val.expression, pc+1)
-    code = [inst.Save(save_index, False)] + exp_code + [inst.Save(save_index+1, val.is_top_level)]
+    exp_code, pc2 = compile_helper(val.expression, pc+1, opts, memo)
+    code = [inst.Save(save_index, False)] + exp_code \
+        + [inst.Save(save_index+1, val.is_top_level, val.pattern)]
     return (code, pc2+1)
 
-@compile_helper.register
-def _(_: syn.WildCard, pc: int) -> tuple[list[inst.Instruction], int]:
+@_generate.register
+def _(_: syn.WildCard, pc: int, opts: Options, memo: _Memo) -> tuple[list[inst.Instruction], int]:
     return ([inst.Consume()], pc+1)
 
-@compile_helper.register
-def _(val: syn.CharSet, pc: int) -> tuple[list[inst.Instruction], int]:
-    # Handle single characters and ranges separately since they don't actually need options.
-    if val._is_single_char():
-        return ([inst.Literal(ord(val.chars[0]), val.inverse)], pc+1)
-    elif val._is_single_range():
-        c_min, c_max = val.ranges[0]
-        return ([inst.Compare(ord(c_min), ord(c_max), val.inverse)], pc+1)
-    
-    # More complex character sets require a series of commands
+@_generate.register
+def _(val: syn.CharSet, pc: int, opts: Options, memo: _Memo) -> tuple[list[inst.Instruction], int]:
+    code = _lower_charset(val, pc, opts)
+    return (code, pc + len(code))
+
+def _lower_charset(val: syn.CharSet, pc: int, opts: Options) -> list[inst.Instruction]:
+    '''
+    Pick the cheapest code for a character set, working from its normalized ranges so that
+    duplicates, overlaps and neighbouring ranges don't cost anything extra.
+    '''
+    ranges = val.normalized()
+    excluded = syn.complement(ranges)
+    # Sets that are a single range, or everything but one, only need one comparison.
+    if len(ranges) == 0:
+        return [inst.Die()]
+    elif len(ranges) == 1:
+        return [inst.Compare(*ranges[0], False)]
+    elif len(excluded) == 1:
+        return [inst.Compare(*excluded[0], True)]
+    elif opts.class_table:
+        bitmap = sum((1 << (c_max + 1)) - (1 << c_min) for c_min, c_max in ranges)
+        return [inst.ClassLookup(bitmap)]
+
+    # Otherwise branch on the ranges of whichever of the set and its complement is cheaper.
     """
     ---- Normal Comparison ----
-        Branches for single characters <dest=L1>
-        Branches for character ranges <dest=L1>
+        Branches for the ranges in the set <dest=L1>
     L0: Die
     L1: Consume
     L2:
     ---- Inverse Comparison ----
-        Branches for single characters <dest=L1>
-        Branches for character ranges <dest=L1>
+        Branches for the ranges not in the set <dest=L1>
     L0: Consume
         Jump L2
     L1: Die
     L2:
     """
-    code = []
-    l0 = pc + len(val.chars) + len(val.ranges)
-
-    if not val.inverse:
-        l1 = l0 + 1
-        l2 = l0 + 2
-        code_postfix = [inst.Die(), inst.Consume()]
-    else:
-        l1 = l0 + 2
-        l2 = l0 + 3
-        code_postfix = [inst.Consume(), inst.Jump(l2), inst.Die()]
-
-    for c in val.chars:
-        code.append(inst.Branch(ord(c), ord(c), l1))
-    for c_min, c_max in val.ranges:
-        code.append(inst.Branch(ord(c_min), ord(c_max), l1))
-    code += code_postfix
-
-    return (code, l2)
-
-@compile_helper.register
-def _(val: syn.Sequence, pc: int) -> tuple[list[inst.Instruction], int]:
+    # Ties go to the way the set was written. Only characters above 0xFF can tell the two apart.
+    normal_cost = len(ranges) + 2
+    inverse_cost = len(excluded) + 3
+    if normal_cost < inverse_cost or (normal_cost == inverse_cost and not val.inverse):
+        l1 = pc + len(ranges) + 1
+        code = [inst.Branch(c_min, c_max, l1) for c_min, c_max in ranges]
+        return code + [inst.Die(), inst.Consume()]
+    l0 = pc + len(excluded)
+    l1 = l0 + 2
+    l2 = l0 + 3
+    code = [inst.Branch(c_min, c_max, l1) for c_min, c_max in excluded]
+    return code + [inst.Consume(), inst.Jump(l2), inst.Die()]
+
+@_generate.register
+def _(val: syn.Sequence, pc: int, opts: Options, memo: _Memo) -> tuple[list[inst.Instruction], int]:
     code = []
     for seq_val in val.val:
-        tmp_code, pc = compile_helper(seq_val, pc)
+        tmp_code, pc = compile_helper(seq_val, pc, opts, memo)
         code += tmp_code
     return (code, pc)
 
-@compile_helper.register
-def _(val: syn.Alternatives, pc: int) -> tuple[list[inst.Instruction], int]:
+@_generate.register
+def _(val: syn.Alternatives, pc: int, opts: Options,
+      memo: _Memo) -> tuple[list[inst.Instruction], int]:
     """
         Split L1, L2
     L1: code for alt1
@@ -88,46 +150,148 @@ def _(val: syn.Alternatives, pc: int) -> tuple[list[inst.Instruction], int]:
     L3:
     """
     l1 = pc+1
-    code1, pc1 = compile_helper(val.alt1, l1)
+    code1, pc1 = compile_helper(val.alt1, l1, opts, memo)
     l2 = pc1+1
-    code2, l3 = compile_helper(val.alt2, l2)
+    code2, l3 = compile_helper(val.alt2, l2, opts, memo)
     return ([inst.Split(l1, l2)] + code1 + [inst.Jump(l3)] + code2, l3)
 
-@compile_helper.register
-def _(val: syn.Option, pc: int) -> tuple[list[inst.Instruction], int]:
+@_generate.register
+def _(val: syn.Option, pc: int, opts: Options, memo: _Memo) -> tuple[list[inst.Instruction], int]:
     """
         Split L1, L2
     L1: code for val
     L2:
     """
-    # NOTE: We could do a strength-reduction optimization to optChar or OptRange if the option
-    # is on a simple character or range.
+    # Options of options and of loops don't add anything: x?? == x? and (x*)? == (x+)? == x*.
+    # Options on a single character or range are already as cheap as they can be without a
+    # dedicated instruction, and the optimizer shortens the loops.
+    if isinstance(val.val, syn.Option | syn.Any):
+        return compile_helper(val.val, pc, opts, memo)
+    elif isinstance(val.val, syn.Some):
+        return compile_helper(syn.Any(val.val.val), pc, opts, memo)
     l1 = pc+1
-    code, l2 = compile_helper(val.val, l1)
+    code, l2 = compile_helper(val.val, l1, opts, memo)
     return ([inst.Split(l1, l2)] + code, l2)
 
-@compile_helper.register
-def _(val: syn.Some, pc: int) -> tuple[list[inst.Instruction], int]:
+@_generate.register
+def _(val: syn.Some, pc: int, opts: Options, memo: _Memo) -> tuple[list[inst.Instruction], int]:
     """
     L1: code for val
         Split L1, L3
     L3:
     """
+    # (x+)+ == x+ and (x?)+ == (x*)+ == x*
+    if isinstance(val.val, syn.Some):
+        return compile_helper(val.val, pc, opts, memo)
+    elif isinstance(val.val, syn.Option | syn.Any):
+        return compile_helper(syn.Any(val.val.val), pc, opts, memo)
     l1 = pc
-    code, pc1 = compile_helper(val.val, l1)
+    code, pc1 = compile_helper(val.val, l1, opts, memo)
     l3 = pc1+1
     return (code + [inst.Split(l1, l3)], l3)
 
-@compile_helper.register
-def _(val: syn.Any, pc: int) -> tuple[list[inst.Instruction], int]:
+@_generate.register
+def _(val: syn.Any, pc: int, opts: Options, memo: _Memo) -> tuple[list[inst.Instruction], int]:
     """
     L1: Split L2, L3
     L2: code for val
         Jump L1
     L3:
     """
+    # (x?)* == (x+)* == (x*)* == x*
+    if isinstance(val.val, syn.Option | syn.Some | syn.Any):
+        return compile_helper(syn.Any(val.val.val), pc, opts, memo)
     l1 = pc
     l2 = pc+1
-    code, pc1 = compile_helper(val.val, l2)
+    code, pc1 = compile_helper(val.val, l2, opts, memo)
     l3 = pc1+1
     return ([inst.Split(l2, l3)] + code + [inst.Jump(l1)], l3)
+
+@_generate.register
+def _(val: syn.Repeat, pc: int, opts: Options, memo: _Memo) -> tuple[list[inst.Instruction], int]:
+    """
+        code for val (min times)
+    ---- Bounded ----
+        Split L1, L3
+    L1: code for val
+        Split L2, L3
+    L2: code for val
+        ... (max - min times)
+    L3:
+    ---- Unbounded ----
+        code for val*
+    """
+    # The body is only generated once and then copied, and the optional copies are nested so
+    # that skipping one skips all the ones after it, rather than leaving them all to be tried.
+    body, _ = compile_helper(val.val, 0, opts, memo)
+    code: list[inst.Instruction] = []
+    for _ in range(val.min):
+        code += _relocate(body, pc + len(code))
+
+    if val.max is None:
+        tail, l3 = compile_helper(syn.Any(val.val), pc + len(code), opts, memo)
+        return (code + tail, l3)
+
+    l3 = pc + len(code) + (val.max - val.min) * (len(body) + 1)
+    for _ in range(val.max - val.min):
+        l1 = pc + len(code) + 1
+        code.append(inst.Split(l1, l3))
+        code += _relocate(body, l1)
+    return (code, l3)
+
+@singledispatch
+def code_size(val, opts: Options) -> int:
+    '''
+    The number of instructions `compile` generates for a construction, worked out without
+    generating them.
+    '''
+    raise AssertionError(f"Unexpected type for val {val.type}")
+
+@code_size.register
+def _(_: syn.Literal | syn.WildCard, opts: Options) -> int:
+    return 1
+
+@code_size.register
+def _(val: syn.Group, opts: Options) -> int:
+    return code_size(val.expression, opts) + 2
+
+@code_size.register
+def _(val: syn.CharSet, opts: Options) -> int:
+    return len(_lower_charset(val, 0, opts))
+
+@code_size.register
+def _(val: syn.Sequence, opts: Options) -> int:
+    return sum(code_size(v, opts) for v in val.val)
+
+@code_size.register
+def _(val: syn.Alternatives, opts: Options) -> int:
+    return code_size(val.alt1, opts) + code_size(val.alt2, opts) + 2
+
+@code_size.register
+def _(val: syn.Option, opts: Options) -> int:
+    if isinstance(val.val, syn.Option | syn.Any):
+        return code_size(val.val, opts)
+    elif isinstance(val.val, syn.Some):
+        return code_size(syn.Any(val.val.val), opts)
+    return code_size(val.val, opts) + 1
+
+@code_size.register
+def _(val: syn.Some, opts: Options) -> int:
+    if isinstance(val.val, syn.Some):
+        return code_size(val.val, opts)
+    elif isinstance(val.val, syn.Option | syn.Any):
+        return code_size(syn.Any(val.val.val), opts)
+    return code_size(val.val, opts) + 1
+
+@code_size.register
+def _(val: syn.Any, opts: Options) -> int:
+    if isinstance(val.val, syn.Option | syn.Some | syn.Any):
+        return code_size(syn.Any(val.val.val), opts)
+    return code_size(val.val, opts) + 2
+
+@code_size.register
+def _(val: syn.Repeat, opts: Options) -> int:
+    body = code_size(val.val, opts)
+    if val.max is None:
+        return val.min * body + code_size(syn.Any(val.val), opts)
+    return val.min * body + (val.max - val.min) * (body + 1)
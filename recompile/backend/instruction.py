@@ -2,31 +2,42 @@ from dataclasses import dataclass
 
 """
 Instructions:
-- Save <index> <is_match>
+- Save <index> <is_match> <pattern>
 - Split <dest1> <dest2>
 - Compare <inverse> <char1> <char2>
 - Branch <dest> <char1> <char2>
+- Class <bitmap>
 """
 
+# The character value a program sees once the input has been exhausted.
+END_OF_INPUT = 0xFF
+
 class Instruction:
     """
-    Base class for regex instructions
+    Base class for regex instructions. Instructions are immutable, so equal ones can be shared,
+    see `share`.
     """
+    __slots__ = ()
+
     def code(self) -> str:
         raise AssertionError("Base class should not be used")
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Save(Instruction):
     """
     Saves the location in the input where a match begins or ends.
-    If is_match is set, then it also indicates the input matches the pattern.
+    If is_match is set, then it also indicates the input matches the pattern, and `pattern` says
+    which one for programs built from several patterns.
     """
     index: int
     is_match: bool
+    pattern: int = 0
     def code(self) -> str:
+        if self.pattern != 0:
+            return f"Save {self.index} {self.is_match} {self.pattern}"
         return f"Save {self.index} {self.is_match}"
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Split(Instruction):
     """
     Continue execution from two different locations in the program.
@@ -36,7 +47,7 @@ class Split(Instruction):
     def code(self) -> str:
         return f"Split {self.dest1} {self.dest2}"
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class AluOp(Instruction):
     """
     Jump to a given destination if the current input character is within a given range.
@@ -70,6 +81,37 @@ class AluOp(Instruction):
                     return f"Nop"
                 return f"InvBranch {self.dest} {c_min} {c_max}"
 
+@dataclass(frozen=True, slots=True)
+class ClassLookup(Instruction):
+    """
+    Consume the current input character if it is in a set of bytes, and die otherwise.
+    Bit `c` of `bitmap` is set if the set contains byte `c`.
+    """
+    bitmap: int
+    def code(self) -> str:
+        ranges = []
+        for c_min, c_max in bitmap_ranges(self.bitmap):
+            if c_min == c_max:
+                ranges.append(encode_char(c_min))
+            else:
+                ranges.append(f"{encode_char(c_min)}-{encode_char(c_max)}")
+        return f"Class {' '.join(ranges)}"
+
+def bitmap_ranges(bitmap: int) -> list[tuple[int, int]]:
+    '''
+    The runs of set bits in a class bitmap, as (first, last) pairs.
+    '''
+    ranges = []
+    c = 0
+    while c <= 0xFF:
+        if (bitmap >> c) & 1:
+            start = c
+            while c < 0xFF and (bitmap >> (c+1)) & 1:
+                c += 1
+            ranges.append((start, c))
+        c += 1
+    return ranges
+
 # Define some Pseudo Ops for convenience
 def Consume() -> Instruction:
     return AluOp(True, False, 0, 0x00, 0xFF)
@@ -99,3 +141,11 @@ def encode_char(c: int) -> str:
         return f"'{encoded}'"
     else:
         return f"%{c}"
+
+def share(code: list[Instruction]) -> list[Instruction]:
+    '''
+    The same program, with each instruction equal to an earlier one replaced by that one, so
+    that programs kept in memory only hold one copy of each distinct instruction.
+    '''
+    table: dict[Instruction, Instruction] = {}
+    return [table.setdefault(i, i) for i in code]
@@ -0,0 +1,147 @@
+from dataclasses import dataclass, replace
+
+from . import instruction as inst
+
+@dataclass
+class OptimizationStats:
+    '''
+    Instruction counts of a program before and after optimization.
+    '''
+    before: int
+    after: int
+
+def optimize(code: list[inst.Instruction]) -> tuple[list[inst.Instruction], OptimizationStats]:
+    '''
+    Run the peephole and control-flow passes over a program until none of them changes it:
+    - Jump threading: branches to a Jump go straight to its destination, and a Jump to a Split
+      becomes a copy of that Split.
+    - Splits with both destinations the same, or with one leading to a Die, become Jumps.
+    - Branches to a Die all share a single one, so the Die at the end of each inverted character
+      set can go.
+    - Jumps and Branches that lead to the next instruction anyway are removed along with
+      unreachable code, and the remaining instructions are renumbered.
+
+    Jumps are treated as unconditional, which holds for every byte of input.
+    '''
+    before = len(code)
+    # Unreachable code may jump past the end of the program, so get rid of it first.
+    code = _remove_dead_code(code)
+    while True:
+        threaded = _thread_jumps(code)
+        optimized = _remove_dead_code(threaded)
+        if optimized == code:
+            break
+        code = optimized
+    return (code, OptimizationStats(before, len(code)))
+
+def _is_jump(i: inst.Instruction) -> bool:
+    return isinstance(i, inst.AluOp) and not i.consume and not i.inverted \
+        and i.c_min == 0x00 and i.c_max == 0xFF
+
+def _is_die(i: inst.Instruction) -> bool:
+    return isinstance(i, inst.AluOp) and i.consume and i.inverted \
+        and i.c_min == 0x00 and i.c_max == 0xFF
+
+def _is_nop(i: inst.Instruction) -> bool:
+    '''
+    A non-consuming instruction that always falls through to the next one.
+    '''
+    return isinstance(i, inst.AluOp) and not i.consume and i.inverted \
+        and i.c_min == 0x00 and i.c_max == 0xFF
+
+def _resolve(code: list[inst.Instruction], pc: int) -> int:
+    '''
+    Follow a chain of Jumps and Nops to the first instruction that does something.
+    '''
+    visited = set()
+    while pc not in visited:
+        visited.add(pc)
+        i = code[pc]
+        if _is_jump(i):
+            pc = i.dest
+        elif _is_nop(i):
+            pc = pc+1
+        else:
+            break
+    return pc
+
+def _thread_jumps(code: list[inst.Instruction]) -> list[inst.Instruction]:
+    # Every Die is the same, so branches to one can all share the first.
+    first_die = next((pc for pc, i in enumerate(code) if _is_die(i)), None)
+    threaded: list[inst.Instruction] = []
+    for pc, i in enumerate(code):
+        if isinstance(i, inst.Split):
+            dest1 = _resolve(code, i.dest1)
+            dest2 = _resolve(code, i.dest2)
+            if dest1 == dest2 or _is_die(code[dest2]):
+                i = inst.Jump(dest1)
+            elif _is_die(code[dest1]):
+                i = inst.Jump(dest2)
+            else:
+                i = inst.Split(dest1, dest2)
+        elif isinstance(i, inst.AluOp) and not i.consume and not _is_nop(i):
+            dest = _resolve(code, i.dest)
+            target = code[dest]
+            if _is_jump(i) and isinstance(target, inst.Split):
+                i = target
+            elif _is_jump(i) and _is_die(target):
+                i = target
+            elif dest == _resolve(code, pc+1):
+                # Both outcomes of the Branch end up in the same place.
+                i = inst.AluOp(False, True, 0, 0x00, 0xFF)
+            else:
+                i = replace(i, dest=first_die if _is_die(target) else dest)
+        threaded.append(i)
+    return threaded
+
+def _successors(code: list[inst.Instruction], pc: int) -> list[int]:
+    i = code[pc]
+    if isinstance(i, inst.Save):
+        return [] if i.is_match else [pc+1]
+    elif isinstance(i, inst.Split):
+        return [i.dest1, i.dest2]
+    elif isinstance(i, inst.ClassLookup):
+        return [pc+1]
+    elif isinstance(i, inst.AluOp):
+        if _is_die(i):
+            return []
+        elif _is_jump(i):
+            return [i.dest]
+        elif i.consume or _is_nop(i):
+            return [pc+1]
+        return [i.dest, pc+1]
+    raise AssertionError(f"{i} is not a recognized instruction!")
+
+def _remove_dead_code(code: list[inst.Instruction]) -> list[inst.Instruction]:
+    reachable = [False] * len(code)
+    stack = [0]
+    while stack:
+        pc = stack.pop()
+        if reachable[pc]:
+            continue
+        reachable[pc] = True
+        stack += _successors(code, pc)
+
+    # Instructions that only fall through to the next one can go as well. Anything jumping to
+    # a removed instruction is sent to the instruction that follows it instead.
+    keep = [
+        reachable[pc] and not _is_nop(i) and not (_is_jump(i) and i.dest == pc+1)
+        for pc, i in enumerate(code)
+    ]
+    new_pc = [0] * (len(code) + 1)
+    new_pc[len(code)] = sum(keep)
+    for pc in reversed(range(len(code))):
+        new_pc[pc] = new_pc[pc+1] - int(keep[pc])
+    # new_pc[pc] now counts the kept instructions before pc, which is where pc (or whatever
+    # follows it) ends up.
+
+    optimized: list[inst.Instruction] = []
+    for pc, i in enumerate(code):
+        if not keep[pc]:
+            continue
+        if isinstance(i, inst.Split):
+            i = inst.Split(new_pc[i.dest1], new_pc[i.dest2])
+        elif isinstance(i, inst.AluOp) and not i.consume:
+            i = replace(i, dest=new_pc[i.dest])
+        optimized.append(i)
+    return optimized
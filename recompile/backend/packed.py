@@ -0,0 +1,170 @@
+from array import array
+from collections import OrderedDict
+import json
+import mmap
+import struct
+
+from . import assembler, instruction as inst
+from .assembler import Opcode
+
+# Bits of PackedProgram.flags
+INVERTED = 0b001
+CONSUME = 0b010
+MATCH = 0b100
+
+# Number of packed programs `pack` keeps for the instruction lists it has seen.
+MAX_PACKED = 256
+
+class PackedProgram:
+    '''
+    A program stored as the 32-bit words defined in assembler.py, together with parallel arrays
+    of the fields decoded from each word, so that engines can run it without creating a Python
+    object per instruction.
+
+    `dest` holds the destination of a Branch or the first destination of a Split, `dest2` the
+    second destination of a Split, and `index`/`pattern` the fields of a Save. Class
+    instructions are flagged as consuming, and their bitmaps are kept in `bitmaps` by pc.
+
+    `data` is the program's binary, big-endian as compiler.compile_bin writes it. It isn't
+    copied, so a program loaded from an mmap reads its words straight from the file.
+    '''
+    def __init__(self, data: bytes | bytearray | memoryview | mmap.mmap):
+        assert len(data) % 4 == 0, f"A program is made of 4 byte words, got {len(data)} bytes"
+        self.data = memoryview(data).cast('B')
+        self.opcode = array('B')
+        self.flags = array('B')
+        self.dest = array('H')
+        self.dest2 = array('H')
+        self.c_min = array('B')
+        self.c_max = array('B')
+        self.index = array('B')
+        self.pattern = array('H')
+        self.bitmaps: dict[int, int] = {}
+        self._decode()
+
+    @classmethod
+    def from_instructions(cls, code: list[inst.Instruction]) -> 'PackedProgram':
+        words = assembler.assemble_program(code)
+        return cls(struct.pack(f'>{len(words)}I', *words))
+
+    @classmethod
+    def from_bytes(cls, data: bytes | bytearray | memoryview | mmap.mmap) -> 'PackedProgram':
+        '''
+        Load the output of compiler.compile_bin, without copying it.
+        '''
+        return cls(data)
+
+    @property
+    def words(self) -> array:
+        '''
+        Every word of the program, tables included, as native integers.
+        '''
+        return array('I', (word for word, in struct.iter_unpack('>I', self.data)))
+
+    def __len__(self) -> int:
+        return self.code_length
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.data)
+
+    def instructions(self) -> list[inst.Instruction]:
+        return assembler.disassemble_program(self.words)
+
+    def slot_count(self) -> int:
+        '''
+        The number of save slots the program uses.
+        '''
+        return max((self.index[pc] + 1 for pc in range(len(self))
+                    if self.opcode[pc] == Opcode.Save), default=0)
+
+    def _decode(self):
+        # The fields are read straight from the bits of each word, see assembler.py.
+        self.code_length = len(self.data) // 4
+        for pc, (word,) in enumerate(struct.iter_unpack('>I', self.data)):
+            if pc == self.code_length:
+                break
+            opcode = word >> assembler._opcode_shift
+            flags = dest = dest2 = c_min = c_max = index = pattern = 0
+            if opcode == Opcode.Branch:
+                flags = ((word >> assembler._inverted_shift) & 1) * INVERTED \
+                    | ((word >> assembler._consume_shift) & 1) * CONSUME
+                dest = (word >> assembler._dest_shift) & 0xFFF
+                c_min = (word >> assembler._char_min_shift) & 0xFF
+                c_max = (word >> assembler._char_max_shift) & 0xFF
+            elif opcode == Opcode.Split:
+                dest = (word >> assembler._dest1_shift) & 0xFFF
+                dest2 = (word >> assembler._dest2_shift) & 0xFFF
+            elif opcode == Opcode.Save:
+                flags = ((word >> assembler._match_shift) & 1) * MATCH
+                index = (word >> assembler._save_index_shift) & 0x3F
+                pattern = (word >> assembler._pattern_shift) & 0xFFFF
+            else:
+                flags = CONSUME
+                address = (word >> assembler._table_shift) & 0xFFFF
+                # Tables come after the code, and the first one right after it.
+                self.code_length = min(self.code_length, address)
+                table = struct.unpack_from(f'>{assembler.TABLE_WORDS}I', self.data, 4 * address)
+                self.bitmaps[pc] = sum(w << (32 * k) for k, w in enumerate(table))
+            self.opcode.append(opcode)
+            self.flags.append(flags)
+            self.dest.append(dest)
+            self.dest2.append(dest2)
+            self.c_min.append(c_min)
+            self.c_max.append(c_max)
+            self.index.append(index)
+            self.pattern.append(pattern)
+
+# Anything the engines can run.
+Program = list[inst.Instruction] | PackedProgram
+
+_packed: OrderedDict[tuple[inst.Instruction, ...], PackedProgram] = OrderedDict()
+
+def pack(program: Program) -> PackedProgram:
+    '''
+    The packed form of a program. Instruction lists are only packed the first time they're seen,
+    so searching with the list compiler.compile_regex returns doesn't pack it every time.
+    '''
+    if isinstance(program, PackedProgram):
+        return program
+    key = tuple(program)
+    found = _packed.get(key)
+    if found is not None:
+        _packed.move_to_end(key)
+        return found
+    found = _packed[key] = PackedProgram.from_instructions(program)
+    while len(_packed) > MAX_PACKED:
+        _packed.popitem(last=False)
+    return found
+
+def load(path: str) -> PackedProgram:
+    '''
+    Load a program written by compiler.compile_bin (or `recompiler`) from a file. The file is
+    mapped into memory rather than read, and stays mapped as long as the program is used.
+    '''
+    with open(path, 'rb') as f:
+        if f.seek(0, 2) == 0:
+            return PackedProgram(b'')
+        return PackedProgram.from_bytes(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+def patterns_path(path: str) -> str:
+    '''
+    Where the patterns of a program built by compiler.compile_multi_bin are kept, next to its
+    binary at `path`.
+    '''
+    return path + '.json'
+
+def save_patterns(path: str, patterns: list[str]):
+    '''
+    Record the pattern each match ID of the binary at `path` stands for, see `load_multi`.
+    '''
+    with open(patterns_path(path), 'w') as f:
+        json.dump({'patterns': patterns}, f)
+
+def load_multi(path: str) -> tuple[PackedProgram, list[str]]:
+    '''
+    Load a program written by compiler.compile_multi_bin (or `recompiler --multi`), along with
+    its patterns: the match IDs runner.search_multi returns index into them.
+    '''
+    with open(patterns_path(path), 'r') as f:
+        patterns = json.load(f)['patterns']
+    return (load(path), patterns)
@@ -0,0 +1,232 @@
+'''
+Compiles programs to Python functions that search like the Pike VM, with the program built in.
+
+Every pc that threads can wait at (pc 0 and the pc after each consuming instruction), and every
+pc that can be reached from more than one place, becomes a nested function. Each function checks
+whether its pc already ran at this position, then runs its instruction and the single-entry
+instructions that follow it as straight-line code. Split destinations are called (or inlined) in
+the order runner.pike_step visits them. Comparisons use the program's ranges as constants, so
+searching doesn't decode or dispatch on any instruction.
+
+Each non-consuming instruction can add a call to the Python stack, so programs with too many of
+them would hit the recursion limit. Those are generated like runner.pike_step instead: functions
+push the functions to run next onto a stack that the search loop empties, and a Split pushes its
+first destination (which becomes a function too) and carries on with its second. That's slower,
+but never recurses.
+
+The generated source is compiled once per program and cached in memory. With a directory, the
+code object is also stored there with `marshal`, so other processes running the same version of
+Python can load it without generating the source again. Stored code is named after the program
+and GENERATOR_VERSION.
+'''
+from collections import OrderedDict
+from collections.abc import Callable, Iterable
+import hashlib
+import importlib.util
+import marshal
+import os
+
+from . import instruction as inst, packed
+from .assembler import Opcode
+
+# Signature of a generated search: character codes in, span of the longest match out.
+Matcher = Callable[[Iterable[int]], tuple[int, int] | None]
+
+# Python limits how deeply blocks can be nested, so deeper code is split into another function.
+_MAX_DEPTH = 32
+
+# Programs with more non-consuming instructions than this follow them with a stack, not calls.
+MAX_RECURSION = 200
+
+# Number of compiled matchers kept in memory.
+MAX_CACHED = 256
+
+# Part of the name of stored code, so that code from older generators isn't loaded. Bump it
+# whenever the generated source changes.
+GENERATOR_VERSION = 3
+
+_matchers: OrderedDict[bytes, Matcher] = OrderedDict()
+
+class _Generator:
+    def __init__(self, program: packed.PackedProgram):
+        self.program = program
+        n = len(program)
+        entries = {0}
+        predecessors = [0] * n
+        # Nested calls each run a different non-consuming instruction, as pcs only run once per
+        # position, so this bounds how deep they go.
+        non_consuming = sum(1 for pc in range(n) if not program.flags[pc] & packed.CONSUME)
+        self.recursive = non_consuming <= MAX_RECURSION
+        for pc in range(n):
+            op = program.opcode[pc]
+            if program.flags[pc] & packed.CONSUME:
+                if pc + 1 < n:
+                    entries.add(pc + 1)
+            elif op == Opcode.Split:
+                if not self.recursive:
+                    entries.add(program.dest[pc])
+                predecessors[program.dest[pc]] += 1
+                predecessors[program.dest2[pc]] += 1
+            elif op == Opcode.Branch:
+                predecessors[program.dest[pc]] += 1
+                predecessors[pc + 1] += 1
+            elif op == Opcode.Save and not program.flags[pc] & packed.MATCH:
+                predecessors[pc + 1] += 1
+        self.functions = entries | {pc for pc in range(n) if predecessors[pc] > 1}
+        self.saves_count = 0
+
+    def source(self) -> str:
+        program = self.program
+        lines = [
+            f"def search(codes):",
+            f"    best = None",
+            f"    seen = [-1] * {len(program)}",
+            f"    nxt = []",
+        ]
+        # Runs everything the functions on the stack lead to, once a thread's function returns.
+        run_stack = []
+        if not self.recursive:
+            lines += [
+                f"    stack = []",
+                f"    push = stack.append",
+                f"    pop = stack.pop",
+            ]
+            run_stack = [
+                f"    while stack:",
+                f"        f, s = pop()",
+                f"        f(c, sc, s)",
+            ]
+        done: set[int] = set()
+        while self.functions - done:
+            pc = min(self.functions - done)
+            done.add(pc)
+            lines += [
+                f"    def p{pc}(c, sc, saves):",
+                f"        nonlocal best",
+                f"        if seen[{pc}] == sc:",
+                f"            return",
+                f"        seen[{pc}] = sc",
+            ]
+            lines += self.block(pc, 'saves', 2, inline=True)
+        unset = (-1,) * program.slot_count()
+        lines += [
+            f"    threads = [(p0, {unset!r})]",
+            f"    sc = 0",
+            f"    for c in codes:",
+            f"        nxt = []",
+            f"        for f, saves in threads:",
+            f"            f(c, sc, saves)",
+            *['        ' + line for line in run_stack],
+            f"        threads = nxt",
+            f"        sc += 1",
+            f"        if not threads:",
+            f"            break",
+            f"    # Nothing is consumed at the end of the input, so the next threads are dropped.",
+            f"    # They mustn't go on the list being run, or they'd run again.",
+            f"    nxt = []",
+            f"    c = {inst.END_OF_INPUT}",
+            f"    for f, saves in threads:",
+            f"        f(c, sc, saves)",
+            *['    ' + line for line in run_stack],
+            f"    return best",
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def block(self, pc: int, saves: str, depth: int, inline: bool = False) -> list[str]:
+        '''
+        The statements that run the instruction at `pc`, indented `depth` levels. Functions they
+        push run after the function they're in returns, the last one pushed first.
+        '''
+        pad = '    ' * depth
+        if (pc in self.functions and not inline) or depth > _MAX_DEPTH:
+            self.functions.add(pc)
+            if self.recursive:
+                return [f"{pad}p{pc}(c, sc, {saves})"]
+            return [f"{pad}push((p{pc}, {saves}))"]
+
+        program = self.program
+        op = program.opcode[pc]
+        flags = program.flags[pc]
+        if op == Opcode.Branch:
+            c_min, c_max = program.c_min[pc], program.c_max[pc]
+            test = f"{c_min} <= c <= {c_max}"
+            if flags & packed.INVERTED:
+                test = f"not {test}"
+            if flags & packed.CONSUME:
+                return [f"{pad}if {test}:",
+                        f"{pad}    nxt.append((p{pc+1}, {saves}))"]
+            return [f"{pad}if {test}:",
+                    *self.block(program.dest[pc], saves, depth + 1),
+                    f"{pad}else:",
+                    *self.block(pc + 1, saves, depth + 1)]
+        elif op == Opcode.Class:
+            return [f"{pad}if c <= 255 and ({program.bitmaps[pc]:#x} >> c) & 1:",
+                    f"{pad}    nxt.append((p{pc+1}, {saves}))"]
+        elif op == Opcode.Split:
+            if self.recursive:
+                return self.block(program.dest2[pc], saves, depth) \
+                    + self.block(program.dest[pc], saves, depth)
+            # The first destination runs once everything the second one leads to has.
+            return [f"{pad}push((p{program.dest[pc]}, {saves}))",
+                    *self.block(program.dest2[pc], saves, depth)]
+        elif op == Opcode.Save:
+            index = program.index[pc]
+            if flags & packed.MATCH:
+                return [f"{pad}start = {saves}[{index - 1}]",
+                        f"{pad}if best is None or best[1] - best[0] < sc - start:",
+                        f"{pad}    best = (start, sc)"]
+            # Each Save gets its own name, so that other paths still see the old slots.
+            self.saves_count += 1
+            name = f"s{self.saves_count}"
+            return [f"{pad}{name} = {saves}[:{index}] + (sc,) + {saves}[{index + 1}:]",
+                    *self.block(pc + 1, name, depth)]
+        raise AssertionError(f"Opcode {op} at {pc} is not recognized!")
+
+def source(program: packed.Program) -> str:
+    '''
+    Generate the source of a module defining `search(codes)`, which returns the (start, end)
+    offsets of the longest match in a sequence of character codes like runner.search_span.
+    '''
+    return _Generator(packed.pack(program)).source()
+
+def _compile(program: packed.PackedProgram, binary: bytes, directory: str | None):
+    path = None
+    if directory is not None:
+        key = hashlib.sha256(GENERATOR_VERSION.to_bytes(4) + binary).hexdigest()
+        path = os.path.join(directory, f"{key}.marshal")
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            if data.startswith(importlib.util.MAGIC_NUMBER):
+                return marshal.loads(data[len(importlib.util.MAGIC_NUMBER):])
+        except (OSError, EOFError, ValueError, TypeError):
+            pass
+
+    code = compile(source(program), '<specialized program>', 'exec')
+    if path is not None:
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file first so that a concurrent reader never sees half of it.
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(importlib.util.MAGIC_NUMBER + marshal.dumps(code))
+        os.replace(tmp_path, path)
+    return code
+
+def matcher(program: packed.Program, directory: str | None = None) -> Matcher:
+    '''
+    Get the specialized search function of a program, compiling it if it hasn't been already.
+    '''
+    program = packed.pack(program)
+    binary = program.to_bytes()
+    found = _matchers.get(binary)
+    if found is not None:
+        _matchers.move_to_end(binary)
+        return found
+
+    namespace: dict = {}
+    exec(_compile(program, binary, directory), namespace)
+    found = namespace['search']
+    _matchers[binary] = found
+    while len(_matchers) > MAX_CACHED:
+        _matchers.popitem(last=False)
+    return found
@@ -0,0 +1,97 @@
+'''
+A bit-state backtracker, for searching short inputs.
+
+The program is run depth first, trying the second destination of each Split before the first
+like the Pike VM does, and a bitmap records every (pc, position) pair that has been visited. The
+first path to reach a pair at a position is the same thread that the Pike VM keeps when it merges
+threads there, so the backtracker finds exactly the matches the Pike VM finds, and visits each
+pair at most once: O(len(program) * len(input)) time, like the Pike VM, but with much less work
+per step. The bitmap takes len(program) * (len(input) + 1) bits, which is why this is only used
+when that fits in MAX_BITMAP_BITS.
+
+Save slots live in one list that is updated in place. Every Save pushes the slot's old value
+onto the stack, so that it is put back when the search backtracks past the Save.
+'''
+from .backend import instruction as inst, packed
+from .backend.assembler import Opcode
+
+# Plain ints, which compare faster than the enum members in the inner loop.
+BRANCH, SPLIT, SAVE, CLASS = (int(op) for op in (Opcode.Branch, Opcode.Split, Opcode.Save,
+                                                  Opcode.Class))
+
+# The largest visited bitmap the runner will allocate, 32 KiB.
+MAX_BITMAP_BITS = 1 << 18
+
+def fits(program: packed.PackedProgram, length: int,
+         max_bits: int = MAX_BITMAP_BITS) -> bool:
+    '''
+    Whether the visited bitmap for searching `length` characters is small enough.
+    '''
+    return len(program) * (length + 1) <= max_bits
+
+def search_span(data, program: packed.Program) -> tuple[int, int] | None:
+    '''
+    Return the (start, end) offsets of the longest match in a string or bytes-like object, or
+    None if nothing matched. Ties go to the match that starts first, as in runner.search.
+    '''
+    program = packed.pack(program)
+    opcode = program.opcode
+    flags = program.flags
+    c_min = program.c_min
+    c_max = program.c_max
+    dest = program.dest
+    n = len(data)
+    width = n + 1
+    codes = list(map(ord, data)) if isinstance(data, str) else data
+    visited = bytearray((len(program) * width + 7) // 8)
+    slots = [-1] * program.slot_count()
+    best: tuple[int, int] | None = None
+
+    # Entries are either (pc, position) to explore, or (~slot, value) to restore a slot.
+    stack = [(0, 0)]
+    while stack:
+        pc, pos = stack.pop()
+        if pc < 0:
+            slots[~pc] = pos
+            continue
+
+        while True:
+            bit = pc * width + pos
+            if visited[bit >> 3] & (1 << (bit & 7)):
+                break
+            visited[bit >> 3] |= 1 << (bit & 7)
+
+            op = opcode[pc]
+            if op == BRANCH:
+                c = codes[pos] if pos < n else inst.END_OF_INPUT
+                is_match = (c_min[pc] <= c <= c_max[pc]) != bool(flags[pc] & packed.INVERTED)
+                if flags[pc] & packed.CONSUME:
+                    # Nothing can be consumed once the input is exhausted
+                    if not is_match or pos == n:
+                        break
+                    pc += 1
+                    pos += 1
+                else:
+                    pc = dest[pc] if is_match else pc+1
+            elif op == SPLIT:
+                stack.append((dest[pc], pos))
+                pc = program.dest2[pc]
+            elif op == CLASS:
+                if pos == n or codes[pos] > 0xFF or not (program.bitmaps[pc] >> codes[pos]) & 1:
+                    break
+                pc += 1
+                pos += 1
+            elif op == SAVE:
+                index = program.index[pc]
+                if flags[pc] & packed.MATCH:
+                    start = slots[index-1]
+                    if best is None or pos - start > best[1] - best[0] \
+                            or (pos - start == best[1] - best[0] and start < best[0]):
+                        best = (start, pos)
+                    break
+                stack.append((~index, slots[index]))
+                slots[index] = pos
+                pc += 1
+            else:
+                raise AssertionError(f"Opcode {op} at {pc} is not recognized!")
+    return best
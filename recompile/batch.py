@@ -0,0 +1,164 @@
+'''
+Search many short inputs at once with NumPy.
+
+All records are stepped through the program together: the threads of every record live in one
+(records x pcs) array, and each instruction is applied to a whole column of that array at once.
+This module needs the optional `numpy` dependency.
+'''
+from collections.abc import Sequence
+
+import numpy as np
+
+from .backend import instruction as inst, packed
+from .backend.assembler import Opcode
+
+# Start offset of a thread that doesn't exist.
+_DEAD = np.iinfo(np.int64).max
+# Start offset of a thread that hasn't reached a Save yet.
+_UNSET = -1
+
+def to_matrix(records: Sequence[str | bytes]) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Pack records into a zero-padded uint8 matrix with one row per record.
+    Returns the matrix and the length of each record. Strings must be encodable as latin-1.
+    '''
+    encoded = [r.encode('latin-1') if isinstance(r, str) else bytes(r) for r in records]
+    lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+    width = int(lengths.max()) if len(encoded) else 0
+    matrix = np.zeros((len(encoded), width), dtype=np.uint8)
+    for row, data in enumerate(encoded):
+        matrix[row, :len(data)] = np.frombuffer(data, dtype=np.uint8)
+    return (matrix, lengths)
+
+def accept_table(program: packed.PackedProgram) -> np.ndarray:
+    '''
+    Build a (pcs x 256) table that says whether the Branch or Class at each pc accepts each
+    byte, from the c_min/c_max ranges and inverted flags of the packed program and the bitmaps
+    of its classes. Rows for other instructions are all False.
+    '''
+    chars = np.arange(256)
+    c_min = np.frombuffer(program.c_min, dtype=np.uint8)[:, None]
+    c_max = np.frombuffer(program.c_max, dtype=np.uint8)[:, None]
+    flags = np.frombuffer(program.flags, dtype=np.uint8)
+    is_branch = np.frombuffer(program.opcode, dtype=np.uint8) == Opcode.Branch
+    inverted = (flags & packed.INVERTED).astype(bool)[:, None]
+    in_range = (chars >= c_min) & (chars <= c_max)
+    table = (in_range != inverted) & is_branch[:, None]
+    for pc, bitmap in program.bitmaps.items():
+        table[pc] = [(bitmap >> c) & 1 for c in range(256)]
+    return table
+
+def search_batch(
+        records: Sequence[str | bytes] | np.ndarray,
+        program: packed.Program,
+        lengths: np.ndarray | None = None
+) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Find the longest match of a program in every record.
+
+    `records` is either a sequence of strings/bytes or a padded uint8 matrix with one record per
+    row, in which case `lengths` gives the length of each row (the full width by default).
+    Returns arrays of the start and end offset of each record's match, both -1 where a record
+    doesn't match. Like runner.search, ties are broken in favour of the earliest start.
+
+    Only the most recent Save is tracked for each thread, so programs should contain a single
+    capture group, as the ones built by compiler.compile_regex do.
+    '''
+    if isinstance(records, np.ndarray):
+        matrix = records.astype(np.uint8, copy=False)
+        if lengths is None:
+            lengths = np.full(matrix.shape[0], matrix.shape[1], dtype=np.int64)
+    else:
+        assert lengths is None, "Lengths are only used with a padded matrix"
+        matrix, lengths = to_matrix(records)
+
+    program = packed.pack(program)
+    record_count, width = matrix.shape
+    pc_count = len(program)
+    table = accept_table(program)
+    best_start = np.full(record_count, -1, dtype=np.int64)
+    best_len = np.full(record_count, -1, dtype=np.int64)
+
+    # Start offsets of the threads waiting at each pc, _DEAD where there's no thread.
+    threads = np.full((record_count, pc_count), _DEAD, dtype=np.int64)
+    threads[:, 0] = _UNSET
+
+    for sc in range(width + 1):
+        live = sc <= lengths
+        if not live.any():
+            break
+        at_end = sc >= lengths
+        column = matrix[:, sc] if sc < width else np.zeros(record_count, dtype=np.uint8)
+        chars = np.where(at_end, inst.END_OF_INPUT, column)
+
+        _close(program, table, threads, chars, sc, best_start, best_len)
+
+        # Step every consuming AluOp and Class over the current character.
+        next_threads = np.full_like(threads, _DEAD)
+        for pc in range(pc_count):
+            if program.flags[pc] & packed.CONSUME:
+                accepted = table[pc, chars] & ~at_end
+                next_threads[:, pc+1] = np.where(accepted, threads[:, pc], _DEAD)
+        threads = next_threads
+
+    found = best_len >= 0
+    ends = np.where(found, best_start + best_len, -1)
+    return (best_start, ends)
+
+def _close(
+        program: packed.PackedProgram,
+        table: np.ndarray,
+        threads: np.ndarray,
+        chars: np.ndarray,
+        sc: int,
+        best_start: np.ndarray,
+        best_len: np.ndarray
+):
+    '''
+    Follow Splits, Saves and non-consuming AluOps in place until no thread can move any further,
+    keeping the earliest start when threads meet at the same pc, then record the threads that
+    reached a matching Save.
+    '''
+    changed = True
+    while changed:
+        changed = False
+        for pc in range(len(program)):
+            starts = threads[:, pc]
+            alive = starts != _DEAD
+            if not alive.any():
+                continue
+
+            op = program.opcode[pc]
+            flags = program.flags[pc]
+            if op == Opcode.Save:
+                if flags & packed.MATCH:
+                    continue
+                targets = [(pc+1, np.where(alive, sc, _DEAD))]
+            elif op == Opcode.Split:
+                targets = [(program.dest[pc], starts), (program.dest2[pc], starts)]
+            elif op == Opcode.Class:
+                continue
+            elif op == Opcode.Branch:
+                if flags & packed.CONSUME:
+                    continue
+                taken = table[pc, chars]
+                targets = [
+                    (program.dest[pc], np.where(taken, starts, _DEAD)),
+                    (pc+1, np.where(taken, _DEAD, starts))
+                ]
+            else:
+                raise AssertionError(f"Opcode {op} at {pc} is not recognized!")
+
+            for dest, moved in targets:
+                merged = np.minimum(threads[:, dest], moved)
+                if (merged != threads[:, dest]).any():
+                    threads[:, dest] = merged
+                    changed = True
+
+    for pc in range(len(program)):
+        if program.opcode[pc] == Opcode.Save and program.flags[pc] & packed.MATCH:
+            starts = threads[:, pc]
+            length = np.where((starts != _DEAD) & (starts >= 0), sc - starts, -1)
+            better = length > best_len
+            best_len[better] = length[better]
+            best_start[better] = starts[better]
@@ -0,0 +1,70 @@
+'''
+Deterministic input text for benchmarks, in the spirit of the input of mariomka/regex-benchmark:
+mostly prose, with emails, URIs and IP addresses (valid and not) mixed in.
+'''
+import hashlib
+import random
+
+_words = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut "
+    "labore et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris "
+    "nisi aliquip ex ea commodo consequat duis aute irure in reprehenderit voluptate velit esse "
+    "cillum fugiat nulla pariatur excepteur sint occaecat cupidatat non proident sunt culpa qui "
+    "officia deserunt mollit anim id est laborum"
+).split()
+_tlds = ["com", "org", "net", "io", "co.uk"]
+_schemes = ["http", "https", "ftp"]
+
+def generate(size: int, seed: int = 0) -> str:
+    '''
+    Generate `size` characters of ASCII text. The same size and seed always give the same text.
+    '''
+    rng = random.Random(seed)
+    parts: list[str] = []
+    length = 0
+    while length < size:
+        part = _line(rng)
+        parts.append(part)
+        length += len(part)
+    return ''.join(parts)[:size]
+
+def load(path: str) -> str:
+    with open(path, 'r', encoding='latin-1') as f:
+        return f.read()
+
+def digest(text: str) -> str:
+    '''
+    A short fingerprint of a corpus, so that results from different corpora aren't compared.
+    '''
+    return hashlib.sha256(text.encode('latin-1')).hexdigest()[:16]
+
+def _line(rng: random.Random) -> str:
+    words = [rng.choice(_words) for _ in range(rng.randint(4, 16))]
+    # Roughly one line in four mentions something the benchmark patterns look for.
+    roll = rng.random()
+    if roll < 0.08:
+        words.insert(rng.randrange(len(words)), _email(rng))
+    elif roll < 0.16:
+        words.insert(rng.randrange(len(words)), _uri(rng))
+    elif roll < 0.25:
+        words.insert(rng.randrange(len(words)), _ipv4(rng))
+    return ' '.join(words) + '\n'
+
+def _name(rng: random.Random) -> str:
+    return '.'.join(rng.choice(_words) for _ in range(rng.randint(1, 2)))
+
+def _email(rng: random.Random) -> str:
+    return f"{_name(rng)}{rng.choice(['', '+news', '-1'])}@{_name(rng)}.{rng.choice(_tlds)}"
+
+def _uri(rng: random.Random) -> str:
+    uri = f"{rng.choice(_schemes)}://www.{rng.choice(_words)}.{rng.choice(_tlds)}"
+    uri += ''.join('/' + rng.choice(_words) for _ in range(rng.randint(0, 3)))
+    if rng.random() < 0.3:
+        uri += f"?q={rng.choice(_words)}&page={rng.randint(1, 99)}"
+    if rng.random() < 0.2:
+        uri += f"#{rng.choice(_words)}"
+    return uri
+
+def _ipv4(rng: random.Random) -> str:
+    # Some octets are out of range so that not every address is valid.
+    return '.'.join(str(rng.randint(0, 299)) for _ in range(4))
@@ -0,0 +1,217 @@
+'''
+Benchmarks for the compiler and the search engines, with Python's `re` as a baseline.
+Run them with `recompiler bench`, see `main`.
+'''
+import argparse
+from dataclasses import asdict, dataclass
+import json
+import platform
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+
+from .. import compiler, runner
+from . import corpus
+
+# The patterns from mariomka/regex-benchmark.
+PATTERNS = {
+    'email': r"[\w.+-]+@[\w.-]+\.[\w.-]+",
+    'uri': r"[\w]+://[^/\s?#]+[^\s?#]+(\?[^\s#]*)?(#[^\s]*)?",
+    'ipv4': r"((25[0-5]|2[0-4][0-9]|[01]?[0-9]?[0-9])\.){3}(25[0-5]|2[0-4][0-9]|[01]?[0-9]?[0-9])",
+}
+
+# Every engine, with and without a prefilter, the DFA with a reverse program, and `re` as the
+# baseline.
+ENGINES = runner.ENGINES + tuple(f"{engine}+prefilter" for engine in runner.ENGINES) \
+    + ('dfa+reverse', 're')
+
+# Bump when the layout of the JSON report changes.
+REPORT_VERSION = 1
+
+@dataclass
+class Timing:
+    min_ms: float
+    median_ms: float
+
+@dataclass
+class SearchResult:
+    seconds: float
+    mb_per_s: float
+    # Peak bytes allocated while searching the first `memory_sample` characters of the corpus.
+    peak_memory: int
+    # The longest match, or None if there isn't one.
+    span: tuple[int, int] | None
+
+@dataclass
+class PatternResult:
+    name: str
+    regex: str
+    # Program sizes: unoptimized, optimized, and optimized with class tables.
+    instructions: dict[str, int]
+    compile: dict[str, Timing]
+    search: dict[str, SearchResult]
+
+@dataclass
+class Report:
+    version: int
+    python: str
+    corpus_size: int
+    corpus_digest: str
+    memory_sample: int
+    patterns: list[PatternResult]
+
+def run(text: str, patterns: dict[str, str] = PATTERNS, engines: tuple[str, ...] = ENGINES,
+        repeat: int = 5, memory_sample: int = 1 << 14) -> Report:
+    '''
+    Benchmark compiling each pattern `repeat` times from a cold cache, and searching `text`
+    with each engine.
+    '''
+    data = text.encode('latin-1')
+    results = [_run_pattern(name, regex, text, data, engines, repeat, memory_sample)
+               for name, regex in patterns.items()]
+    return Report(REPORT_VERSION, platform.python_version(), len(text), corpus.digest(text),
+                  memory_sample, results)
+
+def _run_pattern(name: str, regex: str, text: str, data: bytes, engines: tuple[str, ...],
+                 repeat: int, memory_sample: int) -> PatternResult:
+    instructions = {
+        'unoptimized': len(compiler.compile_regex(regex, optimize=False)),
+        'optimized': len(compiler.compile_regex(regex)),
+        'class_table': len(compiler.compile_regex(regex, class_table=True)),
+    }
+    timings = {
+        'compile_regex': _time_compile(lambda: compiler.compile_regex(regex), repeat),
+        'compile_bin': _time_compile(lambda: compiler.compile_bin(regex), repeat),
+    }
+    search = {engine: _run_search(engine, regex, text, data, memory_sample)
+              for engine in engines}
+    return PatternResult(name, regex, instructions, timings, search)
+
+def _time_compile(compile, repeat: int) -> Timing:
+    times = []
+    for _ in range(repeat):
+        compiler.clear_cache()
+        start = time.perf_counter()
+        compile()
+        times.append((time.perf_counter() - start) * 1000)
+    return Timing(min(times), statistics.median(times))
+
+def _searcher(engine: str, regex: str):
+    '''
+    Build a function that returns the span of the longest match of `regex` in the corpus, given
+    as both a string and the same text encoded as bytes.
+    '''
+    if engine == 're':
+        pattern = re.compile(regex)
+        def search_re(text: str, _: bytes) -> tuple[int, int] | None:
+            spans = (m.span() for m in pattern.finditer(text))
+            return max(spans, key=lambda span: (span[1] - span[0], -span[0]), default=None)
+        return search_re
+
+    engine, _, option = engine.partition('+')
+    if engine not in runner.ENGINES or option not in ('', 'prefilter', 'reverse'):
+        raise ValueError(f"Unknown engine '{engine}', expected one of {ENGINES}")
+    program = compiler.compile_regex(regex)
+    prefilter = compiler.compile_prefilter(regex) if option == 'prefilter' else None
+    reverse = compiler.compile_reverse(regex) if option == 'reverse' else None
+    def search(_: str, data: bytes) -> tuple[int, int] | None:
+        return runner.search_bytes(data, program, engine, prefilter=prefilter, reverse=reverse)
+    return search
+
+def _run_search(engine: str, regex: str, text: str, data: bytes,
+                memory_sample: int) -> SearchResult:
+    search = _searcher(engine, regex)
+    start = time.perf_counter()
+    span = search(text, data)
+    seconds = time.perf_counter() - start
+
+    # Tracing allocations slows everything down, so memory is measured in a separate run over
+    # a sample of the corpus.
+    tracemalloc.start()
+    try:
+        search(text[:memory_sample], data[:memory_sample])
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return SearchResult(seconds, len(text) / seconds / 1e6 if seconds else 0.0, peak, span)
+
+def compare(old: dict, new: dict, tolerance: float = 0.1) -> list[str]:
+    '''
+    Compare two JSON reports and describe everything that got worse by more than `tolerance`
+    (a fraction): lower search throughput, slower compiles and bigger programs.
+    '''
+    regressions = []
+    old_patterns = {p['name']: p for p in old['patterns']}
+    for pattern in new['patterns']:
+        name = pattern['name']
+        before = old_patterns.get(name)
+        if before is None:
+            continue
+        for engine, result in pattern['search'].items():
+            if engine not in before['search']:
+                continue
+            old_speed = before['search'][engine]['mb_per_s']
+            if result['mb_per_s'] < old_speed * (1 - tolerance):
+                regressions.append(f"{name} {engine}: {old_speed:.3f} -> "
+                                   f"{result['mb_per_s']:.3f} MB/s")
+        for step, timing in pattern['compile'].items():
+            old_time = before['compile'].get(step, {}).get('median_ms')
+            if old_time is not None and timing['median_ms'] > old_time * (1 + tolerance):
+                regressions.append(f"{name} {step}: {old_time:.3f} -> "
+                                   f"{timing['median_ms']:.3f} ms")
+        for kind, count in pattern['instructions'].items():
+            old_count = before['instructions'].get(kind)
+            if old_count is not None and count > old_count:
+                regressions.append(f"{name} {kind} instructions: {old_count} -> {count}")
+    return regressions
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='recompiler bench',
+        description="Benchmark compiling and searching, and write the results as JSON.")
+    parser.add_argument(
+        '--size', type=float, default=2.0,
+        help="Size of the generated corpus in MB (default 2).")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the generated corpus.")
+    parser.add_argument('--corpus', help="Benchmark on this file instead of a generated corpus.")
+    parser.add_argument(
+        '--patterns', nargs='+', choices=list(PATTERNS), default=list(PATTERNS),
+        help="Patterns to benchmark.")
+    parser.add_argument(
+        '--engines', nargs='+', choices=ENGINES, default=list(ENGINES),
+        help="Engines to benchmark.")
+    parser.add_argument(
+        '--repeat', type=int, default=5, help="Number of times to time each compile.")
+    parser.add_argument('-o', '--out-file', help="File to write the JSON report to.")
+    parser.add_argument(
+        '--compare', metavar='REPORT',
+        help="A previous report. Exits with status 1 if anything regressed.")
+    parser.add_argument(
+        '--tolerance', type=float, default=0.1,
+        help="Fraction by which a result may get worse before it's a regression (default 0.1).")
+    args = parser.parse_args(argv)
+
+    text = corpus.load(args.corpus) if args.corpus \
+        else corpus.generate(int(args.size * 1e6), args.seed)
+    patterns = {name: PATTERNS[name] for name in args.patterns}
+    report = asdict(run(text, patterns, tuple(args.engines), args.repeat))
+
+    output = json.dumps(report, indent=2)
+    if args.out_file is None:
+        print(output)
+    else:
+        with open(args.out_file, 'w') as f:
+            f.write(output + '\n')
+
+    if args.compare is None:
+        return 0
+    with open(args.compare, 'r') as f:
+        old = json.load(f)
+    if old['corpus_digest'] != report['corpus_digest']:
+        print("warning: the reports were made with different corpora", file=sys.stderr)
+    regressions = compare(old, report, args.tolerance)
+    for regression in regressions:
+        print(f"regression: {regression}", file=sys.stderr)
+    return 1 if regressions else 0
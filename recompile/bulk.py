@@ -0,0 +1,163 @@
+'''
+Compile many patterns at once across a pool of processes, into a bundle or a directory.
+
+A bundle holds the binaries of every pattern in one file, all fields big-endian like the
+programs themselves:
+
+-----------------------------------------------
+| magic "RCBN" | version | pattern count      |   3 x 4 bytes
+-----------------------------------------------
+| offset | length |  ... one per pattern ...  |   8 bytes per pattern
+-----------------------------------------------
+| binaries of the patterns, back to back      |
+-----------------------------------------------
+
+Offsets are from the start of the file. Patterns that failed to compile have an offset of
+FAILED and a length of 0.
+'''
+import argparse
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
+from functools import partial
+import multiprocessing
+import os
+import sys
+
+from . import compiler
+from .backend import packed
+
+MAGIC = b'RCBN'
+BUNDLE_VERSION = 1
+FAILED = 0xFFFF_FFFF
+_HEADER_SIZE = 12
+_ENTRY_SIZE = 8
+# Number of patterns sent to a worker at a time.
+_CHUNK_SIZE = 32
+
+class BundleError(ValueError):
+    '''
+    Raised when a file isn't a bundle this version can read.
+    '''
+
+@dataclass
+class Result:
+    index: int
+    pattern: str
+    # The compiled program, or None if compiling failed.
+    binary: bytes | None
+    error: str | None = None
+
+def _compile(index: int, pattern: str, class_table: bool) -> Result:
+    try:
+        return Result(index, pattern, compiler.compile_bin(pattern, class_table=class_table))
+    except Exception as e:
+        # One bad pattern shouldn't stop the others from being compiled.
+        return Result(index, pattern, None, f"{type(e).__name__}: {e}")
+
+def _compile_entry(class_table: bool, entry: tuple[int, str]) -> Result:
+    return _compile(*entry, class_table)
+
+def read_patterns(lines: Iterable[str]) -> Iterator[str]:
+    '''
+    Yield the patterns of a file, one per line, skipping blank lines.
+    '''
+    for line in lines:
+        pattern = line.rstrip('\r\n')
+        if pattern:
+            yield pattern
+
+def compile_all(patterns: Iterable[str], jobs: int | None = None,
+                class_table: bool = False) -> Iterator[Result]:
+    '''
+    Compile patterns across `jobs` worker processes (one per CPU by default) and yield the
+    results in the order of the patterns. With one job everything runs in this process.
+    '''
+    if jobs == 1:
+        for index, pattern in enumerate(patterns):
+            yield _compile(index, pattern, class_table)
+        return
+    with multiprocessing.Pool(jobs) as pool:
+        # Patterns are read as they're needed rather than all up front, and sent in chunks,
+        # since each one only takes a moment to compile.
+        yield from pool.imap(partial(_compile_entry, class_table), enumerate(patterns),
+                             chunksize=_CHUNK_SIZE)
+
+def write_bundle(path: str, results: list[Result]):
+    offset = _HEADER_SIZE + _ENTRY_SIZE * len(results)
+    table = bytearray()
+    for result in results:
+        if result.binary is None:
+            table += FAILED.to_bytes(4) + (0).to_bytes(4)
+        else:
+            table += offset.to_bytes(4) + len(result.binary).to_bytes(4)
+            offset += len(result.binary)
+    with open(path, 'wb') as f:
+        f.write(MAGIC + BUNDLE_VERSION.to_bytes(4) + len(results).to_bytes(4))
+        f.write(table)
+        for result in results:
+            if result.binary is not None:
+                f.write(result.binary)
+
+def read_bundle(data: bytes) -> list[bytes | None]:
+    '''
+    Split a bundle into the binary of each pattern, None for those that failed to compile.
+    '''
+    if data[:4] != MAGIC:
+        raise BundleError("Not a bundle")
+    version = int.from_bytes(data[4:8])
+    if version != BUNDLE_VERSION:
+        raise BundleError(f"Bundle version {version} is not supported")
+    count = int.from_bytes(data[8:12])
+    binaries: list[bytes | None] = []
+    for i in range(count):
+        entry = _HEADER_SIZE + _ENTRY_SIZE * i
+        offset = int.from_bytes(data[entry:entry+4])
+        length = int.from_bytes(data[entry+4:entry+8])
+        binaries.append(None if offset == FAILED else bytes(data[offset:offset+length]))
+    return binaries
+
+def load_bundle(path: str) -> list[packed.PackedProgram | None]:
+    with open(path, 'rb') as f:
+        binaries = read_bundle(f.read())
+    return [None if b is None else packed.PackedProgram.from_bytes(b) for b in binaries]
+
+def write_directory(directory: str, result: Result):
+    os.makedirs(directory, exist_ok=True)
+    if result.binary is not None:
+        with open(os.path.join(directory, f"{result.index}.bin"), 'wb') as f:
+            f.write(result.binary)
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='recompiler bulk',
+        description="Compile a file of patterns, one per line, in parallel.")
+    parser.add_argument('input', nargs='?', default='-',
+                        help="File of patterns, or - for stdin (the default).")
+    output_group = parser.add_mutually_exclusive_group(required=True)
+    output_group.add_argument('-o', '--out-file', help="Write every program to one bundle.")
+    output_group.add_argument('-d', '--directory',
+                              help="Write each program to <index>.bin in this directory.")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="Number of worker processes (default: one per CPU).")
+    parser.add_argument('-c', '--class-table', action='store_true',
+                        help="Use Class instructions with a lookup table for character sets.")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == '-' else open(args.input, 'r')
+    results: list[Result] = []
+    failures = 0
+    with source:
+        for result in compile_all(read_patterns(source), args.jobs, args.class_table):
+            if result.error is not None:
+                failures += 1
+                print(f"pattern {result.index} ({result.pattern}): {result.error}",
+                      file=sys.stderr)
+            if args.directory:
+                write_directory(args.directory, result)
+                # Only the outcome is needed once the program has been written.
+                result.binary = None
+            results.append(result)
+    if args.out_file:
+        write_bundle(args.out_file, results)
+    print(f"Compiled {len(results) - failures} of {len(results)} patterns", file=sys.stderr)
+    return 1 if failures else 0
@@ -0,0 +1,138 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import hashlib
+import json
+import os
+
+from .backend import assembler, instruction as inst
+
+# Bump whenever the code generator changes in a way that invalidates stored programs.
+FORMAT_VERSION = 7
+
+@dataclass
+class CacheInfo:
+    '''
+    Statistics for a ProgramCache.
+    '''
+    hits: int
+    misses: int
+    disk_hits: int
+    size: int
+    max_size: int
+    directory: str | None
+
+class ProgramCache:
+    '''
+    A least-recently-used cache of compiled programs, keyed by the regex and its compile options.
+
+    If a directory is given, every compiled program is also stored there as its assembled binary
+    plus a JSON metadata file, so that a new process can load it without parsing or generating
+    code again.
+    '''
+    def __init__(self, max_size: int = 256, directory: str | None = None):
+        assert max_size >= 0, "The cache size can't be negative"
+        self.max_size = max_size
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._programs: OrderedDict[str, list[inst.Instruction]] = OrderedDict()
+
+    def info(self) -> CacheInfo:
+        return CacheInfo(self.hits, self.misses, self.disk_hits, len(self._programs),
+                         self.max_size, self.directory)
+
+    def clear(self):
+        '''
+        Drop every program held in memory and reset the statistics. Stored files are kept.
+        '''
+        self._programs.clear()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+
+    def resize(self, max_size: int):
+        assert max_size >= 0, "The cache size can't be negative"
+        self.max_size = max_size
+        self._evict()
+
+    def get(self, regex: str, options: dict) -> list[inst.Instruction] | None:
+        key = self.key(regex, options)
+        program = self._programs.get(key)
+        if program is not None:
+            self.hits += 1
+            self._programs.move_to_end(key)
+            return program
+
+        program = self._load(key)
+        if program is None:
+            self.misses += 1
+            return None
+        self.disk_hits += 1
+        self._remember(key, program)
+        return program
+
+    def put(self, regex: str, options: dict, program: list[inst.Instruction]):
+        key = self.key(regex, options)
+        self._remember(key, program)
+        self._store(key, regex, options, program)
+
+    @staticmethod
+    def key(regex: str, options: dict) -> str:
+        description = json.dumps([FORMAT_VERSION, regex, options], sort_keys=True)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def _remember(self, key: str, program: list[inst.Instruction]):
+        if self.max_size == 0:
+            return
+        self._programs[key] = program
+        self._programs.move_to_end(key)
+        self._evict()
+
+    def _evict(self):
+        while len(self._programs) > self.max_size:
+            self._programs.popitem(last=False)
+
+    def _paths(self, key: str) -> tuple[str, str]:
+        assert self.directory is not None
+        base = os.path.join(self.directory, key)
+        return (base + '.bin', base + '.json')
+
+    def _load(self, key: str) -> list[inst.Instruction] | None:
+        if self.directory is None:
+            return None
+        bin_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, 'r') as f:
+                meta = json.load(f)
+            with open(bin_path, 'rb') as f:
+                code = f.read()
+        except (OSError, ValueError):
+            return None
+
+        if meta.get('format_version') != FORMAT_VERSION or len(code) != 4 * meta.get('length'):
+            return None
+        words = [int.from_bytes(code[i:i+4]) for i in range(0, len(code), 4)]
+        return assembler.disassemble_program(words)
+
+    def _store(self, key: str, regex: str, options: dict, program: list[inst.Instruction]):
+        if self.directory is None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        bin_path, meta_path = self._paths(key)
+        words = assembler.assemble_program(program)
+        code = b''.join(word.to_bytes(length=4) for word in words)
+        meta = {
+            'format_version': FORMAT_VERSION,
+            'regex': regex,
+            'options': options,
+            'length': len(words),
+        }
+        # Write to temporary files first so that a concurrent reader never sees half a program.
+        # The binary goes first since the metadata is what marks an entry as present.
+        for path, mode, contents in ((bin_path, 'wb', code),
+                                     (meta_path, 'w', json.dumps(meta, sort_keys=True))):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, mode) as f:
+                f.write(contents)
+            os.replace(tmp_path, path)
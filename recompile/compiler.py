@@ -1,35 +1,212 @@
-from .backend import assembler, code_gen, instruction
-from .frontend import parser
+from .backend import assembler, code_gen, instruction, optimizer, specialize
+from .frontend import analysis, parser, transform
 from .frontend import syntax
+from . import cache
+from .backend import packed
+from collections import OrderedDict
+from collections.abc import Callable
+import json
 
-def compile_regex(regex: str) -> list[instruction.Instruction]:
-    # In the future, unicode can be handled by compiling it down into a sequence of uint8s.
-    assert regex.isascii(), "Compiler currently only supports ASCII"
+# Match IDs live in the 16-bit pattern field of a Save instruction.
+MAX_PATTERNS = 1 << 16
+
+# Programs compiled so far, shared by every compile_* function.
+program_cache = cache.ProgramCache()
+
+# The regex and options of the programs compile_regex returned last, see `reverse_of`.
+MAX_SOURCES = 256
+_sources: OrderedDict[tuple[instruction.Instruction, ...], tuple[str, dict]] = OrderedDict()
+
+def configure_cache(max_size: int = 256, directory: str | None = None):
+    '''
+    Set how many compiled programs are kept in memory, and the directory they are stored in so
+    that other processes can load them. Passing no directory disables the on-disk store.
+    '''
+    program_cache.resize(max_size)
+    program_cache.directory = directory
+
+def cache_info() -> cache.CacheInfo:
+    return program_cache.info()
+
+def clear_cache():
+    program_cache.clear()
+
+def compile_regex(regex: str, optimize: bool = True, class_table: bool = False,
+                  utf8: bool = False) -> list[instruction.Instruction]:
+    '''
+    Compile a regex from its string representation to a list of instructions.
+    With `class_table`, character sets that need more than one comparison become a single
+    Class instruction. With `utf8`, the regex may contain any characters, and the program
+    matches their UTF-8 encoding in bytes (see frontend/transform.py), so search UTF-8 data with
+    runner.search_bytes. Results are cached, see `configure_cache`.
+    '''
+    options = {'optimize': optimize, 'class_table': class_table, 'utf8': utf8}
+    code = _cached(regex, options, lambda: _compile_regex(regex, class_table, utf8))
+    key = tuple(code)
+    _sources[key] = (regex, options)
+    _sources.move_to_end(key)
+    while len(_sources) > MAX_SOURCES:
+        _sources.popitem(last=False)
+    return code
+
+def compile_reverse(regex: str, optimize: bool = True, class_table: bool = False,
+                    utf8: bool = False) -> list[instruction.Instruction]:
+    '''
+    Compile the reverse of a regex, for finding where a match starts once its end is known.
+    The program reads the input backwards from the end of a match, without a .* prefix, and
+    matches when it reaches a position the match could start at. See runner.search.
+    '''
+    options = {'optimize': optimize, 'class_table': class_table, 'utf8': utf8, 'reverse': True}
+    return _cached(regex, options, lambda: _compile_reverse(regex, class_table, utf8))
+
+def reverse_of(program: packed.Program) -> list[instruction.Instruction] | None:
+    '''
+    The reverse (see `compile_reverse`) of a program compile_regex returned, or None if the
+    program didn't come from one of the last MAX_SOURCES calls to compile_regex.
+    '''
+    code = program.instructions() if isinstance(program, packed.PackedProgram) else program
+    source = _sources.get(tuple(code))
+    if source is None:
+        return None
+    regex, options = source
+    return compile_reverse(regex, **options)
+
+def compile_matcher(regex: str, optimize: bool = True, class_table: bool = False,
+                    utf8: bool = False) -> specialize.Matcher:
+    '''
+    Compile a regex to a Python function that takes a sequence of character codes and returns
+    the (start, end) offsets of the longest match, see backend/specialize.py. Its code is stored
+    alongside the cached programs when the cache has a directory.
+    '''
+    code = compile_regex(regex, optimize, class_table, utf8)
+    return specialize.matcher(code, program_cache.directory)
+
+def compile_multi(patterns: list[str], optimize: bool = True, class_table: bool = False,
+                  utf8: bool = False) -> list[instruction.Instruction]:
+    '''
+    Compile several regexes into a single program that looks for all of them in one pass.
+    The final Save of each pattern carries its index in `patterns` as the match ID, see
+    runner.search_multi.
+    '''
+    assert 0 < len(patterns) <= MAX_PATTERNS, \
+        f"Can compile between 1 and {MAX_PATTERNS} patterns together, not {len(patterns)}"
+    options = {'optimize': optimize, 'class_table': class_table, 'utf8': utf8, 'multi': True}
+    return _cached(json.dumps(patterns), options,
+                   lambda: _compile_multi(patterns, class_table, utf8))
+
+def _cached(key: str, options: dict,
+            build: Callable[[], list[instruction.Instruction]]) -> list[instruction.Instruction]:
+    code = program_cache.get(key, options)
+    if code is None:
+        code = build()
+        if options['optimize']:
+            code, _ = optimizer.optimize(code)
+        code = instruction.share(code)
+        program_cache.put(key, options, code)
+    # Hand out a copy so that callers can't modify the cached program.
+    return list(code)
+
+def _parse(regex: str, utf8: bool) -> syntax.Construction:
+    if not utf8:
+        assert regex.isascii(), "Compiler only supports ASCII unless compiling for UTF-8"
+    # Factor alternations first, while their literals are still whole characters.
+    parsed = transform.factor(parser.parse(regex))
+    return transform.utf8(parsed) if utf8 else parsed
+
+def _compile_regex(regex: str, class_table: bool, utf8: bool) -> list[instruction.Instruction]:
     # Wrap the regex in a group to allow for extraction of the match.
-    parsed = syntax.Group(0, True, parser.parse(regex))
+    parsed = syntax.Group(0, True, _parse(regex, utf8))
 
     # If the regex isn't trying to match from the start of the string, then its equivalent to
-    # matching anything (.*) before the provided regex.
+    # matching anything (.*) before the provided regex. The prefix skips any byte, even in
+    # UTF-8 programs, so that invalid UTF-8 doesn't stop the search.
     if regex[0] != '$':
         prefix = parser.parse('.*')
         parsed = syntax.Sequence([prefix, parsed])
     
-    code = code_gen.compile(parsed)
+    code = code_gen.compile(parsed, opts=code_gen.Options(class_table=class_table))
     return code
 
-def compile_asm(regex: str) -> str:
+def _compile_reverse(regex: str, class_table: bool, utf8: bool) -> list[instruction.Instruction]:
+    parsed = syntax.Group(0, True, transform.reverse(_parse(regex, utf8)))
+    return code_gen.compile(parsed, opts=code_gen.Options(class_table=class_table))
+
+def _compile_multi(patterns: list[str], class_table: bool,
+                   utf8: bool) -> list[instruction.Instruction]:
+    anchored: list[syntax.Construction] = []
+    unanchored: list[syntax.Construction] = []
+    for pattern_id, regex in enumerate(patterns):
+        group = syntax.Group(0, True, _parse(regex, utf8), pattern_id)
+        if regex[0] == '$':
+            anchored.append(group)
+        else:
+            unanchored.append(group)
+
+    # All the unanchored patterns share a single .* prefix, followed by one fan-out of Splits.
+    parsed: syntax.Construction | None = None
+    if unanchored:
+        parsed = syntax.Sequence([parser.parse('.*'), _alternatives(unanchored)])
+    if anchored:
+        first = _alternatives(anchored)
+        parsed = first if parsed is None else syntax.Alternatives(first, parsed)
+    assert parsed is not None
+    return code_gen.compile(parsed, opts=code_gen.Options(class_table=class_table))
+
+def _alternatives(options: list[syntax.Construction]) -> syntax.Construction:
+    if len(options) == 1:
+        return options[0]
+    return syntax.Alternatives(options[0], _alternatives(options[1:]))
+
+def compile_prefilter(regex: str, utf8: bool = False) -> analysis.Prefilter:
+    '''
+    Work out what every match of a regex must look like, so that searches can skip input that
+    can't contain one. See runner.search. Pass the same `utf8` as when compiling the regex.
+    '''
+    return analysis.analyze(_parse(regex, utf8), anchored=regex[0] == '$')
+
+def compile_asm(regex: str, optimize: bool = True, class_table: bool = False,
+                utf8: bool = False) -> str:
     '''
     Compile a regex from its string representation to "assembly code"
     '''
-    code = compile_regex(regex)
-    code_text = '\n'.join(map(lambda inst: inst.code(), code))
-    return f"# regex: {regex}\n" + code_text
+    code = compile_regex(regex, optimize, class_table, utf8)
+    header = f"# regex: {regex}\n"
+    if optimize:
+        unoptimized = compile_regex(regex, False, class_table, utf8)
+        header += f"# instructions: {len(code)} ({len(unoptimized)} before optimization)\n"
+    return header + _code_text(code)
+
+def compile_multi_asm(patterns: list[str], optimize: bool = True, class_table: bool = False,
+                      utf8: bool = False) -> str:
+    '''
+    Compile several regexes into one program (see `compile_multi`) as "assembly code".
+    The header lists the pattern each match ID stands for.
+    '''
+    code = compile_multi(patterns, optimize, class_table, utf8)
+    header = ''.join(f"# pattern {i}: {regex}\n" for i, regex in enumerate(patterns))
+    return header + _code_text(code)
 
-def compile_bin(regex: str) -> bytes:
+def _code_text(code: list[instruction.Instruction]) -> str:
+    return '\n'.join(map(lambda inst: inst.code(), code))
+
+def compile_bin(regex: str, optimize: bool = True, class_table: bool = False,
+                utf8: bool = False) -> bytes:
     '''
     Compile a regex from its string representation to binary "machine code"
+    The bitmaps of any Class instructions follow the code, see assembler.assemble_program.
+    '''
+    return _assemble(compile_regex(regex, optimize, class_table, utf8))
+
+def compile_multi_bin(patterns: list[str], optimize: bool = True, class_table: bool = False,
+                      utf8: bool = False) -> bytes:
     '''
-    code = compile_regex(regex)
-    def assemble_to_bytes(i: instruction.Instruction) -> bytes:
-        return assembler.assemble(i).to_bytes(length=4)
-    return b''.join(map(assemble_to_bytes, code))
+    Compile several regexes into one program (see `compile_multi`) as binary "machine code".
+    Match IDs are the index of each pattern in `patterns`. The binary doesn't hold the patterns,
+    so write them next to it with packed.save_patterns, and load both with packed.load_multi.
+    '''
+    return _assemble(compile_multi(patterns, optimize, class_table, utf8))
+
+def _assemble(code: list[instruction.Instruction]) -> bytes:
+    def word_to_bytes(word: int) -> bytes:
+        return word.to_bytes(length=4)
+    return b''.join(map(word_to_bytes, assembler.assemble_program(code)))
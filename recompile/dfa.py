@@ -0,0 +1,194 @@
+from dataclasses import dataclass
+from collections.abc import Iterable, Iterator
+
+from .backend import instruction as inst, packed
+from .backend.assembler import Opcode
+
+# Character codes above 0xFF can't match any range, so they all share one column.
+WIDE_CHAR = 257
+
+# A state's transition row has one entry per byte, one for wide characters and one for the end
+# of the input.
+_END_COLUMN = 256
+_ROW_LENGTH = WIDE_CHAR + 1
+_UNKNOWN = -1
+
+@dataclass
+class CacheStats:
+    '''
+    Counters describing how well the transition cache of a LazyDFA is doing.
+    '''
+    hits: int = 0
+    misses: int = 0
+    flushes: int = 0
+    fallbacks: int = 0
+
+class LazyDFA:
+    '''
+    A DFA built on demand from a compiled program.
+
+    Each state is the set of pcs that are waiting to consume a character. Following a transition
+    takes the epsilon closure of that set over Split, Save and non-consuming AluOps (which depends
+    on the character being looked at) and then steps every consuming AluOp that accepts it.
+    Transitions are cached in a table of at most `max_states` rows. When the table fills up it is
+    cleared, and if that happens more than `max_flushes` times during one scan the rest of the
+    scan falls back to stepping the NFA directly without caching anything.
+    '''
+    def __init__(self, program: packed.Program, max_states: int = 1024,
+                 max_flushes: int = 8):
+        assert max_states >= 2, "The cache needs room for at least two states"
+        self.program = packed.pack(program)
+        self.max_states = max_states
+        self.max_flushes = max_flushes
+        self.stats = CacheStats()
+        self._kernels: list[tuple[int, ...]] = []
+        self._ids: dict[tuple[int, ...], int] = {}
+        self._transitions: list[list[int]] = []
+
+    def state_count(self) -> int:
+        return len(self._kernels)
+
+    def clear(self):
+        self._kernels.clear()
+        self._ids.clear()
+        self._transitions.clear()
+
+    def find_end(self, codes: Iterable[int]) -> int | None:
+        '''
+        Scan a sequence of character codes and return the position at which the first match
+        ends, or None if the program doesn't match anywhere. Codes above 0xFF must be passed
+        as WIDE_CHAR.
+        '''
+        return next(self.match_ends(codes), None)
+
+    def find_last_end(self, codes: Iterable[int]) -> int | None:
+        '''
+        Scan a sequence of character codes and return the position at which the last match
+        ends, or None if the program doesn't match anywhere. No match extends past it.
+        '''
+        last = None
+        for last in self.match_ends(codes):
+            pass
+        return last
+
+    def match_ends(self, codes: Iterable[int]) -> Iterator[int]:
+        '''
+        Scan a sequence of character codes, yielding every position at which a match ends in
+        order. The scan stops early once no match can end further on.
+        '''
+        flushes = 0
+        state = self._state_id((0,))
+        sc = 0
+        codes_iter = iter(codes)
+        for c in codes_iter:
+            entry = self._transitions[state][c]
+            if entry == _UNKNOWN:
+                if len(self._kernels) >= self.max_states:
+                    kernel = self._kernels[state]
+                    self.stats.flushes += 1
+                    self.clear()
+                    flushes += 1
+                    if flushes > self.max_flushes:
+                        self.stats.fallbacks += 1
+                        yield from self._match_ends_uncached(kernel, c, codes_iter, sc)
+                        return
+                    state = self._state_id(kernel)
+                entry = self._fill(state, c, False)
+            else:
+                self.stats.hits += 1
+
+            if entry & 1:
+                yield sc
+            state = entry >> 1
+            if not self._kernels[state]:
+                # Dead state, nothing can match from here on.
+                return
+            sc += 1
+
+        entry = self._transitions[state][_END_COLUMN]
+        if entry == _UNKNOWN:
+            entry = self._fill(state, _END_COLUMN, True)
+        else:
+            self.stats.hits += 1
+        if entry & 1:
+            yield sc
+
+    def _match_ends_uncached(self, kernel: tuple[int, ...], c: int, codes_iter: Iterator[int],
+                             sc: int) -> Iterator[int]:
+        '''
+        Finish a scan by stepping the NFA directly, starting with the character `c` at `sc`.
+        '''
+        while True:
+            kernel, matched = step(self.program, kernel, c, False)
+            if matched:
+                yield sc
+            if not kernel:
+                return
+            sc += 1
+            c = next(codes_iter, None)
+            if c is None:
+                _, matched = step(self.program, kernel, _END_COLUMN, True)
+                if matched:
+                    yield sc
+                return
+
+    def _state_id(self, kernel: tuple[int, ...]) -> int:
+        state = self._ids.get(kernel)
+        if state is None:
+            state = len(self._kernels)
+            self._ids[kernel] = state
+            self._kernels.append(kernel)
+            self._transitions.append([_UNKNOWN] * _ROW_LENGTH)
+        return state
+
+    def _fill(self, state: int, c: int, at_end: bool) -> int:
+        self.stats.misses += 1
+        next_kernel, matched = step(self.program, self._kernels[state], c, at_end)
+        entry = (self._state_id(next_kernel) << 1) | int(matched)
+        self._transitions[state][c] = entry
+        return entry
+
+def step(program: packed.PackedProgram, kernel: tuple[int, ...], c: int,
+         at_end: bool) -> tuple[tuple[int, ...], bool]:
+    '''
+    Compute the NFA transition from a set of pcs over the character `c`.
+    Returns the set of pcs waiting at the next position and whether a match was found.
+    '''
+    if at_end:
+        c = inst.END_OF_INPUT
+    opcode = program.opcode
+    flags = program.flags
+    matched = False
+    next_pcs: set[int] = set()
+    visited: set[int] = set()
+    stack = list(kernel)
+    while stack:
+        pc = stack.pop()
+        if pc in visited:
+            continue
+        visited.add(pc)
+
+        op = opcode[pc]
+        if op == Opcode.Branch:
+            in_range = c >= program.c_min[pc] and c <= program.c_max[pc]
+            is_match = in_range != bool(flags[pc] & packed.INVERTED)
+            if flags[pc] & packed.CONSUME:
+                if is_match and not at_end:
+                    next_pcs.add(pc+1)
+            else:
+                stack.append(program.dest[pc] if is_match else pc+1)
+        elif op == Opcode.Class:
+            if c <= 0xFF and (program.bitmaps[pc] >> c) & 1 and not at_end:
+                next_pcs.add(pc+1)
+        elif op == Opcode.Split:
+            stack.append(program.dest[pc])
+            stack.append(program.dest2[pc])
+        elif op == Opcode.Save:
+            if flags[pc] & packed.MATCH:
+                matched = True
+            else:
+                stack.append(pc+1)
+        else:
+            raise AssertionError(f"Opcode {op} at {pc} is not recognized!")
+
+    return (tuple(sorted(next_pcs)), matched)
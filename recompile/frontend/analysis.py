@@ -0,0 +1,150 @@
+from dataclasses import dataclass
+from functools import singledispatch
+
+from . import syntax as syn
+
+@dataclass
+class Prefilter:
+    '''
+    Facts about every string a regex can match, used to skip input that can't contain a match.
+    '''
+    # Literal strings that every match contains.
+    required: list[str]
+    # Character codes a match can start with, or None if it can start with anything.
+    first_chars: frozenset[int] | None
+    min_length: int
+    # None if matches can be arbitrarily long.
+    max_length: int | None
+    # Anchored regexes only match at the start of the input.
+    anchored: bool
+
+@dataclass
+class _Info:
+    min_length: int
+    max_length: int | None
+    first_chars: frozenset[int] | None
+    # Set if the construction only matches this one string.
+    exact: str | None
+    required: list[str]
+
+def analyze(val: syn.Construction, anchored: bool = False) -> Prefilter:
+    '''
+    Work out a Prefilter for the syntax tree of a regex.
+    '''
+    info = _analyze(val)
+    required = [info.exact] if info.exact else info.required
+    # Longest first, since those are the least likely to show up by chance.
+    required = sorted(dict.fromkeys(required), key=len, reverse=True)
+    first_chars = info.first_chars if info.min_length > 0 else None
+    return Prefilter(required, first_chars, info.min_length, info.max_length, anchored)
+
+def _chars_of(val: syn.CharSet) -> frozenset[int] | None:
+    if val.inverse:
+        # Inverted sets contain nearly everything, which doesn't help with skipping.
+        return None
+    chars = {ord(c) for c in val.chars}
+    for c_min, c_max in val.ranges:
+        chars.update(range(ord(c_min), ord(c_max) + 1))
+    return frozenset(chars)
+
+def _union(a: frozenset[int] | None, b: frozenset[int] | None) -> frozenset[int] | None:
+    if a is None or b is None:
+        return None
+    return a | b
+
+@singledispatch
+def _analyze(val) -> _Info:
+    raise AssertionError(f"Unexpected type for val {val.type}")
+
+@_analyze.register
+def _(val: syn.Literal) -> _Info:
+    return _Info(1, 1, frozenset([ord(val.val)]), val.val, [])
+
+@_analyze.register
+def _(val: syn.Group) -> _Info:
+    return _analyze(val.expression)
+
+@_analyze.register
+def _(_: syn.WildCard) -> _Info:
+    return _Info(1, 1, None, None, [])
+
+@_analyze.register
+def _(val: syn.CharSet) -> _Info:
+    chars = _chars_of(val)
+    if chars is not None and len(chars) == 1:
+        return _Info(1, 1, chars, chr(next(iter(chars))), [])
+    return _Info(1, 1, chars, None, [])
+
+@_analyze.register
+def _(val: syn.Sequence) -> _Info:
+    min_length = 0
+    max_length: int | None = 0
+    first_chars: frozenset[int] | None = frozenset()
+    still_first = True
+    required: list[str] = []
+    # Adjacent exact parts join up into longer literals.
+    run = ''
+    parts = [_analyze(v) for v in val.val]
+    for part in parts:
+        if still_first:
+            first_chars = _union(first_chars, part.first_chars)
+            still_first = part.min_length == 0
+        min_length += part.min_length
+        max_length = None if max_length is None or part.max_length is None \
+            else max_length + part.max_length
+
+        if part.exact is not None:
+            run += part.exact
+        else:
+            if run:
+                required.append(run)
+            run = ''
+            required += part.required
+    if run:
+        required.append(run)
+
+    if all(p.exact is not None for p in parts):
+        return _Info(min_length, max_length, first_chars, run, [])
+    return _Info(min_length, max_length, first_chars, None, required)
+
+@_analyze.register
+def _(val: syn.Alternatives) -> _Info:
+    a = _analyze(val.alt1)
+    b = _analyze(val.alt2)
+    max_length = None if a.max_length is None or b.max_length is None \
+        else max(a.max_length, b.max_length)
+    exact = a.exact if a.exact is not None and a.exact == b.exact else None
+    # Only literals needed by both sides are needed by the whole.
+    a_required = [a.exact] if a.exact else a.required
+    b_required = [b.exact] if b.exact else b.required
+    required = [r for r in a_required if r in b_required]
+    return _Info(min(a.min_length, b.min_length), max_length,
+                 _union(a.first_chars, b.first_chars), exact, required)
+
+@_analyze.register
+def _(val: syn.Option) -> _Info:
+    info = _analyze(val.val)
+    return _Info(0, info.max_length, info.first_chars, None, [])
+
+@_analyze.register
+def _(val: syn.Some) -> _Info:
+    info = _analyze(val.val)
+    required = [info.exact] if info.exact else info.required
+    return _Info(info.min_length, None if info.max_length != 0 else 0, info.first_chars, None,
+                 required)
+
+@_analyze.register
+def _(val: syn.Any) -> _Info:
+    info = _analyze(val.val)
+    return _Info(0, None if info.max_length != 0 else 0, info.first_chars, None, [])
+
+@_analyze.register
+def _(val: syn.Repeat) -> _Info:
+    info = _analyze(val.val)
+    max_length = None if info.max_length is None or val.max is None \
+        else info.max_length * val.max
+    if val.min == 0:
+        return _Info(0, max_length, info.first_chars, None, [])
+    exact = info.exact * val.min if info.exact is not None and val.min == val.max else None
+    required = [] if exact is not None else [info.exact] if info.exact else info.required
+    return _Info(info.min_length * val.min, max_length, info.first_chars, exact, required)
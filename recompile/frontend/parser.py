@@ -1,94 +1,104 @@
+from dataclasses import dataclass, field
+
 from . import syntax as syn
 
-_whitespace_chars = ['\n', ' ', '\t', '\r', '\f', '\v']
-_alpha_num_ranges = [('0','9'), ('A', 'Z'), ('a', 'z')]
-_alpha_num_chars = ['_']
-_num_ranges = [('0', '9')]
+_whitespace_chars = ('\n', ' ', '\t', '\r', '\f', '\v')
+_alpha_num_ranges = (('0','9'), ('A', 'Z'), ('a', 'z'))
+_alpha_num_chars = ('_',)
+_num_ranges = (('0', '9'),)
 
-def find_closing_paren(s: str) -> int | None:
+class ParseError(ValueError):
     '''
-    Find the closing parenthesis for a string that starts with an opening parenthesis
+    Raised when a regex can't be parsed. `offset` is the index in the regex where the problem
+    was found.
     '''
-    assert s[0] == '('
-    depth = 0
-    escape: bool = False
-    for i, c in enumerate(s):
-        # If we hit an escape character last time, then skip this
-        if escape:
-            escape = False
-            continue
-        match c:
-            case '\\':
-                escape = True
-            case '(':
-                depth += 1
-            case ')':
-                depth -= 1
-                if depth == 0:
-                    return i
-    return None
+    def __init__(self, message: str, regex: str, offset: int):
+        super().__init__(f"{message} at {offset} of '{regex}'")
+        self.regex = regex
+        self.offset = offset
+
+@dataclass
+class _Frame:
+    '''
+    The state of one level of grouping while parsing.
+    '''
+    # Where the group (or the whole regex) starts, and where its current alternative starts.
+    pos: int
+    alt_pos: int
+    items: list[syn.Construction] = field(default_factory=list)
+    # Finished alternatives to the left of the current one, with their positions.
+    alternatives: list[tuple[syn.Construction, int]] = field(default_factory=list)
 
-def parse_count(s: str) -> tuple[int, int, int]:
+def parse_count(regex: str, index: int) -> tuple[int, int | None, int]:
     '''
-    Parses a count specifier of the form `{n}` or `{min, max}`
-    returns a tuple of the min and max counts.
+    Parses a count specifier of the form `{n}`, `{min,max}` or `{min,}` starting at `index`.
+    returns a tuple of the min and max counts (None if unbounded) and the index of the closing
+    brace.
     '''
-    assert s[0] == '{'
-    end = s.find('}')
-    assert end != -1, f"Could not find closing brace in {s}"
-    inside = s[1:end]
-    nums = inside.split(',')
-
-    if len(nums) == 1:
-        count = int(nums[0].strip())
-        assert count > 0
-        return (count, count, end)
-    elif len(nums) == 2:
-        min_count = int(nums[0].strip())
-        max_count = int(nums[1].strip())
-        assert min_count > 0
-        assert max_count > min_count
-        return (min_count, max_count, end)
-    else:
-        assert False, f"Invalid count specifier: '{s[:end+1]}'"
-
-def parse_charset(s: str) -> tuple[syn.CharSet, int]:
-    assert s[0] == '['
-    end = s.find(']')
-
-    # If there's an escape before the closing brace, it doesn't count.
-    if end != -1 and s[end-1] == '\\':
-        end = s[end:].find(']')
-    assert end != -1, f"Could not find closing brace in {s}"
+    assert regex[index] == '{'
+    end = regex.find('}', index)
+    if end == -1:
+        raise ParseError("Could not find closing brace", regex, index)
+    nums = [num.strip() for num in regex[index+1:end].split(',')]
+
+    if len(nums) > 2:
+        raise ParseError("Invalid count specifier", regex, index)
+    try:
+        min_count = int(nums[0])
+        if len(nums) == 1:
+            max_count: int | None = min_count
+        else:
+            max_count = int(nums[1]) if nums[1] else None
+    except ValueError:
+        raise ParseError("Invalid count specifier", regex, index) from None
+
+    if min_count < 0:
+        raise ParseError("Minimum count can't be negative", regex, index)
+    if max_count is not None:
+        if max_count <= 0:
+            raise ParseError("Maximum count must be positive", regex, index)
+        if max_count < min_count:
+            raise ParseError("Maximum count can't be less than the minimum", regex, index)
+    return (min_count, max_count, end)
+
+def parse_charset(regex: str, index: int) -> tuple[syn.CharSet, int]:
+    '''
+    Parses a character set like `[a-z_]` starting at `index`.
+    Returns the set and the index of the closing bracket.
+    '''
+    assert regex[index] == '['
+    start = index
 
     # See if we're going to invert the character set.
     # Also don't processed the inversion character in the main loop.
-    inverted = s[1] == '^'
-    inside = s[2:end] if inverted else s[1:end]
-    assert len(inside) != 0, f"There must be one or characters inside the set '{s[:end]}'"
+    inverted = index+1 < len(regex) and regex[index+1] == '^'
+    index += 2 if inverted else 1
 
-    index = 0
     ranges: list[tuple[str, str]] = []
     chars: list[str] = []
 
-    while index < len(inside):
-        match inside[index]:
+    while index < len(regex) and regex[index] != ']':
+        match regex[index]:
             case '-':
-                if len(chars) == 0 or index == len(inside) - 1:
+                at_end = index+1 >= len(regex) or regex[index+1] == ']'
+                if len(chars) == 0 or at_end:
                     chars.append('-')
-                elif inside[index+1] != '\\':
+                elif regex[index+1] != '\\':
                     last = chars.pop()
-                    next = inside[index+1]
-                    assert last.isalnum() and next.isalnum(), \
-                        "Ranges only supported on alphanumeric chars"
-                    assert last < next, "Ranges must be from low to high!"
+                    next = regex[index+1]
+                    if not (last.isalnum() and next.isalnum()):
+                        raise ParseError(
+                            "Ranges only supported on alphanumeric chars", regex, index)
+                    if last >= next:
+                        raise ParseError("Ranges must be from low to high", regex, index)
                     ranges.append((last, next))
                     index += 1
                 else:
-                    assert False, "Cannot have a range with an escaped character!"
+                    raise ParseError("Cannot have a range with an escaped character", regex, index)
             case '\\':
-                assert index != len(inside) - 1
-                escaped = inside[index+1]
+                if index+1 >= len(regex):
+                    raise ParseError("Escape character with nothing after it", regex, index)
+                escaped = regex[index+1]
                 match escaped:
                     case 's':
                         chars += _whitespace_chars
@@ -100,85 +110,107 @@ def parse_charset(s: str) -> tuple[syn.CharSet, int]:
                     case '[' | ']' | '(' | ')' | '{' | '}' | '^' | '\\':
                         chars.append(escaped)
                     case _:
-                        assert False, f"Unsupported escaped character: {escaped}"
+                        raise ParseError(
+                            f"Unsupported escaped character '{escaped}'", regex, index)
                 index += 1
-            case _:
-                chars.append(inside[index])
+            case c:
+                chars.append(c)
         index += 1
-    return (syn.CharSet(ranges, chars, inverted), end)
+
+    if index >= len(regex):
+        raise ParseError("Could not find closing bracket", regex, start)
+    if len(chars) == 0 and len(ranges) == 0:
+        raise ParseError("There must be one or more characters inside the set", regex, start)
+    return (syn.CharSet(ranges, chars, inverted, pos=start), index)
 
 def parse(regex: str) -> syn.Construction:
     '''
     Parse an AST for a regex from a string.
+
+    This is a single pass over the regex that keeps a stack of the groups it is inside, so it
+    takes time linear in the length of the regex and never copies parts of it.
+    Raises a ParseError if the regex is invalid.
     '''
-    instructions: list[syn.Construction] = []
+    stack = [_Frame(0, 0)]
     index = 0
 
     # Loop through the string
     while index < len(regex):
+        frame = stack[-1]
+        instructions = frame.items
         match regex[index]:
             case '(':
-                end = find_closing_paren(regex[index:])
-                assert end is not None, f"Unmatched opening parenthesis at {index} of '{regex}'"
-                end = index + end
-                instructions.append(parse(regex[index+1:end]))
-                index=end
+                stack.append(_Frame(index, index+1))
             case ')':
-                assert False, f"Unmatched closing parenthesis at {index} of '{regex}'"
-            case '?':
+                if len(stack) == 1:
+                    raise ParseError("Unmatched closing parenthesis", regex, index)
+                stack.pop()
+                stack[-1].items.append(_finish(frame, regex, index))
+            case '?' | '*' | '+' as c:
+                if len(instructions) == 0:
+                    raise ParseError(f"Nothing for '{c}' to repeat", regex, index)
                 last = instructions.pop()
-                instructions.append(syn.Option(last))
-            case '*':
-                last = instructions.pop()
-                instructions.append(syn.Any(last))
-            case '+':
-                last = instructions.pop()
-                instructions.append(syn.Some(last))
+                node_type = {'?': syn.Option, '*': syn.Any, '+': syn.Some}[c]
+                instructions.append(node_type(last, pos=last.pos))
             case '|':
-                assert len(instructions) != 0, \
-                    f"Alternative with empty option at {index} of '{regex}'"
-                first = syn.Sequence(instructions) if len(instructions) > 1 else instructions[0]
-                second = parse(regex[index+1:])
-                return syn.Alternatives(first, second)
+                if len(instructions) == 0:
+                    raise ParseError("Alternative with empty option", regex, index)
+                frame.alternatives.append((_sequence(instructions), frame.alt_pos))
+                frame.items = []
+                frame.alt_pos = index+1
             case '.':
-                instructions.append(syn.WildCard())
+                instructions.append(syn.WildCard(pos=index))
             case '\\':
-                assert index+1 < len(regex), \
-                    f"Escape character with nothing after it at {index} of '{regex}'"
-                
+                if index+1 >= len(regex):
+                    raise ParseError("Escape character with nothing after it", regex, index)
+
                 escaped = regex[index+1]
                 match escaped:
                     case 's' | 'S':
-                        instructions.append(syn.CharSet([], _whitespace_chars, escaped.isupper()))
+                        instructions.append(syn.CharSet(
+                            (), _whitespace_chars, escaped.isupper(), pos=index))
                     case 'd' | 'D':
-                        instructions.append(syn.CharSet(_num_ranges, [], escaped.isupper()))
+                        instructions.append(syn.CharSet(
+                            _num_ranges, (), escaped.isupper(), pos=index))
                     case 'w' | 'W':
-                        instructions.append(
-                            syn.CharSet(_alpha_num_ranges, _alpha_num_chars, escaped.isupper()))
+                        instructions.append(syn.CharSet(
+                            _alpha_num_ranges, _alpha_num_chars, escaped.isupper(), pos=index))
                     case _:
-                        instructions.append(syn.Literal(escaped))
+                        instructions.append(syn.Literal(escaped, pos=index))
                 index += 1
             case '{':
-                min_count, max_count, end = parse_count(regex[index:])
-                index += end
-                inst = instructions.pop()
-                # Compile the the count into a sequence where anything
-                # between the min and max count is optional.
-                instructions += [inst] * min_count
-                optional_count = max_count - min_count
-                if optional_count > 0:
-                    instructions += [syn.Option(inst)] * optional_count
+                if len(instructions) == 0:
+                    raise ParseError("Nothing for the count to repeat", regex, index)
+                min_count, max_count, index = parse_count(regex, index)
+                last = instructions.pop()
+                instructions.append(syn.Repeat(last, min_count, max_count, pos=last.pos))
             case '[':
-                inst, chars_parsed = parse_charset(regex[index:])
+                inst, index = parse_charset(regex, index)
                 instructions.append(inst)
-                index += chars_parsed
-            case _:
-                instructions.append(syn.Literal(regex[index]))
+            case c:
+                instructions.append(syn.Literal(c, pos=index))
         index += 1
 
-    assert len(instructions) != 0, f"Could not parse regular expression from '{regex}'"
+    if len(stack) > 1:
+        raise ParseError("Unmatched opening parenthesis", regex, stack[-1].pos)
+    return _finish(stack[0], regex, len(regex))
+
+def _sequence(instructions: list[syn.Construction]) -> syn.Construction:
     if len(instructions) == 1:
-        retVal =  instructions[0]
-    else:
-        retVal = syn.Sequence(instructions)
-    return retVal
+        return instructions[0]
+    return syn.Sequence(instructions, pos=instructions[0].pos)
+
+def _finish(frame: _Frame, regex: str, end: int) -> syn.Construction:
+    '''
+    Build the construction for a group (or the whole regex) that ends at `end`.
+    '''
+    if len(frame.items) == 0:
+        if frame.alternatives:
+            raise ParseError("Alternative with empty option", regex, end)
+        raise ParseError("Could not parse regular expression from empty group", regex, frame.pos)
+
+    # Alternatives nest to the right, so `a|b|c` is `a|(b|c)`.
+    result = _sequence(frame.items)
+    for alternative, pos in reversed(frame.alternatives):
+        result = syn.Alternatives(alternative, result, pos=pos)
+    return result
@@ -1,57 +1,94 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
+@dataclass(frozen=True, slots=True)
 class Construction:
     '''
     Base type for all regular expression grammar constructions.
+    Constructions are immutable and hashable, so that equal subtrees can be shared, see
+    transform.share. Sequences and sets given lists store them as tuples.
     '''
+    # Offset of the construction in the regex it was parsed from, if it was parsed from one.
+    pos: int | None = field(default=None, compare=False, repr=False, kw_only=True)
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Literal(Construction):
     '''
     A single character literal to match.
     '''
     val: str
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Group(Construction):
     '''
     A subexpression that can be matched and have it's location extracted afterwards.
-    Currently just supported for the top-level expression.
+    Currently just supported for the top-level expression, where `pattern` identifies which
+    pattern matched in a program built from several.
     '''
     expression_index: int
     is_top_level: bool
     expression: Construction
+    pattern: int = 0
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class WildCard(Construction):
     '''
     Matches any single character, ex: `.`
     '''
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class CharSet(Construction):
     '''
     Matches any single character in a set, ex: `[a-z0-9]`
     '''
-    ranges: list[tuple[str, str]]
-    chars: list[str]
+    ranges: tuple[tuple[str, str], ...]
+    chars: tuple[str, ...]
     inverse: bool
 
-    def _is_single_char(self) -> bool:
-        return len(self.chars) == 1 and len(self.ranges) == 0
+    def __post_init__(self):
+        object.__setattr__(self, 'ranges', tuple(self.ranges))
+        object.__setattr__(self, 'chars', tuple(self.chars))
 
-    def _is_single_range(self) -> bool:
-        return len(self.chars) == 0 and len(self.ranges) == 1
+    def normalized(self) -> list[tuple[int, int]]:
+        '''
+        The character codes the set matches, as sorted ranges that neither overlap nor touch.
+        Inverted sets are complemented over the byte values 0-255.
+        '''
+        ranges = sorted([(ord(c), ord(c)) for c in self.chars]
+                        + [(ord(c_min), ord(c_max)) for c_min, c_max in self.ranges])
+        merged: list[tuple[int, int]] = []
+        for c_min, c_max in ranges:
+            if merged and c_min <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], c_max))
+            else:
+                merged.append((c_min, c_max))
+        return complement(merged) if self.inverse else merged
 
+def complement(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    '''
+    The byte values not covered by sorted, non-overlapping ranges.
+    '''
+    result = []
+    start = 0
+    for c_min, c_max in ranges:
+        if c_min > start:
+            result.append((start, c_min - 1))
+        start = c_max + 1
+    if start <= 0xFF:
+        result.append((start, 0xFF))
+    return result
 
-@dataclass
+
+@dataclass(frozen=True, slots=True)
 class Sequence(Construction):
     '''
     Matches a sequence of sub-expressions, ex: `abc`
     '''
-    val: list[Construction]
+    val: tuple[Construction, ...]
+
+    def __post_init__(self):
+        object.__setattr__(self, 'val', tuple(self.val))
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Alternatives(Construction):
     '''
     Matches one of multiple alternative sub-expressions, ex: `ab|cd`
@@ -59,23 +96,33 @@ class Alternatives(Construction):
     alt1: Construction
     alt2: Construction
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Option(Construction):
     '''
     Matches zero or one occurrences, ex: `a?`
     '''
     val: Construction
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Some(Construction):
     '''
     Matches one or more occurrences, ex: `a+`
     '''
     val: Construction
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Any(Construction):
     '''
     Matches zero or more occurrences, ex: `a*`
     '''
     val: Construction
+
+@dataclass(frozen=True, slots=True)
+class Repeat(Construction):
+    '''
+    Matches between `min` and `max` occurrences, ex: `a{2,5}`.
+    A `max` of None means there's no upper limit, ex: `a{2,}`
+    '''
+    val: Construction
+    min: int
+    max: int | None
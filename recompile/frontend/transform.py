@@ -0,0 +1,331 @@
+from dataclasses import fields, replace
+from functools import singledispatch
+import operator
+
+from . import syntax as syn
+
+@singledispatch
+def reverse(val) -> syn.Construction:
+    '''
+    Build the syntax tree of a regex that matches the reverse of every string `val` matches.
+    '''
+    raise AssertionError(f"Unexpected type for val {type(val)}")
+
+@reverse.register
+def _(val: syn.Literal | syn.WildCard | syn.CharSet) -> syn.Construction:
+    return val
+
+@reverse.register
+def _(val: syn.Group) -> syn.Construction:
+    return replace(val, expression=reverse(val.expression))
+
+@reverse.register
+def _(val: syn.Sequence) -> syn.Construction:
+    return replace(val, val=[reverse(v) for v in reversed(val.val)])
+
+@reverse.register
+def _(val: syn.Alternatives) -> syn.Construction:
+    return replace(val, alt1=reverse(val.alt1), alt2=reverse(val.alt2))
+
+@reverse.register
+def _(val: syn.Option | syn.Some | syn.Any | syn.Repeat) -> syn.Construction:
+    return replace(val, val=reverse(val.val))
+
+def share(val: syn.Construction,
+          table: dict[tuple, syn.Construction] | None = None) -> syn.Construction:
+    '''
+    Hash-cons a syntax tree, so that equal subtrees become the same object, and code_gen only
+    generates code for each of them once. Pass the same `table` to share subtrees between trees.
+    Nodes that only differ in where they were parsed keep the position of the first one.
+    '''
+    if table is None:
+        table = {}
+    # Children are shared first, so nodes are told apart by the ids of their children rather
+    # than by comparing whole subtrees.
+    key: list = [type(val)]
+    children: dict[str, syn.Construction | tuple[syn.Construction, ...]] = {}
+    for f in fields(val):
+        if not f.compare:
+            continue
+        value = getattr(val, f.name)
+        if isinstance(value, syn.Construction):
+            child = share(value, table)
+            key.append(id(child))
+            if child is not value:
+                children[f.name] = child
+        elif isinstance(val, syn.Sequence):
+            items = tuple(share(v, table) for v in value)
+            key.append(tuple(map(id, items)))
+            if any(map(operator.is_not, items, value)):
+                children[f.name] = items
+        else:
+            key.append(value)
+
+    found = table.get(tuple(key))
+    if found is None:
+        found = table[tuple(key)] = replace(val, **children) if children else val
+    return found
+
+# Unicode scalar values, which are all the code points UTF-8 can encode.
+_SCALAR_VALUES = [(0, 0xD7FF), (0xE000, 0x10FFFF)]
+
+@singledispatch
+def utf8(val) -> syn.Construction:
+    '''
+    Lower a syntax tree over code points to one that matches their UTF-8 encodings a byte at a
+    time. ASCII is left as it is. Literal bytes are Literals of the characters 0x80-0xFF, and
+    sets of code points become alternatives of byte sequences, with common prefixes and suffixes
+    shared. Wildcards and inverted sets only match valid UTF-8.
+    '''
+    raise AssertionError(f"Unexpected type for val {type(val)}")
+
+@utf8.register
+def _(val: syn.Literal) -> syn.Construction:
+    if val.val.isascii():
+        return val
+    return syn.Sequence([syn.Literal(chr(b), pos=val.pos) for b in val.val.encode()],
+                        pos=val.pos)
+
+@utf8.register
+def _(val: syn.WildCard) -> syn.Construction:
+    return _utf8_set(_SCALAR_VALUES, val.pos)
+
+@utf8.register
+def _(val: syn.CharSet) -> syn.Construction:
+    ranges = replace(val, inverse=False).normalized()
+    if val.inverse:
+        ranges = _subtract(_SCALAR_VALUES, ranges)
+    elif all(c_max < 0x80 for _, c_max in ranges):
+        return val
+    return _utf8_set(ranges, val.pos)
+
+@utf8.register
+def _(val: syn.Group) -> syn.Construction:
+    return replace(val, expression=utf8(val.expression))
+
+@utf8.register
+def _(val: syn.Sequence) -> syn.Construction:
+    return replace(val, val=[utf8(v) for v in val.val])
+
+@utf8.register
+def _(val: syn.Alternatives) -> syn.Construction:
+    return replace(val, alt1=utf8(val.alt1), alt2=utf8(val.alt2))
+
+@utf8.register
+def _(val: syn.Option | syn.Some | syn.Any | syn.Repeat) -> syn.Construction:
+    return replace(val, val=utf8(val.val))
+
+def _subtract(ranges: list[tuple[int, int]],
+              removed: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    '''
+    The parts of sorted, non-overlapping `ranges` that aren't in sorted `removed`.
+    '''
+    result = []
+    for c_min, c_max in ranges:
+        for r_min, r_max in removed:
+            if r_max < c_min or r_min > c_max:
+                continue
+            if r_min > c_min:
+                result.append((c_min, r_min - 1))
+            c_min = r_max + 1
+        if c_min <= c_max:
+            result.append((c_min, c_max))
+    return result
+
+def utf8_sequences(c_min: int, c_max: int) -> list[list[tuple[int, int]]]:
+    '''
+    Split a range of code points into sequences of byte ranges, such that the UTF-8 encodings
+    of the code points are exactly the byte strings matching one of the sequences. Surrogates
+    are left out, since they can't be encoded.
+    '''
+    result = []
+    stack = list(reversed(_subtract([(c_min, c_max)], [(0xD800, 0xDFFF)])))
+    while stack:
+        lo, hi = stack.pop()
+        # Split the range until every code point in it has the same length of encoding, and
+        # each continuation byte either is the same for all of them or covers every value.
+        split = False
+        for boundary in (0x7F, 0x7FF, 0xFFFF):
+            if lo <= boundary < hi:
+                stack += [(boundary + 1, hi), (lo, boundary)]
+                split = True
+                break
+        if not split and hi > 0x7F:
+            for i in range(1, 4):
+                mask = (1 << (6 * i)) - 1
+                if lo & ~mask == hi & ~mask:
+                    continue
+                if lo & mask != 0:
+                    stack += [((lo | mask) + 1, hi), (lo, lo | mask)]
+                    split = True
+                    break
+                if hi & mask != mask:
+                    stack += [(hi & ~mask, hi), (lo, (hi & ~mask) - 1)]
+                    split = True
+                    break
+        if not split:
+            result.append(list(zip(chr(lo).encode(), chr(hi).encode())))
+    return result
+
+def _utf8_set(ranges: list[tuple[int, int]], pos: int | None) -> syn.Construction:
+    sequences = [[(r,) for r in seq] for c_min, c_max in ranges
+                 for seq in utf8_sequences(c_min, c_max)]
+    # Share suffixes by merging the first byte of sequences that are the same after it, like
+    # the lead bytes of all the three byte encodings that continue with any two bytes.
+    heads: dict[tuple, list[tuple[int, int]]] = {}
+    for seq in sequences:
+        heads.setdefault(tuple(seq[1:]), []).extend(seq[0])
+    merged = [[tuple(sorted(head))] + list(tail) for tail, head in heads.items()]
+    return _byte_trie(merged, pos)
+
+def _byte_trie(sequences: list[list[tuple]], pos: int | None) -> syn.Construction:
+    '''
+    Build alternatives of byte sequences that share their common prefixes.
+    '''
+    rests: dict[tuple, list[list[tuple]]] = {}
+    for seq in sequences:
+        rests.setdefault(seq[0], []).append(seq[1:])
+    options: list[syn.Construction] = []
+    for head, tails in rests.items():
+        if len(head) == 1 and head[0][0] == head[0][1]:
+            node: syn.Construction = syn.Literal(chr(head[0][0]), pos=pos)
+        else:
+            node = syn.CharSet([(chr(lo), chr(hi)) for lo, hi in head], [], False, pos=pos)
+        # Encodings never start with another encoding, so the tails are all empty or none are.
+        if tails[0]:
+            node = syn.Sequence([node, _byte_trie(tails, pos)], pos=pos)
+        options.append(node)
+    result = options[-1]
+    for option in reversed(options[:-1]):
+        result = syn.Alternatives(option, result, pos=pos)
+    return result
+
+# The items of a branch of an alternation: literal characters as strings, anything else as it is.
+_Item = str | syn.Construction
+
+# Alternations with more branches than this are balanced even when nothing can be shared, so
+# that the code generator doesn't recurse once per branch.
+_MAX_CHAIN = 32
+
+@singledispatch
+def factor(val) -> syn.Construction:
+    '''
+    Rewrite alternations whose branches start (or end) with the same literal characters, like
+    the words of a dictionary, into a trie that matches each shared prefix (or suffix) once,
+    e.g. `foo|foobar|fizz` becomes `f(oo(bar)?|izz)`. Only the overall match can be extracted,
+    so the order of the branches doesn't matter and they can be regrouped freely.
+    '''
+    raise AssertionError(f"Unexpected type for val {type(val)}")
+
+@factor.register
+def _(val: syn.Literal | syn.WildCard | syn.CharSet) -> syn.Construction:
+    return val
+
+@factor.register
+def _(val: syn.Group) -> syn.Construction:
+    return replace(val, expression=factor(val.expression))
+
+@factor.register
+def _(val: syn.Sequence) -> syn.Construction:
+    return replace(val, val=[factor(v) for v in val.val])
+
+@factor.register
+def _(val: syn.Option | syn.Some | syn.Any | syn.Repeat) -> syn.Construction:
+    return replace(val, val=factor(val.val))
+
+@factor.register
+def _(val: syn.Alternatives) -> syn.Construction:
+    # Alternatives nest to the right, and long chains are walked without recursing.
+    chain: list[syn.Alternatives] = []
+    node: syn.Construction = val
+    while isinstance(node, syn.Alternatives):
+        chain.append(node)
+        node = node.alt2
+    branches = [factor(n.alt1) for n in chain] + [factor(node)]
+
+    items = [_items(branch) for branch in branches]
+    if not _shares(items) and len(branches) <= _MAX_CHAIN:
+        result = branches[-1]
+        for n, branch in zip(reversed(chain), reversed(branches[:-1])):
+            result = replace(n, alt1=branch, alt2=result)
+        return result
+    result = _trie(items, val.pos)
+    # Empty branches can't be written, so at least one branch is left.
+    assert result is not None
+    return result
+
+def _items(val: syn.Construction) -> list[_Item]:
+    if isinstance(val, syn.Literal):
+        return [val.val]
+    elif isinstance(val, syn.Sequence):
+        return [item for v in val.val for item in _items(v)]
+    return [val]
+
+def _shares(branches: list[list[_Item]]) -> bool:
+    '''
+    Whether two branches start, or two end, with the same literal character.
+    '''
+    for index in (0, -1):
+        chars = [b[index] for b in branches if b and isinstance(b[index], str)]
+        if len(set(chars)) < len(chars):
+            return True
+    return False
+
+def _trie(branches: list[list[_Item]], pos: int | None) -> syn.Construction | None:
+    '''
+    Build a construction matching any of the branches, sharing their common prefixes and
+    suffixes. Returns None if the only branch is empty.
+    '''
+    optional = any(not b for b in branches)
+    branches = [b for b in branches if b]
+    if not branches:
+        return None
+
+    options: list[syn.Construction] = []
+    # Group branches by the literal they start with if any two share one, and otherwise by the
+    # literal they end with.
+    for index in (0, -1):
+        groups: dict[str, list[list[_Item]]] = {}
+        rest: list[list[_Item]] = []
+        for b in branches:
+            if isinstance(b[index], str):
+                groups.setdefault(b[index], []).append(b[1:] if index == 0 else b[:-1])
+            else:
+                rest.append(b)
+        if all(len(group) == 1 for group in groups.values()):
+            continue
+        for c, group in groups.items():
+            shared = syn.Literal(c, pos=pos)
+            parts = [shared, _trie(group, pos)] if index == 0 else [_trie(group, pos), shared]
+            options.append(_sequence([p for p in parts if p is not None], pos))
+        options += [_sequence(_constructions(b, pos), pos) for b in rest]
+        break
+    else:
+        options = [_sequence(_constructions(b, pos), pos) for b in branches]
+
+    result = _balanced(options, pos)
+    return syn.Option(result, pos=pos) if optional else result
+
+def _constructions(items: list[_Item], pos: int | None) -> list[syn.Construction]:
+    return [syn.Literal(i, pos=pos) if isinstance(i, str) else i for i in items]
+
+def _sequence(parts: list[syn.Construction], pos: int | None) -> syn.Construction:
+    flat = [v for p in parts for v in (p.val if isinstance(p, syn.Sequence) else [p])]
+    return flat[0] if len(flat) == 1 else syn.Sequence(flat, pos=pos)
+
+def _balanced(options: list[syn.Construction], pos: int | None) -> syn.Construction:
+    '''
+    Alternatives of the options, nested as a balanced tree rather than a chain. Single
+    characters are merged into one set.
+    '''
+    chars = [o.val for o in options if isinstance(o, syn.Literal)]
+    if len(chars) > 1:
+        options = [syn.CharSet([], chars, False, pos=pos)] \
+            + [o for o in options if not isinstance(o, syn.Literal)]
+    return _nest(options, pos)
+
+def _nest(options: list[syn.Construction], pos: int | None) -> syn.Construction:
+    if len(options) == 1:
+        return options[0]
+    middle = len(options) // 2
+    return syn.Alternatives(_nest(options[:middle], pos), _nest(options[middle:], pos), pos=pos)
@@ -0,0 +1,239 @@
+'''
+A grep-like search of files with a compiled regex, spread over a pool of processes.
+
+Files are split into line-aligned shards of about `shard_size` bytes, so that one big file keeps
+every worker busy. Lines are searched independently, so a shard never needs to see the input on
+either side of it. The program is assembled once and handed to each worker when it starts,
+rather than being sent or recompiled with every shard.
+
+Results come back shard by shard in the order of the input, as soon as each one and those before
+it are done, so the output of a big file is written as it is found rather than all at the end.
+'''
+import argparse
+from collections.abc import Iterator
+from dataclasses import dataclass
+from functools import partial
+import multiprocessing
+import os
+import sys
+
+from . import compiler, runner
+from .backend import packed
+from .frontend import analysis
+
+DEFAULT_SHARD_SIZE = 8 << 20
+
+@dataclass
+class Shard:
+    '''
+    The lines of a file from byte `start` up to byte `end`. Both are at the start of a line (or
+    the end of the file).
+    '''
+    path: str
+    start: int
+    end: int
+
+@dataclass
+class Options:
+    count: bool = False
+    only_matching: bool = False
+
+@dataclass
+class ShardResult:
+    '''
+    What searching one shard found: the number of matching lines and the output lines (see
+    `search_shard`). `last` is set on the last result of each file. Files that can't be read
+    have a single result with the error.
+    '''
+    path: str
+    count: int
+    output: list[bytes]
+    last: bool
+    error: OSError | None = None
+
+# A shard to search, and whether it's the last of its file. Files that can't be split into
+# shards are passed on as the error instead.
+_Task = tuple[Shard, bool] | tuple[str, OSError]
+
+# The program and prefilter of a worker process, set up by _init_worker.
+_program: packed.PackedProgram | None = None
+_prefilter: analysis.Prefilter | None = None
+
+def _init_worker(binary: bytes, prefilter: analysis.Prefilter):
+    global _program, _prefilter
+    _program = packed.PackedProgram.from_bytes(binary)
+    _prefilter = prefilter
+
+def files(paths: list[str]) -> Iterator[str]:
+    '''
+    Expand directories into the files below them, in sorted order.
+    '''
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            for name in sorted(names):
+                yield os.path.join(root, name)
+
+def shards(path: str, shard_size: int = DEFAULT_SHARD_SIZE) -> list[Shard]:
+    '''
+    Split a file into shards of about `shard_size` bytes, each ending at the end of a line.
+    '''
+    size = os.path.getsize(path)
+    result = []
+    start = 0
+    with open(path, 'rb') as f:
+        while start < size:
+            end = start + shard_size
+            if end < size:
+                # Move the boundary past the end of the line it falls in.
+                f.seek(end)
+                end += len(f.readline())
+            end = min(end, size)
+            result.append(Shard(path, start, end))
+            start = end
+    return result
+
+def search_shard(shard: Shard, options: Options) -> tuple[int, list[bytes]]:
+    '''
+    Search the lines of a shard in a worker. Returns the number of matching lines, and the
+    matching lines (or just the matches with `only_matching`) unless counting.
+    '''
+    assert _program is not None and _prefilter is not None
+    with open(shard.path, 'rb') as f:
+        f.seek(shard.start)
+        data = f.read(shard.end - shard.start)
+
+    # Skip shards that lack a literal every match needs.
+    if any(literal.encode('latin-1') not in data for literal in _prefilter.required):
+        return (0, [])
+
+    count = 0
+    output: list[bytes] = []
+    lines = data.split(b'\n')
+    if lines[-1] == b'':
+        lines.pop()
+    for line in lines:
+        if options.only_matching:
+            matches = [line[start:end] for start, end in
+                       runner.finditer(line, _program, _prefilter) if end > start]
+            if matches:
+                count += 1
+                if not options.count:
+                    output += matches
+        elif runner.search_bytes(line, _program, prefilter=_prefilter) is not None:
+            count += 1
+            if not options.count:
+                output.append(line)
+    return (count, output)
+
+def _tasks(paths: list[str], shard_size: int) -> Iterator[_Task]:
+    for path in files(paths):
+        try:
+            path_shards = shards(path, shard_size)
+        except OSError as e:
+            yield (path, e)
+            continue
+        if not path_shards:
+            # Empty files still get a result.
+            path_shards = [Shard(path, 0, 0)]
+        for i, shard in enumerate(path_shards):
+            yield (shard, i == len(path_shards) - 1)
+
+def _run_task(options: Options, task: _Task) -> ShardResult:
+    if isinstance(task[0], str):
+        return ShardResult(task[0], 0, [], True, task[1])
+    shard, last = task
+    try:
+        count, output = search_shard(shard, options)
+    except OSError as e:
+        return ShardResult(shard.path, 0, [], True, e)
+    return ShardResult(shard.path, count, output, last)
+
+def search_files(regex: str, paths: list[str], options: Options = Options(),
+                 jobs: int | None = None, shard_size: int = DEFAULT_SHARD_SIZE,
+                 utf8: bool = False) -> Iterator[ShardResult]:
+    '''
+    Search every line of the files (or directories) in `paths` for `regex`, and yield the result
+    of each shard in order. `jobs` is the number of worker processes, by default one per CPU.
+    With one job everything runs in this process. With `utf8` the regex is compiled for UTF-8
+    files, see compiler.compile_regex.
+    '''
+    binary = compiler.compile_bin(regex, utf8=utf8)
+    prefilter = compiler.compile_prefilter(regex, utf8)
+    tasks = _tasks(paths, shard_size)
+    run = partial(_run_task, options)
+    if jobs == 1:
+        _init_worker(binary, prefilter)
+        yield from map(run, tasks)
+        return
+    with multiprocessing.Pool(jobs, _init_worker, (binary, prefilter)) as pool:
+        # imap hands results back in the order of the tasks, whichever worker finishes first,
+        # and reads the tasks as it goes rather than all up front.
+        yield from pool.imap(run, tasks)
+
+def grep(regex: str, paths: list[str], options: Options = Options(), jobs: int | None = None,
+         shard_size: int = DEFAULT_SHARD_SIZE,
+         utf8: bool = False) -> Iterator[tuple[str, int, list[bytes]]]:
+    '''
+    Like `search_files`, but yield the results of each file together: its path, the number of
+    matching lines and the output lines. Raises the OSError of a file that can't be read.
+    '''
+    count = 0
+    output: list[bytes] = []
+    for result in search_files(regex, paths, options, jobs, shard_size, utf8):
+        if result.error is not None:
+            raise result.error
+        count += result.count
+        output += result.output
+        if result.last:
+            yield (result.path, count, output)
+            count = 0
+            output = []
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='recompiler grep',
+        description="Print the lines of files that match a regex.")
+    parser.add_argument('regex', help="The regular expression to search for.")
+    parser.add_argument('paths', nargs='+', help="Files or directories to search.")
+    parser.add_argument('-c', '--count', action='store_true',
+                        help="Print the number of matching lines of each file instead.")
+    parser.add_argument('-o', '--only-matching', action='store_true',
+                        help="Print each match on a line of its own instead of the whole line.")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="Number of worker processes (default: one per CPU).")
+    parser.add_argument('-u', '--utf8', action='store_true',
+                        help="Match characters of UTF-8 files rather than bytes.")
+    parser.add_argument('--shard-size', type=int, default=DEFAULT_SHARD_SIZE,
+                        help="Split files into pieces of about this many bytes.")
+    args = parser.parse_args(argv)
+
+    options = Options(args.count, args.only_matching)
+    # Like grep, name the file on each line when there could be more than one.
+    with_names = len(args.paths) > 1 or any(os.path.isdir(path) for path in args.paths)
+    out = sys.stdout.buffer
+    found = failed = False
+    count = 0
+    for result in search_files(args.regex, args.paths, options, args.jobs, args.shard_size,
+                               args.utf8):
+        if result.error is not None:
+            # Like grep, report the file and carry on with the others.
+            out.flush()
+            print(f"recompiler grep: {result.path}: {result.error.strerror or result.error}",
+                  file=sys.stderr)
+            failed = True
+            continue
+        found = found or result.count > 0
+        prefix = result.path.encode() + b':' if with_names else b''
+        for line in result.output:
+            out.write(prefix + line + b'\n')
+        count += result.count
+        if result.last:
+            if args.count:
+                out.write(prefix + str(count).encode() + b'\n')
+            count = 0
+    out.flush()
+    return 2 if failed else 0 if found else 1
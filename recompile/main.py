@@ -3,9 +3,22 @@
 import argparse
 import sys
 
-from . import compiler
+from . import bulk, compiler, grep, profiler, runner, simulator
+from .backend import packed
+from .bench import suite
+
+# Subcommands, which have their own arguments.
+_commands = {
+    'bench': suite.main,
+    'bulk': bulk.main,
+    'grep': grep.main,
+    'simulate': simulator.main,
+}
 
 def main():
+    if len(sys.argv) > 1 and sys.argv[1] in _commands:
+        sys.exit(_commands[sys.argv[1]](sys.argv[2:]))
+
     parser = argparse.ArgumentParser(description='A regex compiler for a custom ISA.')
     input_group = parser.add_mutually_exclusive_group(required=True)
     input_group.add_argument('-r', '--regex', help="The regular expression to compile.")
@@ -14,25 +27,63 @@ def main():
         '-s', '--asm', action='store_true',
         help="Compile the regex to assembly code without assembling it.")
     parser.add_argument('-o', '--out-file', help="File to write the compiled output to.")
+    parser.add_argument(
+        '-m', '--multi', action='store_true',
+        help="Compile every line of the file into one program, using line numbers (from 0) as "
+             "match IDs. Binaries get a .json file listing the patterns beside them.")
+    parser.add_argument(
+        '-c', '--class-table', action='store_true',
+        help="Use Class instructions with a lookup table for character sets.")
+    parser.add_argument(
+        '-u', '--utf8', action='store_true',
+        help="Compile non-ASCII characters, wildcards and inverted sets to match UTF-8 bytes.")
+    parser.add_argument(
+        '-p', '--profile', metavar='INPUT',
+        help="Search INPUT with the compiled program and print the assembly code annotated with "
+             "how often each instruction ran.")
+    parser.add_argument(
+        '-e', '--engine', choices=runner.ENGINES, default='pike',
+        help="The engine to search with when profiling.")
     args = parser.parse_args()
 
+    if args.multi and not args.file:
+        parser.error("--multi needs a file of patterns")
+
     if args.file:
         with open(args.file, "r") as f:
+            lines = f.read().split('\n')
+        if args.multi:
+            patterns = [line for line in lines if line]
+        else:
             # Just read the first line
-            regex_src = f.read().split('\n')[0]
+            regex_src = lines[0]
     else:
         regex_src = args.regex
 
     # Compile the code
     compiled: str | bytes = ''
-    if args.asm:
-        compiled = compiler.compile_asm(regex_src)
+    if args.profile:
+        code = compiler.compile_multi(patterns, class_table=args.class_table, utf8=args.utf8) \
+            if args.multi \
+            else compiler.compile_regex(regex_src, class_table=args.class_table, utf8=args.utf8)
+        with open(args.profile, "rb") as f:
+            data = f.read()
+        profile = profiler.Profile()
+        span = runner.search_bytes(data, code, args.engine, profile=profile)
+        compiled = f"# match: {span}\n" + profiler.annotate(code, profile)
+        file_mode = "w"
+    elif args.asm:
+        compiled = compiler.compile_multi_asm(
+            patterns, class_table=args.class_table, utf8=args.utf8) if args.multi \
+            else compiler.compile_asm(regex_src, class_table=args.class_table, utf8=args.utf8)
         file_mode = "w"
     else:
-        compiled = compiler.compile_bin(regex_src)
+        compiled = compiler.compile_multi_bin(
+            patterns, class_table=args.class_table, utf8=args.utf8) if args.multi \
+            else compiler.compile_bin(regex_src, class_table=args.class_table, utf8=args.utf8)
         file_mode = "wb"
 
-    match (args.out_file, args.asm):
+    match (args.out_file, args.asm or bool(args.profile)):
         case (None, True):
             out_file = None
         case (None, False):
@@ -43,12 +94,18 @@ def main():
 
     if out_file is None:
         lines = compiled.splitlines()
-        print(lines[0])
-        for i, inst in enumerate(lines[1:]):
+        # Print the header comments as they are and number the instructions.
+        header_length = next(i for i, line in enumerate(lines) if not line.startswith('#'))
+        for line in lines[:header_length]:
+            print(line)
+        for i, inst in enumerate(lines[header_length:]):
             print(f"{i:3d}: {inst}")
     else:
         with open(out_file, file_mode) as f:
             f.write(compiled)
+        if args.multi and file_mode == 'wb':
+            # The binary only holds match IDs, so keep the patterns they stand for beside it.
+            packed.save_patterns(out_file, patterns)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,141 @@
+'''
+A push-style matcher for data that arrives a piece at a time, such as from a socket.
+
+The matcher finds the same matches as runner.finditer would over all of the data at once: the
+non-overlapping leftmost-longest matches, from left to right. A match is reported as soon as
+nothing later in the input could change it, which is once every thread that could still find
+an earlier or longer match has died.
+
+Only the input from the start of the earliest thread still running is kept. When a match is
+reported, the scan for the next one resumes from its end, so the input after it is gone over
+again. Apart from that, each chunk takes time proportional to its own length, however much
+came before it.
+'''
+import asyncio
+from collections.abc import AsyncIterator
+from dataclasses import dataclass
+
+from . import runner
+from .backend import instruction as inst, packed
+
+@dataclass
+class Match:
+    # Offsets from the start of the stream.
+    start: int
+    end: int
+    data: bytes
+
+class Matcher:
+    '''
+    Feed chunks of a stream to a compiled program and collect its matches as they complete.
+    Programs are expected to have a single capture group, like those built by
+    compiler.compile_regex.
+    '''
+    def __init__(self, program: packed.Program):
+        self.program = packed.pack(program)
+        self._unset = (-1,) * self.program.slot_count()
+        self.reset()
+
+    def reset(self):
+        '''
+        Forget everything fed so far, and start a new stream at offset 0.
+        '''
+        self._buffer = bytearray()
+        # Stream offset of the first byte in the buffer.
+        self._base = 0
+        # Set once no more matches are possible, e.g. when an anchored program fails.
+        self._finished = False
+        self._restart(0)
+
+    def feed(self, chunk: bytes | bytearray | memoryview) -> list[Match]:
+        '''
+        Search the next chunk of the stream, and return the matches that are now complete.
+        '''
+        if self._finished:
+            return []
+        self._buffer += chunk
+        matches = self._run(at_end=False)
+        self._trim()
+        return matches
+
+    def flush(self) -> list[Match]:
+        '''
+        Signal the end of the stream and return the remaining matches. The matcher is then
+        reset, ready for a new stream.
+        '''
+        matches = [] if self._finished else self._run(at_end=True)
+        self.reset()
+        return matches
+
+    def _restart(self, sc: int):
+        self._threads = [(0, self._unset)]
+        self._best: tuple[int, int] | None = None
+        self._sc = sc
+        # Positions before `sc` may be stepped over again, so nothing seen there counts.
+        self._seen = [-1] * len(self.program)
+
+    def _run(self, at_end: bool) -> list[Match]:
+        found: list[Match] = []
+        buffer = self._buffer
+        end_of_data = self._base + len(buffer)
+        while True:
+            while self._threads and self._sc < end_of_data:
+                self._step(buffer[self._sc - self._base], False)
+                self._sc += 1
+            if self._threads:
+                if not at_end:
+                    # Wait for more input.
+                    return found
+                self._step(inst.END_OF_INPUT, True)
+
+            if self._best is None:
+                self._finished = True
+                return found
+            start, end = self._best
+            found.append(Match(start, end, bytes(buffer[start - self._base:end - self._base])))
+            # Resume after the match, or one past it if it was empty.
+            resume = end if end > start else end + 1
+            if at_end and resume > end_of_data:
+                self._finished = True
+                return found
+            self._restart(resume)
+
+    def _step(self, c: int, at_end: bool):
+        self._threads, matches = runner.pike_step(
+            self.program, self._threads, c, self._sc, at_end, self._seen)
+        best = self._best
+        for _, start, end in matches:
+            if best is None or start < best[0] or (start == best[0] and end > best[1]):
+                best = (start, end)
+        if best is not None:
+            # Only threads that started no later than the match can still beat it.
+            self._threads = [t for t in self._threads if 0 <= t[1][0] <= best[0]]
+        self._best = best
+
+    def _trim(self):
+        '''
+        Drop the input before the start of every match that is still in progress.
+        '''
+        starts = [saves[0] for _, saves in self._threads if saves[0] >= 0]
+        if self._best is not None:
+            starts.append(self._best[0])
+        keep = min(starts, default=self._sc)
+        # Deleting from the front copies the rest, so only do it once it frees half the buffer.
+        if keep - self._base >= len(self._buffer) // 2:
+            del self._buffer[:keep - self._base]
+            self._base = keep
+
+async def stream_matches(reader: asyncio.StreamReader, program: packed.Program,
+                         chunk_size: int = 1 << 16) -> AsyncIterator[Match]:
+    '''
+    Yield the matches of a program in an asyncio stream as they complete, until the stream
+    ends. Chunks of at most `chunk_size` bytes are searched between reads, and control goes
+    back to the event loop after each one, so other tasks keep running while data is searched.
+    '''
+    matcher = Matcher(program)
+    while chunk := await reader.read(chunk_size):
+        for match in matcher.feed(chunk):
+            yield match
+        await asyncio.sleep(0)
+    for match in matcher.flush():
+        yield match
@@ -0,0 +1,91 @@
+'''
+Opt-in instrumentation for the search engines.
+
+Pass a Profile to runner.search (or runner.PikeVM) and runner.pike_step counts what the Pike VM
+does as it steps through the input. Searches without a Profile skip the counting.
+'''
+from dataclasses import dataclass, field
+
+from .backend import instruction as inst, packed
+from .dfa import CacheStats, LazyDFA
+
+@dataclass
+class Profile:
+    '''
+    Execution statistics gathered by instrumented searches. A Profile can be passed to several
+    searches of the same program to add up their statistics.
+    '''
+    # Number of times each pc was executed.
+    executions: list[int] = field(default_factory=list)
+    # Number of new threads each Split started, i.e. destinations not already visited at the
+    # same input position.
+    forks: list[int] = field(default_factory=list)
+    # Number of live threads at each input position stepped over.
+    live_threads: list[int] = field(default_factory=list)
+    # States and cache statistics of the lazy DFA, when the 'dfa' engine was used.
+    dfa_states: int | None = None
+    dfa_stats: CacheStats | None = None
+
+    @property
+    def steps(self) -> int:
+        return sum(self.executions)
+
+    @property
+    def positions(self) -> int:
+        return len(self.live_threads)
+
+    @property
+    def steps_per_byte(self) -> float:
+        return self.steps / self.positions if self.positions else 0.0
+
+    @property
+    def peak_threads(self) -> int:
+        return max(self.live_threads, default=0)
+
+    @property
+    def mean_threads(self) -> float:
+        return sum(self.live_threads) / self.positions if self.positions else 0.0
+
+    def fanout(self, pc: int) -> float:
+        '''
+        The average number of new threads the Split at `pc` started each time it ran.
+        '''
+        return self.forks[pc] / self.executions[pc] if self.executions[pc] else 0.0
+
+    def prepare(self, program: packed.PackedProgram):
+        '''
+        Make room for the counters of every pc in a program.
+        '''
+        missing = len(program) - len(self.executions)
+        if missing > 0:
+            self.executions += [0] * missing
+            self.forks += [0] * missing
+
+    def record_dfa(self, dfa: LazyDFA):
+        self.dfa_states = dfa.state_count()
+        self.dfa_stats = CacheStats(**vars(dfa.stats))
+
+def annotate(code: list[inst.Instruction], profile: Profile) -> str:
+    '''
+    List a program in the format of compiler.compile_asm, with a header summarizing the profile
+    and the execution count of each instruction (and the fan-out of each Split) after it.
+    '''
+    total = profile.steps
+    header = f"# positions: {profile.positions}, steps: {total}, " \
+             f"steps per byte: {profile.steps_per_byte:.2f}\n" \
+             f"# live threads: peak {profile.peak_threads}, mean {profile.mean_threads:.2f}\n"
+    if profile.dfa_stats is not None:
+        stats = profile.dfa_stats
+        header += f"# dfa states: {profile.dfa_states}, hits: {stats.hits}, " \
+                  f"misses: {stats.misses}, flushes: {stats.flushes}\n"
+
+    width = max((len(i.code()) for i in code), default=0)
+    lines = []
+    for pc, i in enumerate(code):
+        count = profile.executions[pc] if pc < len(profile.executions) else 0
+        share = 100 * count / total if total else 0.0
+        line = f"{i.code():<{width}}  ; {count} ({share:.1f}%)"
+        if isinstance(i, inst.Split):
+            line += f", fan-out {profile.fanout(pc):.2f}"
+        lines.append(line)
+    return header + '\n'.join(lines)
@@ -1,61 +1,559 @@
-from .backend import instruction as inst
-import copy
-
-def search(s: str, regex: list[inst.Instruction]) -> str | None:
-    matches = []
-    execution_step(regex, s, {}, matches, 0, 0)
-    longest_match: str | None = None
-
-    for start, end in matches:
-        if (longest_match is None) or len(longest_match) < end - start:
-            longest_match = s[start:end]
-
-    return longest_match
-
-def execution_step(
-        program: list[inst.Instruction],
-        s: str,
-        save_data: dict[int, int],
-        matches: list[tuple[int, int]],
-        pc: int,
-        sc: int
-):
-    i = program[pc]
-    next_pc = pc+1
-
-    if sc > len(s):
+from .backend import instruction as inst, packed, specialize
+from .backend.assembler import Opcode
+from .frontend import analysis
+from . import backtrack, compiler, dfa as lazy_dfa, profiler
+from collections import OrderedDict
+from collections.abc import Callable, Iterable, Iterator
+from functools import partial
+from operator import length_hint
+from typing import BinaryIO
+import mmap
+
+ENGINES = ('pike', 'dfa', 'backtrack', 'specialized')
+
+# Objects that can be searched directly as bytes.
+ByteInput = bytes | bytearray | memoryview | mmap.mmap
+
+# The reverse DFAs the 'dfa' engine built for the programs it searched with last, see
+# `_default_reverse`.
+MAX_REVERSE = 64
+_reverse: OrderedDict[packed.PackedProgram, lazy_dfa.LazyDFA | None] = OrderedDict()
+
+def search(s: str, regex: packed.Program, engine: str = 'pike',
+           dfa: lazy_dfa.LazyDFA | None = None,
+           prefilter: analysis.Prefilter | None = None,
+           profile: profiler.Profile | None = None,
+           reverse: lazy_dfa.LazyDFA | packed.Program | None = None) -> str | None:
+    '''
+    Find the longest match of a compiled regex in a string.
+    If several matches have the same length, the one that starts first is returned.
+
+    With the 'dfa' engine the input is first scanned by a lazy DFA, which can only tell whether
+    the program matches. Inputs that don't match are rejected by that scan alone. Pass a LazyDFA
+    built for `regex` as `dfa` to reuse its transition cache across searches.
+
+    The 'dfa' engine then finds the span with the reverse of the regex (see
+    compiler.compile_reverse, or a LazyDFA built for it), without the Pike VM. The scan reports
+    the end of every match, and from each end the reverse program runs backwards to find where
+    the longest match ending there starts. The reverse is passed as `reverse`, or else compiled
+    and cached the first time a program from compiler.compile_regex is searched. For other
+    programs, like those built by compiler.compile_multi, the Pike VM finds the span instead,
+    over the input up to where the last match ends.
+
+    Passing the regex's prefilter (see compiler.compile_prefilter) lets the search reject inputs
+    that are too short or lack a required literal without running any engine. When a match can
+    only start with a few different characters, the search also skips straight to them.
+
+    The 'backtrack' engine always searches with the bit-state backtracker in backtrack.py. The
+    'specialized' engine runs a Python function generated for the program, see
+    backend/specialize.py. The 'pike' and 'dfa' engines use the backtracker in place of the Pike
+    VM whenever its visited bitmap would fit in backtrack.MAX_BITMAP_BITS, which is faster on
+    short inputs, unless a prefilter lets the Pike VM skip to the characters a match can start
+    with.
+
+    Passing a profiler.Profile collects execution statistics while searching, see profiler.py.
+    Only the Pike VM is instrumented, so profiled searches never use the backtracker.
+    '''
+    span = _search(s, regex, engine, dfa, prefilter, profile, reverse)
+    if span is None:
+        return None
+    start, end = span
+    return s[start:end]
+
+def search_bytes(data: ByteInput, program: packed.Program, engine: str = 'pike',
+                 dfa: lazy_dfa.LazyDFA | None = None,
+                 prefilter: analysis.Prefilter | None = None,
+                 profile: profiler.Profile | None = None,
+                 reverse: lazy_dfa.LazyDFA | packed.Program | None = None
+                 ) -> tuple[int, int] | None:
+    '''
+    Find the (start, end) offsets of the longest match in a bytes-like object such as bytes,
+    bytearray, memoryview or mmap. The data is never copied or decoded.
+    '''
+    if not isinstance(data, bytes | bytearray | mmap.mmap):
+        data = memoryview(data).cast('B')
+    return _search(data, program, engine, dfa, prefilter, profile, reverse)
+
+def _search(data: str | ByteInput, program: packed.Program, engine: str,
+            dfa: lazy_dfa.LazyDFA | None,
+            prefilter: analysis.Prefilter | None,
+            profile: profiler.Profile | None = None,
+            reverse: lazy_dfa.LazyDFA | packed.Program | None = None
+            ) -> tuple[int, int] | None:
+    if prefilter is not None and _rejected(data, prefilter):
+        return None
+
+    match engine:
+        case 'pike' | 'backtrack' | 'specialized':
+            pass
+        case 'dfa':
+            if dfa is None:
+                dfa = lazy_dfa.LazyDFA(program)
+            if reverse is None:
+                reverse = _default_reverse(program)
+            if reverse is not None:
+                if not isinstance(reverse, lazy_dfa.LazyDFA):
+                    reverse = lazy_dfa.LazyDFA(reverse)
+                done, span = _search_reverse(data, dfa, reverse)
+                if profile is not None:
+                    profile.record_dfa(dfa)
+                if done:
+                    return span
+            end = dfa.find_last_end(_dfa_codes(data))
+            if profile is not None:
+                profile.record_dfa(dfa)
+            if end is None:
+                return None
+            # No match goes past the last place one ends, so the rest isn't searched again.
+            data = data[:end] if isinstance(data, str) else memoryview(data)[:end]
+        case _:
+            raise ValueError(f"Unknown engine '{engine}', expected one of {ENGINES}")
+
+    if profile is None:
+        program = packed.pack(program)
+        if engine == 'specialized':
+            return specialize.matcher(program)(_codes(data))
+        if engine == 'backtrack':
+            return backtrack.search_span(data, program)
+
+    # The backtracker always starts at the beginning, so it isn't picked when the prefilter can
+    # skip to the places a match can start.
+    next_candidate = _next_candidate(data, prefilter)
+    if next_candidate is not None:
+        return _search_candidates(data, program, next_candidate, profile)
+    if profile is None and backtrack.fits(program, len(data)):
+        return backtrack.search_span(data, program)
+    return search_span(_codes(data), program, profile)
+
+def _default_reverse(program: packed.Program) -> lazy_dfa.LazyDFA | None:
+    '''
+    A DFA for the reverse of a program, if it was built by compiler.compile_regex. It is kept
+    for the next search with the same program, so its transition cache is reused.
+    '''
+    program = packed.pack(program)
+    if program in _reverse:
+        _reverse.move_to_end(program)
+        return _reverse[program]
+    code = compiler.reverse_of(program)
+    reverse = _reverse[program] = None if code is None else lazy_dfa.LazyDFA(code)
+    while len(_reverse) > MAX_REVERSE:
+        _reverse.popitem(last=False)
+    return reverse
+
+def _codes(data: str | ByteInput) -> Iterable[int]:
+    if isinstance(data, str):
+        return map(ord, data)
+    elif isinstance(data, mmap.mmap):
+        # Iterating over an mmap gives single-byte bytes objects rather than ints.
+        return memoryview(data)
+    return data
+
+def _dfa_codes(data: str | ByteInput) -> Iterable[int]:
+    if not isinstance(data, str):
+        return _codes(data)
+    try:
+        return data.encode('latin-1')
+    except UnicodeEncodeError:
+        return (c if c <= 0xFF else lazy_dfa.WIDE_CHAR for c in map(ord, data))
+
+def _search_reverse(data: str | ByteInput, forward: lazy_dfa.LazyDFA,
+                    reverse: lazy_dfa.LazyDFA) -> tuple[bool, tuple[int, int] | None]:
+    '''
+    Find the longest match with two DFAs and no save slots. The forward scan yields the end of
+    every match, and for each end the reverse program reads backwards from it for as long as a
+    match can still start further back. Returns whether that worked and the match. It gives up
+    when the backward scans add up to more than another pass over the input, which can happen
+    when many matches end close together, like `a*` in a run of a's.
+    '''
+    codes = _dfa_codes(data)
+    if not isinstance(codes, bytes | bytearray | memoryview):
+        codes = list(codes)
+    best: tuple[int, int] | None = None
+    budget = len(data) + 1
+    for end in forward.match_ends(codes):
+        # A longer match must start before end - len(best). One of the same length would start
+        # later than the best, so it doesn't count.
+        if best is not None and end <= best[1] - best[0]:
+            continue
+        positions = iter(range(end - 1, -1, -1))
+        length = None
+        for length in reverse.match_ends(map(codes.__getitem__, positions)):
+            pass
+        if length is not None and (best is None or length > best[1] - best[0]):
+            best = (end - length, end)
+        budget -= end - length_hint(positions)
+        if budget < 0:
+            return (False, None)
+    return (True, best)
+
+def _rejected(data: str | ByteInput, prefilter: analysis.Prefilter) -> bool:
+    '''
+    Check whether the prefilter rules out any match in the input.
+    '''
+    if len(data) < prefilter.min_length:
+        return True
+    if isinstance(data, memoryview):
+        # Memoryviews can't be searched without copying them.
+        return False
+    for literal in prefilter.required:
+        needle = literal if isinstance(data, str) else literal.encode('latin-1')
+        if data.find(needle) == -1:
+            return True
+    return False
+
+# Above this many possible first characters, searching for each of them costs more than the
+# skipping saves, so the input is searched from the start instead.
+_MAX_FIND_CHARS = 4
+
+def _next_candidate(data: str | ByteInput,
+                    prefilter: analysis.Prefilter | None) -> Callable[[int], int | None] | None:
+    '''
+    Make a function that returns the position of the next character at or after a given one
+    that a match can start with, or None if there isn't one. Returns None instead of a function
+    when the prefilter can't skip any input cheaply: there are more than _MAX_FIND_CHARS first
+    characters, the regex is anchored, or the data is a memoryview, which has no `find`.
+    '''
+    if prefilter is None or prefilter.first_chars is None or prefilter.anchored \
+            or isinstance(data, memoryview):
+        return None
+    targets: list = [chr(c) for c in prefilter.first_chars] if isinstance(data, str) \
+        else [bytes([c]) for c in prefilter.first_chars if c <= 0xFF]
+    if len(targets) > _MAX_FIND_CHARS:
+        return None
+    n = len(data)
+    # Where each target was last found, or n if it doesn't appear again.
+    next_at = dict.fromkeys(targets, -1)
+    def next_candidate(sc: int) -> int | None:
+        for t, at in next_at.items():
+            if at < sc:
+                at = data.find(t, sc)
+                next_at[t] = n if at == -1 else at
+        best = min(next_at.values(), default=n)
+        return None if best >= n else best
+    return next_candidate
+
+def _search_candidates(data: str | ByteInput, program: packed.Program,
+                       next_candidate: Callable[[int], int | None],
+                       profile: profiler.Profile | None = None) -> tuple[int, int] | None:
+    '''
+    Run the Pike VM over an unanchored program, jumping over every stretch of input where no
+    match is in progress and no match can start.
+    '''
+    as_code = ord if isinstance(data, str) else int
+    n = len(data)
+    vm = PikeVM(program, profile)
+    while True:
+        if vm.idle:
+            sc = next_candidate(vm.sc)
+            if sc is None:
+                return vm.longest
+            # Only the threads looping over the unanchored prefix are alive, and those are the
+            # same at every position as they are at the start of the program.
+            vm.restart(sc)
+        if vm.sc == n:
+            return vm.finish()
+        vm.feed((as_code(data[vm.sc]),))
+
+def search_span(codes: Iterable[int], program: packed.Program,
+                profile: profiler.Profile | None = None) -> tuple[int, int] | None:
+    '''
+    Run a program over a sequence of character codes and return the (start, end) offsets of the
+    longest match, or None if nothing matched.
+    '''
+    vm = PikeVM(program, profile)
+    vm.feed(codes)
+    return vm.finish()
+
+def search_multi(data: str | ByteInput,
+                 program: packed.Program) -> dict[int, tuple[int, int]]:
+    '''
+    Run a program built by compiler.compile_multi over a string or bytes-like object in a single
+    pass. Returns the (start, end) offsets of the longest match of each pattern that matched,
+    keyed by its match ID.
+    '''
+    if not isinstance(data, str | bytes | bytearray | mmap.mmap):
+        data = memoryview(data).cast('B')
+    vm = PikeVM(program)
+    vm.feed(_codes(data))
+    vm.finish()
+    return vm.longest_by_pattern
+
+def finditer(data: str | ByteInput, program: packed.Program,
+             prefilter: analysis.Prefilter | None = None) -> Iterator[tuple[int, int]]:
+    '''
+    Lazily yield the (start, end) offsets of every non-overlapping match in a string or
+    bytes-like object, from left to right.
+
+    Each match is the leftmost-longest one: the match that starts first, and the longest of
+    those. The scan for the next match resumes from the end of the previous one (or one past an
+    empty match), so the input is only gone over once and nothing is kept between matches.
+    Programs are expected to have a single capture group, like those built by
+    compiler.compile_regex.
+    '''
+    if not isinstance(data, str | bytes | bytearray | mmap.mmap):
+        data = memoryview(data).cast('B')
+    if prefilter is not None and _rejected(data, prefilter):
         return
-    elif sc == len(s):
-        c = 0xFF
-    else:
-        c = ord(s[sc])
-    
-    if isinstance(i, inst.Save):
-        save_data[i.index] = sc
-        if i.is_match:
-            matches.append((save_data[i.index-1], save_data[i.index]))
+    program = packed.pack(program)
+    next_candidate = _next_candidate(data, prefilter)
+
+    pos = 0
+    while pos <= len(data):
+        span = _leftmost_longest(data, program, pos, False, next_candidate)
+        if span is None:
             return
-    elif isinstance(i, inst.Split):
-        old_data = copy.deepcopy(save_data)
-        execution_step(program, s, save_data, matches, i.dest2, sc)
-        save_data = old_data
-        next_pc = i.dest1
-    elif isinstance(i, inst.AluOp):
-        in_range = c >= i.c_min and c <= i.c_max
-        is_match = in_range != i.inverted
-
-        match (i.consume, is_match):
-            case (True, False):
-                # Failed a consuming Branch, failed to match pattern
-                return
-            case (True, True):
-                sc += 1
-            case (False, True):
-                next_pc = i.dest
-            case (False, False):
-                # Nothing wrong with failing on a non-consuming branch
-                pass
-    else:
-        raise AssertionError(f"{i} is not a recognized instruction!")
-
-    execution_step(program, s, save_data, matches, next_pc, sc)
+        yield span
+        start, end = span
+        pos = end if end > start else end + 1
+
+def findall(data: str | ByteInput, program: packed.Program,
+            prefilter: analysis.Prefilter | None = None) -> Iterator[str | bytes]:
+    '''
+    Lazily yield the text of every match found by `finditer`.
+    '''
+    for start, end in finditer(data, program, prefilter):
+        yield data[start:end]
+
+def match(s: str, regex: packed.Program) -> str | None:
+    '''
+    Find the longest match that starts at the beginning of the string.
+    '''
+    span = _leftmost_longest(s, packed.pack(regex), 0, True, None)
+    if span is None:
+        return None
+    start, end = span
+    return s[start:end]
+
+def fullmatch(s: str, regex: packed.Program) -> str | None:
+    '''
+    Return the string if the whole of it matches, and None otherwise.
+    '''
+    span = _leftmost_longest(s, packed.pack(regex), 0, True, None)
+    return s if span == (0, len(s)) else None
+
+def _leftmost_longest(data: str | ByteInput, program: packed.PackedProgram, pos: int,
+                      anchored: bool,
+                      next_candidate: Callable[[int], int | None] | None) -> tuple[int, int] | None:
+    '''
+    Run the Pike VM from `pos` until the leftmost-longest match is known. If `anchored` is set,
+    only matches starting at `pos` count.
+
+    Threads are kept in order of their start, earliest first, so once a match is found every
+    thread that started after it (or hasn't started yet) can be dropped, and the scan stops as
+    soon as the threads that are left die out.
+    '''
+    as_code = ord if isinstance(data, str) else int
+    n = len(data)
+    unset = (-1,) * program.slot_count()
+    seen = [-1] * len(program)
+    threads = [(0, unset)]
+    best: tuple[int, int] | None = None
+    sc = pos
+    while True:
+        if next_candidate is not None and best is None \
+                and all(saves == unset for _, saves in threads):
+            # Nothing is in progress, so skip to where a match could start.
+            candidate = next_candidate(sc)
+            if candidate is None:
+                return None
+            threads = [(0, unset)]
+            sc = candidate
+
+        at_end = sc == n
+        c = inst.END_OF_INPUT if at_end else as_code(data[sc])
+        threads, matches = pike_step(program, threads, c, sc, at_end, seen)
+        for _, start, end in matches:
+            if best is None or start < best[0] or (start == best[0] and end > best[1]):
+                best = (start, end)
+
+        if anchored:
+            threads = [t for t in threads if t[1][0] == pos]
+        elif best is not None:
+            threads = [t for t in threads if 0 <= t[1][0] <= best[0]]
+        if at_end or not threads:
+            return best
+        sc += 1
+
+def search_stream(stream: BinaryIO, program: packed.Program,
+                  chunk_size: int = 1 << 20) -> tuple[int, int] | None:
+    '''
+    Find the (start, end) offsets of the longest match in a binary stream such as an open file.
+
+    The stream is read in chunks of `chunk_size` bytes into a single reused buffer, and the Pike
+    VM's threads are carried from one chunk to the next, so memory use doesn't depend on the size
+    of the stream and matches that cross a chunk boundary are found with their absolute offsets.
+    '''
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    vm = PikeVM(program)
+    while not vm.done:
+        n = stream.readinto(buffer)
+        if not n:
+            break
+        vm.feed(view[:n])
+    return vm.finish()
+
+class PikeVM:
+    '''
+    A resumable Pike VM: every live thread is advanced in lock-step over a single pass of the
+    input, and threads that reach the same pc at the same position are merged. Search time is
+    therefore O(len(program) * len(input)), and no recursion is needed.
+
+    The input can be fed in any number of pieces. Offsets are counted from the start of the
+    first piece. If a profile is given, pike_step counts what the VM does in it.
+    '''
+    def __init__(self, program: packed.Program, profile: profiler.Profile | None = None):
+        program = packed.pack(program)
+        slot_count = program.slot_count()
+        self.program = program
+        self.longest: tuple[int, int] | None = None
+        # The longest match of each pattern in programs built by compiler.compile_multi.
+        self.longest_by_pattern: dict[int, tuple[int, int]] = {}
+        self._unset = (-1,) * slot_count
+        self.threads: list[tuple[int, tuple[int, ...]]] = [(0, self._unset)]
+        self.sc = 0
+        self._seen = [-1] * len(program)
+        self._step = pike_step
+        if profile is not None:
+            profile.prepare(program)
+            self._step = partial(pike_step, profile=profile)
+
+    @property
+    def idle(self) -> bool:
+        '''
+        True if no thread has saved a position yet, so no match is in progress.
+        '''
+        # Threads of matches in progress come before the ones looping over an unanchored
+        # prefix, so this usually stops at the first thread.
+        unset = self._unset
+        for _, saves in self.threads:
+            if saves is not unset and saves != unset:
+                return False
+        return True
+
+    def restart(self, sc: int):
+        '''
+        Drop every thread and start the program from the beginning at position `sc`.
+        '''
+        self.threads = [(0, self._unset)]
+        self.sc = sc
+
+    @property
+    def done(self) -> bool:
+        '''
+        True once no thread is left alive, so the rest of the input can't change the result.
+        '''
+        return not self.threads
+
+    def feed(self, codes: Iterable[int]):
+        program = self.program
+        seen = self._seen
+        step = self._step
+        threads = self.threads
+        sc = self.sc
+        for c in codes:
+            threads, matches = step(program, threads, c, sc, False, seen)
+            self._record(matches)
+            sc += 1
+            if not threads:
+                break
+        self.threads = threads
+        self.sc = sc
+
+    def finish(self) -> tuple[int, int] | None:
+        '''
+        Signal the end of the input and return the longest match.
+        '''
+        if self.threads:
+            _, matches = self._step(
+                self.program, self.threads, inst.END_OF_INPUT, self.sc, True, self._seen)
+            self._record(matches)
+            self.threads = []
+        return self.longest
+
+    def _record(self, matches: list[tuple[int, int, int]]):
+        for pattern, start, end in matches:
+            longest = self.longest
+            if (longest is None) or longest[1] - longest[0] < end - start:
+                self.longest = (start, end)
+            longest = self.longest_by_pattern.get(pattern)
+            if (longest is None) or longest[1] - longest[0] < end - start:
+                self.longest_by_pattern[pattern] = (start, end)
+
+def pike_step(
+        program: packed.PackedProgram,
+        threads: list[tuple[int, tuple[int, ...]]],
+        c: int,
+        sc: int,
+        at_end: bool,
+        seen: list[int],
+        profile: profiler.Profile | None = None
+) -> tuple[list[tuple[int, tuple[int, ...]]], list[tuple[int, int, int]]]:
+    '''
+    Advance every thread over the character `c` at input position `sc`.
+
+    Threads are given as (pc, save slots) pairs in priority order. Returns the threads waiting at
+    the next position and the (pattern, start, end) of every match found at this one. `seen` is
+    scratch space of len(program) used to merge threads that reach the same pc at this position.
+    If a profile is given (see Profile.prepare), what the step does is counted in it.
+    '''
+    opcode = program.opcode
+    flags = program.flags
+    dest = program.dest
+    counting = profile is not None
+    executions = profile.executions if profile is not None else []
+    forks = profile.forks if profile is not None else []
+    if profile is not None:
+        profile.live_threads.append(len(threads))
+    next_threads: list[tuple[int, tuple[int, ...]]] = []
+    matches: list[tuple[int, int, int]] = []
+
+    for thread in threads:
+        # Follow the thread through every non-consuming instruction, visiting the second
+        # destination of a Split first, just like the original recursive runner did.
+        stack = [thread]
+        while stack:
+            pc, saves = stack.pop()
+            if seen[pc] == sc:
+                continue
+            seen[pc] = sc
+            if counting:
+                executions[pc] += 1
+
+            op = opcode[pc]
+            if op == Opcode.Branch:
+                in_range = c >= program.c_min[pc] and c <= program.c_max[pc]
+                is_match = in_range != bool(flags[pc] & packed.INVERTED)
+
+                match (bool(flags[pc] & packed.CONSUME), is_match):
+                    case (True, False):
+                        # Failed a consuming Branch, failed to match pattern
+                        pass
+                    case (True, True):
+                        # Nothing can be consumed once the input is exhausted
+                        if not at_end:
+                            next_threads.append((pc+1, saves))
+                    case (False, True):
+                        stack.append((dest[pc], saves))
+                    case (False, False):
+                        # Nothing wrong with failing on a non-consuming branch
+                        stack.append((pc+1, saves))
+            elif op == Opcode.Class:
+                if c <= 0xFF and (program.bitmaps[pc] >> c) & 1 and not at_end:
+                    next_threads.append((pc+1, saves))
+            elif op == Opcode.Split:
+                if counting:
+                    forks[pc] += (seen[dest[pc]] != sc) + (seen[program.dest2[pc]] != sc)
+                stack.append((dest[pc], saves))
+                stack.append((program.dest2[pc], saves))
+            elif op == Opcode.Save:
+                index = program.index[pc]
+                saves = saves[:index] + (sc,) + saves[index+1:]
+                if flags[pc] & packed.MATCH:
+                    matches.append((program.pattern[pc], saves[index-1], sc))
+                else:
+                    stack.append((pc+1, saves))
+            else:
+                raise AssertionError(f"Opcode {op} at {pc} is not recognized!")
+
+    return (next_threads, matches)
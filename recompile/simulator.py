@@ -0,0 +1,203 @@
+'''
+A cycle-level model of the regex processor that the binary format in assembler.py targets.
+
+The processor has a number of thread slots that each execute one instruction per cycle, a run
+queue of threads waiting for a slot at the current input position, and a queue of threads
+waiting for the next character. A position takes as many cycles as it takes to run every thread
+at it to a consuming instruction (or its death), and at least `cycles_per_char`.
+
+- A Split keeps running its second destination in the same slot, which is the one the software
+  engines explore first, and pushes its first destination onto the run queue.
+- Each pc has a visited bit per position, so threads that reach a pc that already ran at this
+  position die, just like threads are merged in the Pike VM.
+- A thread that can't be queued because the queue is full is dropped, and counted as an
+  overflow. Results are only exact when there were no overflows.
+
+With one slot, threads run in the same order as in runner.pike_step and the simulation finds the
+same match. With more slots, threads that reach the same pc in the same cycle are merged in favour
+of the lowest slot, which can change which of two equally long matches is found.
+'''
+import argparse
+from dataclasses import asdict, dataclass
+import json
+
+from . import compiler
+from .backend import instruction as inst, packed
+from .backend.assembler import Opcode
+
+@dataclass
+class HardwareConfig:
+    thread_slots: int = 4
+    # Capacity of the run queue and of the next-character queue.
+    queue_capacity: int = 64
+    # The least number of cycles the processor spends on each input character.
+    cycles_per_char: int = 1
+
+@dataclass
+class SimulationReport:
+    cycles: int
+    # Input bytes, including those skipped once no thread was left.
+    bytes: int
+    # Cycles spent on a character beyond `cycles_per_char`, waiting for its threads to finish.
+    stall_cycles: int
+    # Threads dropped because a queue was full.
+    overflows: int
+    # The most slots busy in one cycle, and the most threads waiting in either queue.
+    peak_slots: int
+    peak_queue: int
+    # Instructions executed, and the fraction of slot cycles that executed one.
+    instructions: int
+    utilization: float
+    match: tuple[int, int] | None
+
+    @property
+    def cycles_per_byte(self) -> float:
+        return self.cycles / self.bytes if self.bytes else 0.0
+
+    @property
+    def exact(self) -> bool:
+        return self.overflows == 0
+
+def simulate(program: packed.Program | bytes, data: bytes,
+             config: HardwareConfig = HardwareConfig()) -> SimulationReport:
+    '''
+    Run a program over `data` on the modelled processor. `program` may be the output of
+    compiler.compile_bin.
+    '''
+    assert config.thread_slots > 0 and config.queue_capacity > 0 and config.cycles_per_char > 0
+    if isinstance(program, bytes):
+        program = packed.PackedProgram.from_bytes(program)
+    program = packed.pack(program)
+    return _Processor(program, config).run(data)
+
+class _Processor:
+    def __init__(self, program: packed.PackedProgram, config: HardwareConfig):
+        self.program = program
+        self.config = config
+        self.unset = (-1,) * program.slot_count()
+        self.visited = [-1] * len(program)
+        self.cycles = 0
+        self.stall_cycles = 0
+        self.overflows = 0
+        self.peak_slots = 0
+        self.peak_queue = 0
+        self.instructions = 0
+        self.longest: tuple[int, int] | None = None
+
+    def run(self, data: bytes) -> SimulationReport:
+        waiting = [(0, self.unset)]
+        for sc in range(len(data) + 1):
+            at_end = sc == len(data)
+            waiting = self.position(waiting, inst.END_OF_INPUT if at_end else data[sc], sc,
+                                    at_end)
+            if not waiting:
+                break
+        slot_cycles = self.cycles * self.config.thread_slots
+        return SimulationReport(
+            self.cycles, len(data), self.stall_cycles, self.overflows, self.peak_slots,
+            self.peak_queue, self.instructions,
+            self.instructions / slot_cycles if slot_cycles else 0.0, self.longest)
+
+    def position(self, waiting: list[tuple[int, tuple[int, ...]]], c: int, sc: int,
+                 at_end: bool) -> list[tuple[int, tuple[int, ...]]]:
+        '''
+        Run every thread at one input position, and return the threads for the next one.
+        '''
+        config = self.config
+        program = self.program
+        # Threads spawned by Splits, run last in first out like the Pike VM's stack, ahead of
+        # the threads that arrived from the previous character.
+        spawned: list[tuple[int, tuple[int, ...]]] = []
+        incoming = list(reversed(waiting))
+        next_threads: list[tuple[int, tuple[int, ...]]] = []
+        slots: list[tuple[int, tuple[int, ...]] | None] = [None] * config.thread_slots
+        cycles = 0
+
+        while True:
+            for i in range(len(slots)):
+                if slots[i] is None and (spawned or incoming):
+                    slots[i] = spawned.pop() if spawned else incoming.pop()
+            busy = [i for i, thread in enumerate(slots) if thread is not None]
+            if not busy:
+                break
+            cycles += 1
+            self.peak_slots = max(self.peak_slots, len(busy))
+
+            for i in busy:
+                pc, saves = slots[i]
+                slots[i] = None
+                if self.visited[pc] == sc:
+                    continue
+                self.visited[pc] = sc
+                self.instructions += 1
+
+                op = program.opcode[pc]
+                flags = program.flags[pc]
+                if op == Opcode.Split:
+                    slots[i] = (program.dest2[pc], saves)
+                    self.queue(spawned, (program.dest[pc], saves))
+                elif op == Opcode.Save:
+                    index = program.index[pc]
+                    saves = saves[:index] + (sc,) + saves[index+1:]
+                    if flags & packed.MATCH:
+                        self.record(saves[index-1], sc)
+                    else:
+                        slots[i] = (pc+1, saves)
+                elif op == Opcode.Class:
+                    if c <= 0xFF and (program.bitmaps[pc] >> c) & 1 and not at_end:
+                        self.queue(next_threads, (pc+1, saves))
+                elif op == Opcode.Branch:
+                    in_range = program.c_min[pc] <= c <= program.c_max[pc]
+                    is_match = in_range != bool(flags & packed.INVERTED)
+                    if flags & packed.CONSUME:
+                        if is_match and not at_end:
+                            self.queue(next_threads, (pc+1, saves))
+                    else:
+                        slots[i] = (program.dest[pc] if is_match else pc+1, saves)
+                else:
+                    raise AssertionError(f"Opcode {op} at {pc} is not recognized!")
+
+        self.cycles += max(cycles, config.cycles_per_char)
+        self.stall_cycles += max(0, cycles - config.cycles_per_char)
+        return next_threads
+
+    def queue(self, queue: list[tuple[int, tuple[int, ...]]],
+              thread: tuple[int, tuple[int, ...]]):
+        if len(queue) >= self.config.queue_capacity:
+            self.overflows += 1
+            return
+        queue.append(thread)
+        self.peak_queue = max(self.peak_queue, len(queue))
+
+    def record(self, start: int, end: int):
+        if self.longest is None or self.longest[1] - self.longest[0] < end - start:
+            self.longest = (start, end)
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='recompiler simulate',
+        description="Estimate how fast a program runs on the regex processor.")
+    program_group = parser.add_mutually_exclusive_group(required=True)
+    program_group.add_argument('-r', '--regex', help="The regular expression to compile.")
+    program_group.add_argument('-b', '--binary', help="A program written by `recompiler`.")
+    parser.add_argument('input', help="File to search.")
+    parser.add_argument('--slots', type=int, default=HardwareConfig.thread_slots,
+                        help="Number of thread slots.")
+    parser.add_argument('--queue', type=int, default=HardwareConfig.queue_capacity,
+                        help="Capacity of each thread queue.")
+    parser.add_argument('--cycles-per-char', type=int, default=HardwareConfig.cycles_per_char,
+                        help="Least number of cycles spent on each character.")
+    parser.add_argument('-c', '--class-table', action='store_true',
+                        help="Compile the regex with Class instructions.")
+    args = parser.parse_args(argv)
+
+    if args.regex is not None:
+        program = compiler.compile_bin(args.regex, class_table=args.class_table)
+    else:
+        program = packed.load(args.binary)
+    with open(args.input, 'rb') as f:
+        data = f.read()
+    report = simulate(program, data, HardwareConfig(args.slots, args.queue, args.cycles_per_char))
+    print(json.dumps(asdict(report) | {'cycles_per_byte': report.cycles_per_byte,
+                                       'exact': report.exact}, indent=2))
+    return 0
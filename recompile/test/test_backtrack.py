@@ -0,0 +1,44 @@
+import random
+
+import pytest
+
+from recompile import backtrack, compiler, runner
+from recompile.backend import packed
+from recompile.test.test_dfa import corpus
+
+@pytest.mark.parametrize("class_table", [False, True])
+@pytest.mark.parametrize("regex,inputs", corpus)
+def test_backtracker_agrees_with_pike_vm(regex: str, inputs: list[str], class_table: bool):
+    program = packed.pack(compiler.compile_regex(regex, class_table=class_table))
+    for s in inputs:
+        expected = runner.search_span(map(ord, s), program)
+        assert backtrack.search_span(s, program) == expected
+        assert backtrack.search_span(s.encode(), program) == expected
+
+def test_ties_and_repetition_agree_with_pike_vm():
+    rng = random.Random(0)
+    for regex in ["a*", "(a|ab)(c|bcd)?", "(a*)*b", "x?y?", "[ab]+a", "(aa|a)+$"]:
+        program = packed.pack(compiler.compile_regex(regex))
+        for _ in range(50):
+            s = ''.join(rng.choice("abcdxy") for _ in range(rng.randrange(12)))
+            assert backtrack.search_span(s, program) == runner.search_span(map(ord, s), program)
+
+def test_chosen_by_bitmap_size():
+    program = packed.pack(compiler.compile_regex("ab"))
+    assert backtrack.fits(program, 100)
+    assert not backtrack.fits(program, backtrack.MAX_BITMAP_BITS)
+    assert backtrack.fits(program, 1000, max_bits=len(program) * 1001)
+    # Long inputs fall back to the Pike VM, with the same result.
+    s = "x" * backtrack.MAX_BITMAP_BITS + "ab"
+    assert runner.search(s, program) == runner.search(s, program, engine='backtrack') == "ab"
+
+def test_not_chosen_over_skipping_to_candidates(monkeypatch):
+    regex = "qz+"
+    program = packed.pack(compiler.compile_regex(regex))
+    prefilter = compiler.compile_prefilter(regex)
+    s = "x" * 100 + "qzz"
+    assert backtrack.fits(program, len(s))
+    def fail(*args):
+        raise AssertionError("The backtracker shouldn't run")
+    monkeypatch.setattr(backtrack, 'search_span', fail)
+    assert runner.search(s, program, prefilter=prefilter) == "qzz"
@@ -0,0 +1,25 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from recompile import batch, compiler, runner
+from recompile.test.test_dfa import corpus
+
+@pytest.mark.parametrize("class_table", [False, True])
+@pytest.mark.parametrize("regex,inputs", corpus)
+def test_batch_agrees_with_search(regex: str, inputs: list[str], class_table: bool):
+    program = compiler.compile_regex(regex, class_table=class_table)
+    starts, ends = batch.search_batch(inputs, program)
+    for s, start, end in zip(inputs, starts, ends):
+        expected = runner.search(s, program)
+        if expected is None:
+            assert (start, end) == (-1, -1)
+        else:
+            assert s[start:end] == expected
+
+def test_batch_padded_matrix():
+    program = compiler.compile_regex("ab+")
+    matrix, lengths = batch.to_matrix([b"xxabbb", b"ab", b"", b"b"])
+    starts, ends = batch.search_batch(matrix, program, lengths)
+    assert starts.tolist() == [2, 0, -1, -1]
+    assert ends.tolist() == [6, 2, -1, -1]
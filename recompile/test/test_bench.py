@@ -0,0 +1,27 @@
+import copy
+from dataclasses import asdict
+import json
+
+from recompile.bench import corpus, suite
+
+def test_corpus_is_deterministic():
+    assert corpus.generate(5000, seed=1) == corpus.generate(5000, seed=1)
+    assert corpus.generate(5000, seed=1) != corpus.generate(5000, seed=2)
+    assert len(corpus.generate(5000)) == 5000
+
+def test_report_and_compare():
+    text = corpus.generate(3000)
+    report = suite.run(text, engines=('pike', 'dfa+prefilter', 're'), repeat=1)
+    assert report.corpus_size == 3000
+    for pattern in report.patterns:
+        search = pattern.search
+        assert search['pike'].span == search['dfa+prefilter'].span
+        assert pattern.instructions['class_table'] <= pattern.instructions['optimized']
+
+    # Reports survive a round trip through JSON, and only count as regressions when worse.
+    old = json.loads(json.dumps(asdict(report)))
+    assert suite.compare(old, old) == []
+    new = copy.deepcopy(old)
+    speed = old['patterns'][0]['search']['pike']['mb_per_s']
+    new['patterns'][0]['search']['pike']['mb_per_s'] = speed / 2
+    assert suite.compare(old, new) == [f"email pike: {speed:.3f} -> {speed / 2:.3f} MB/s"]
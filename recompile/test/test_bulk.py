@@ -0,0 +1,45 @@
+import io
+import threading
+
+import pytest
+
+from recompile import bulk, compiler, runner
+from recompile.test.test_regex import email_regex, ipv4_regex
+
+patterns = [email_regex, "(unclosed", ipv4_regex, "x{5000}", "ab+"]
+
+def test_failures_do_not_stop_the_batch():
+    serial = list(bulk.compile_all(patterns, jobs=1))
+    assert serial == list(bulk.compile_all(patterns, jobs=2))
+    assert [r.index for r in serial] == list(range(len(patterns)))
+    assert [r.error is None for r in serial] == [True, False, True, False, True]
+    assert serial[1].error.startswith("ParseError")
+    assert serial[0].binary == compiler.compile_bin(email_regex)
+
+def test_parallel_results_come_before_the_input_ends():
+    first_result = threading.Event()
+    waited = []
+    def source():
+        yield from patterns * 8
+        # Like a slow pipe, the rest only comes once a result is out.
+        waited.append(first_result.wait(timeout=5))
+        yield "ab+"
+    results = bulk.compile_all(source(), jobs=2)
+    assert next(results).index == 0
+    first_result.set()
+    assert len(list(results)) == len(patterns) * 8
+    assert waited == [True]
+
+def test_bundle_round_trip(tmp_path):
+    path = tmp_path / "rules.bundle"
+    bulk.write_bundle(str(path), list(bulk.compile_all(patterns, jobs=1)))
+    programs = bulk.load_bundle(str(path))
+    assert [p is None for p in programs] == [False, True, False, True, False]
+    assert runner.search("host 10.0.0.1", programs[2]) == "10.0.0.1"
+    assert runner.search("xabbb", programs[4]) == "abbb"
+
+    with pytest.raises(bulk.BundleError):
+        bulk.read_bundle(b"nope")
+
+def test_read_patterns_skips_blank_lines():
+    assert list(bulk.read_patterns(io.StringIO("a\n\nb\r\n"))) == ["a", "b"]
@@ -0,0 +1,154 @@
+import dataclasses
+
+import pytest
+
+from recompile import cache, compiler, runner
+from recompile.backend import assembler, code_gen, instruction as inst
+from recompile.frontend import parser, transform
+from recompile.test.test_regex import email_regex, uri_regex
+
+@pytest.fixture
+def fresh_cache():
+    old = compiler.program_cache
+    compiler.program_cache = cache.ProgramCache(max_size=2)
+    yield compiler.program_cache
+    compiler.program_cache = old
+
+def test_cache_hits_and_evicts(fresh_cache: cache.ProgramCache):
+    first = compiler.compile_regex(email_regex)
+    assert compiler.compile_regex(email_regex) == first
+    compiler.compile_regex(uri_regex)
+    compiler.compile_regex("abc")
+    info = compiler.cache_info()
+    assert (info.hits, info.misses, info.size) == (1, 3, 2)
+
+    # The email regex was the least recently used, so it has been evicted.
+    compiler.compile_regex(email_regex)
+    assert compiler.cache_info().misses == 4
+
+def test_cached_program_is_not_shared(fresh_cache: cache.ProgramCache):
+    program = compiler.compile_regex("abc")
+    program.clear()
+    assert len(compiler.compile_regex("abc")) != 0
+
+def test_disk_cache_round_trip(fresh_cache: cache.ProgramCache, tmp_path):
+    compiler.configure_cache(max_size=2, directory=str(tmp_path))
+    program = compiler.compile_regex(email_regex)
+    assert len(list(tmp_path.glob("*.bin"))) == 1
+
+    # A cold cache pointed at the same directory loads the program instead of compiling it.
+    compiler.program_cache = cache.ProgramCache(directory=str(tmp_path))
+    loaded = compiler.compile_regex(email_regex)
+    assert loaded == program
+    assert compiler.cache_info().disk_hits == 1
+    assert runner.search("mail joe@example.com", loaded) == "joe@example.com"
+
+def test_multi_pattern_ids_survive_assembly(fresh_cache: cache.ProgramCache):
+    patterns = ["ab", "cd", "ef"]
+    asm = compiler.compile_multi_asm(patterns)
+    assert "# pattern 2: ef" in asm
+    binary = compiler.compile_multi_bin(patterns)
+    words = [int.from_bytes(binary[i:i+4]) for i in range(0, len(binary), 4)]
+    saves = [i for i in map(assembler.disassemble, words) if isinstance(i, inst.Save)]
+    ids = [i.pattern for i in saves if i.is_match]
+    assert sorted(ids) == [0, 1, 2]
+
+def test_charsets_are_normalized():
+    # Duplicates, overlaps and neighbouring ranges all merge into a single range.
+    assert compiler.compile_regex("[a-fc-ka-bl]") == compiler.compile_regex("[a-l]")
+    # Everything but a single range is one inverted comparison.
+    assert compiler.compile_regex(r"[^xx]") == compiler.compile_regex("[^x]")
+    assert compiler.compile_regex(r"[^\d]", class_table=True)[-2] \
+        == inst.Compare(ord('0'), ord('9'), True)
+
+def test_class_table_lowering():
+    code = compiler.compile_regex(r"[\w.+-]", class_table=True)
+    classes = [i for i in code if isinstance(i, inst.ClassLookup)]
+    assert len(classes) == 1
+    assert len(code) < len(compiler.compile_regex(r"[\w.+-]"))
+    assert classes[0].code() == "Class '+' '-'-'.' '0'-'9' 'A'-'Z' '_' 'a'-'z'"
+    for s in ["_", "+", "-", ".", "a", "Z", ",", "/", " "]:
+        assert runner.search(s, code) == runner.search(s, compiler.compile_regex(r"[\w.+-]"))
+
+def test_reverse_program_matches_reversed_strings(fresh_cache: cache.ProgramCache):
+    reverse = compiler.compile_reverse("ab+(c|de)")
+    # It has no .* prefix, so it only matches from the start of its input.
+    for s, matches in [("cba", True), ("edbbba", True), ("abc", False), ("xcba", False)]:
+        assert (runner.search(s, reverse) == s) == matches
+    # The reverse program is cached separately from the forward one.
+    assert reverse != compiler.compile_regex("ab+(c|de)")
+
+@pytest.mark.parametrize("regex,text,expected", [
+    ("café", "le café noir", "café"),
+    ("[à-ü]+", "xx éèà yy", "éèà"),
+    ("a.c", "abc a€c", "a€c"),
+    ("x[^a]y", "xay x😀y", "x😀y"),
+    ("€+", "€€ €", "€€"),
+])
+def test_utf8_programs_search_bytes(regex: str, text: str, expected: str):
+    program = compiler.compile_regex(regex, utf8=True)
+    prefilter = compiler.compile_prefilter(regex, utf8=True)
+    data = text.encode()
+    for engine in runner.ENGINES:
+        start, end = runner.search_bytes(data, program, engine, prefilter=prefilter)
+        assert data[start:end].decode() == expected
+    reverse = compiler.compile_reverse(regex, utf8=True)
+    start, end = runner.search_bytes(data, program, 'dfa', reverse=reverse)
+    assert data[start:end].decode() == expected
+
+def test_utf8_wildcards_skip_invalid_bytes():
+    program = compiler.compile_regex("a.b", utf8=True)
+    assert runner.search_bytes(b"a\xffb a\xc3b", program) is None
+    assert runner.search_bytes(b"\xff\xfea\xc3\xa9b", program) == (2, 6)
+    with pytest.raises(AssertionError):
+        compiler.compile_regex("café")
+
+def test_utf8_sequences_cover_the_range():
+    for c_min, c_max in [(0, 0x10FFFF), (0x7F, 0x800), (0xD000, 0xE100), (0xFFFF, 0x10000)]:
+        sequences = transform.utf8_sequences(c_min, c_max)
+        for c in range(max(0, c_min - 300), min(0x10FFFF, c_max + 300), 97):
+            if 0xD800 <= c <= 0xDFFF:
+                continue
+            encoded = chr(c).encode()
+            found = any(len(seq) == len(encoded)
+                        and all(lo <= b <= hi for (lo, hi), b in zip(seq, encoded))
+                        for seq in sequences)
+            assert found == (c_min <= c <= c_max)
+
+def test_literal_alternations_are_factored():
+    words = [f"{a}{b}{c}" for a in "abcdefgh" for b in "ijklmnop" for c in "qrstuvwx"]
+    regex = "|".join(words)
+    code = compiler.compile_regex(regex)
+    # Each shared prefix is only compared once.
+    assert len(code) < 3 * len(words)
+    assert runner.search("zz dmw fnx zz", code) == "dmw"
+    assert runner.search("zz dmz fny zz", code) is None
+
+    assert compiler.compile_regex("foo|foobar|fizz") == compiler.compile_regex("f(oo(bar)?|izz)")
+    for s in ["foo", "foobar", "fizz", "fobar", "xfoobarx"]:
+        assert runner.search(s, compiler.compile_regex("foo|foobar|fizz")) \
+            == runner.search(s, compiler.compile_regex("foobar|fizz|foo"))
+
+def test_long_alternations_do_not_recurse_per_branch():
+    with pytest.raises(code_gen.ProgramTooLarge):
+        compiler.compile_regex("|".join([r"\d"] * 5000))
+
+def test_equal_subtrees_and_instructions_are_shared(fresh_cache: cache.ProgramCache):
+    parsed = transform.share(parser.parse(r"\w+-\w+|(\w+)x"))
+    first = parsed.alt1.val[0]
+    assert parsed.alt1.val[2] is first and parsed.alt2.val[0] is first
+    # Positions don't stop nodes being shared, and the first one's is kept.
+    assert first.pos == 0
+
+    code = compiler.compile_regex("a{3}b", optimize=False)
+    literals = [i for i in code if i == inst.Literal(ord('a'), False)]
+    assert len(literals) == 3 and all(i is literals[0] for i in literals)
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        literals[0].c_min = 0
+
+def test_shared_code_is_moved_to_each_use(fresh_cache: cache.ProgramCache):
+    # The group is shared by the repeat and the copy after it, and each copy branches to its
+    # own end.
+    code = compiler.compile_regex("(ab|cd){3}(ab|cd)", optimize=False)
+    assert runner.search("xcdabcdab", code) == "cdabcdab"
+    assert runner.search("xcdabcd", code) is None
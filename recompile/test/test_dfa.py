@@ -0,0 +1,95 @@
+from collections import OrderedDict
+
+import pytest
+
+from recompile import backtrack, compiler, dfa, runner
+from recompile.test.test_regex import email_regex, uri_regex, ipv4_regex
+
+corpus = [
+    (email_regex, ["joe@example.com", "My email is foo@example.com", "bar@example.com is my email",
+                   "example.com", "foo@example"]),
+    (uri_regex, ["https://www.example.com", "https://github.com/search?q=regex&type=repositories",
+                 "www.example.com", "foo@example.com"]),
+    (ipv4_regex, ["1.2.3.4", "255.255.255.255", "An IP Address: 127.0.0.1",
+                  "0.1.0.1 is an IP address", "I think [4.3.2.1] is an IP Address",
+                  "256.255.255.255", "256.255.255.255.255", "25.321.2.2", "25.32..2", "a.b.c.d"]),
+]
+
+@pytest.mark.parametrize("regex,inputs", corpus)
+def test_dfa_agrees_with_pike_vm(regex: str, inputs: list[str]):
+    program = compiler.compile_regex(regex)
+    cached = dfa.LazyDFA(program)
+    for s in inputs:
+        expected = runner.search(s, program)
+        assert runner.search(s, program, engine='dfa') == expected
+        assert runner.search(s, program, engine='dfa', dfa=cached) == expected
+    assert cached.stats.hits > 0
+
+def test_dfa_cache_flushes_and_falls_back():
+    program = compiler.compile_regex(ipv4_regex)
+    tiny = dfa.LazyDFA(program, max_states=2, max_flushes=1)
+    assert runner.search("An IP Address: 127.0.0.1", program, engine='dfa', dfa=tiny) == "127.0.0.1"
+    assert tiny.stats.flushes >= 2
+    assert tiny.stats.fallbacks == 1
+    assert tiny.state_count() <= 2
+
+def test_dfa_handles_wide_characters():
+    program = compiler.compile_regex(r"[^a]b")
+    assert runner.search("€b", program, engine='dfa') == runner.search("€b", program)
+
+def test_unknown_engine():
+    with pytest.raises(ValueError):
+        runner.search("a", compiler.compile_regex("a"), engine='nope')
+
+@pytest.mark.parametrize("regex,inputs", corpus)
+def test_reverse_program_finds_the_start(regex: str, inputs: list[str]):
+    program = compiler.compile_regex(regex)
+    reverse = dfa.LazyDFA(compiler.compile_reverse(regex))
+    for s in inputs + [" and ".join(inputs)]:
+        expected = runner.search(s, program)
+        assert runner.search(s, program, engine='dfa', reverse=reverse) == expected
+        assert runner.search_bytes(s.encode(), program, engine='dfa', reverse=reverse) \
+            == runner.search_bytes(s.encode(), program)
+
+def test_reverse_scans_fall_back_to_pike_vm():
+    # Every position ends a match, and each backward scan reads back to the start.
+    program = compiler.compile_regex("a*")
+    reverse = compiler.compile_reverse("a*")
+    assert runner.search("a" * 500 + "b", program, engine='dfa', reverse=reverse) == "a" * 500
+
+def test_every_match_end_is_reported():
+    ends = dfa.LazyDFA(compiler.compile_regex("ab|b")).match_ends(b"abxb")
+    assert list(ends) == [2, 4]
+
+def test_span_search_stops_at_the_last_match_end(monkeypatch):
+    program = compiler.compile_regex("ab|b")
+    # Without a reverse program the span is found by the Pike VM or the backtracker.
+    monkeypatch.setattr(runner, '_reverse', OrderedDict())
+    monkeypatch.setattr(compiler, 'reverse_of', lambda program: None)
+    assert dfa.LazyDFA(program).find_last_end(b"abxbxx") == 4
+    # Whichever engine finds the span only sees the input up to the end of the match.
+    lengths = []
+    def pike_vm(codes, program, *args, original=runner.search_span):
+        codes = list(codes)
+        lengths.append(len(codes))
+        return original(codes, program, *args)
+    def backtracker(data, program, original=backtrack.search_span):
+        lengths.append(len(data))
+        return original(data, program)
+    monkeypatch.setattr(runner, 'search_span', pike_vm)
+    monkeypatch.setattr(backtrack, 'search_span', backtracker)
+    s = "xab" + "x" * 100_000
+    assert runner.search(s, program, engine='dfa') == "ab"
+    assert runner.search_bytes(s.encode(), program, engine='dfa') == (1, 3)
+    assert lengths == [3, 3]
+
+def test_reverse_program_is_built_by_default(monkeypatch):
+    program = compiler.compile_regex("ab+c")
+    def pike_vm(*args):
+        raise AssertionError("the Pike VM shouldn't be needed")
+    monkeypatch.setattr(runner, 'search_span', pike_vm)
+    monkeypatch.setattr(backtrack, 'search_span', pike_vm)
+    s = "xxabbc abc abbbbc xx"
+    assert runner.search(s, program, engine='dfa') == "abbbbc"
+    assert runner.search_bytes(s.encode(), program, engine='dfa') == (11, 17)
+    assert len(runner._reverse) <= runner.MAX_REVERSE
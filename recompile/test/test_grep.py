@@ -0,0 +1,65 @@
+import re
+
+from recompile import grep
+from recompile.bench import corpus
+from recompile.test.test_regex import ipv4_regex
+
+def test_shards_are_line_aligned(tmp_path):
+    path = tmp_path / "log.txt"
+    path.write_text(corpus.generate(10_000))
+    data = path.read_bytes()
+    shards = grep.shards(str(path), shard_size=1000)
+    assert len(shards) > 5
+    assert shards[0].start == 0 and shards[-1].end == len(data)
+    for before, after in zip(shards, shards[1:]):
+        assert before.end == after.start
+        assert data[before.end - 1:before.end] == b'\n'
+
+def test_parallel_results_match_serial(tmp_path):
+    (tmp_path / "b").mkdir()
+    (tmp_path / "a.txt").write_text(corpus.generate(20_000, seed=1))
+    (tmp_path / "b" / "c.txt").write_text(corpus.generate(5_000, seed=2))
+    serial = list(grep.grep(ipv4_regex, [str(tmp_path)], jobs=1, shard_size=2000))
+    parallel = list(grep.grep(ipv4_regex, [str(tmp_path)], jobs=2, shard_size=2000))
+    assert serial == parallel
+    assert [path for path, _, _ in serial] == \
+        [str(tmp_path / "a.txt"), str(tmp_path / "b" / "c.txt")]
+
+    text = (tmp_path / "a.txt").read_text()
+    expected = [line.encode() for line in text.splitlines() if re.search(ipv4_regex, line)]
+    assert serial[0][1:] == (len(expected), expected)
+
+def test_count_and_only_matching(tmp_path):
+    path = tmp_path / "log.txt"
+    path.write_text("a 1.2.3.4 b 5.6.7.8\nnothing\n9.9.9.9\n")
+    counted = list(grep.grep(ipv4_regex, [str(path)], grep.Options(count=True), jobs=1))
+    assert counted == [(str(path), 2, [])]
+    only = list(grep.grep(ipv4_regex, [str(path)], grep.Options(only_matching=True), jobs=1))
+    assert only == [(str(path), 2, [b"1.2.3.4", b"5.6.7.8", b"9.9.9.9"])]
+
+def test_utf8_files(tmp_path):
+    path = tmp_path / "log.txt"
+    path.write_bytes("déjà vu\nplain\nnaïve café\n".encode() + b"\xff\xfe caf\xc3\xa9\n")
+    only = list(grep.grep("caf.", [str(path)], grep.Options(only_matching=True), jobs=1,
+                          utf8=True))
+    assert only == [(str(path), 2, ["café".encode(), "café".encode()])]
+    assert next(grep.grep("[àï]", [str(path)], jobs=1, utf8=True))[1] == 2
+
+def test_shards_are_streamed(tmp_path):
+    path = tmp_path / "log.txt"
+    path.write_text(corpus.generate(20_000, seed=3))
+    results = list(grep.search_files(ipv4_regex, [str(path)], jobs=2, shard_size=2000))
+    assert len(results) > 5
+    assert [r.last for r in results] == [False] * (len(results) - 1) + [True]
+    [(_, count, lines)] = grep.grep(ipv4_regex, [str(path)], jobs=1, shard_size=2000)
+    assert sum(r.count for r in results) == count
+    assert [line for r in results for line in r.output] == lines
+
+def test_unreadable_files_are_reported(tmp_path, capsys):
+    (tmp_path / "a.txt").write_text("1.2.3.4\n")
+    (tmp_path / "c.txt").write_text("5.6.7.8\n")
+    paths = [str(tmp_path / name) for name in ("a.txt", "missing.txt", "c.txt")]
+    assert grep.main([ipv4_regex, "-j", "1", *paths]) == 2
+    out, err = capsys.readouterr()
+    assert out.splitlines() == [f"{paths[0]}:1.2.3.4", f"{paths[2]}:5.6.7.8"]
+    assert err == f"recompiler grep: {paths[1]}: No such file or directory\n"
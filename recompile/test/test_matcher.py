@@ -0,0 +1,49 @@
+import asyncio
+import random
+
+import pytest
+
+from recompile import compiler, runner
+from recompile.matcher import Matcher, stream_matches
+from recompile.test.test_regex import email_regex
+
+@pytest.mark.parametrize("regex", ["a*", "ab|b", "(a|ab)(c|bcd)?", "x.*y", "$ab*", "[ab]+a"])
+def test_chunked_matches_agree_with_finditer(regex: str):
+    program = compiler.compile_regex(regex)
+    matcher = Matcher(program)
+    rng = random.Random(0)
+    for _ in range(50):
+        data = bytes(rng.choice(b"abcdxy") for _ in range(rng.randrange(25)))
+        found = []
+        for i in range(0, len(data), 3):
+            found += matcher.feed(data[i:i+3])
+        found += matcher.flush()
+        assert [(m.start, m.end) for m in found] == list(runner.finditer(data, program))
+        assert [m.data for m in found] == list(runner.findall(data, program))
+
+def test_matches_complete_without_flushing():
+    matcher = Matcher(compiler.compile_regex(email_regex))
+    assert matcher.feed(b"mail joe@exa") == []
+    found = matcher.feed(b"mple.com and ")
+    assert [(m.start, m.end, m.data) for m in found] == [(5, 20, b"joe@example.com")]
+    # Input before the match in progress isn't kept.
+    matcher.feed(b"x" * 1000 + b" ann@")
+    assert len(matcher._buffer) < 100
+    assert matcher.flush() == []
+
+def test_reset_starts_a_new_stream():
+    matcher = Matcher(compiler.compile_regex("ab"))
+    matcher.feed(b"xxa")
+    matcher.reset()
+    assert [(m.start, m.end) for m in matcher.feed(b"abab")] == [(0, 2)]
+    assert [(m.start, m.end) for m in matcher.flush()] == [(2, 4)]
+
+def test_stream_matches():
+    async def collect() -> list[bytes]:
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"a 1.2.3.4 b 5.6.")
+        reader.feed_data(b"7.8 c")
+        reader.feed_eof()
+        program = compiler.compile_regex(r"\d+(\.\d+)+")
+        return [m.data async for m in stream_matches(reader, program, chunk_size=4)]
+    assert asyncio.run(collect()) == [b"1.2.3.4", b"5.6.7.8"]
@@ -0,0 +1,40 @@
+import pytest
+
+from recompile import compiler, runner
+from recompile.backend import instruction as inst, optimizer
+from recompile.test.test_dfa import corpus
+
+@pytest.mark.parametrize("regex,inputs", corpus)
+def test_optimized_program_gives_same_results(regex: str, inputs: list[str]):
+    plain = compiler.compile_regex(regex, optimize=False)
+    optimized = compiler.compile_regex(regex)
+    assert len(optimized) <= len(plain)
+    for s in inputs:
+        assert runner.search(s, optimized) == runner.search(s, plain)
+
+def test_jump_threading_and_dead_code():
+    code = [
+        inst.Split(1, 3),
+        inst.Jump(2),
+        inst.Jump(4),
+        inst.Jump(4),
+        inst.Literal(ord('a'), False),
+        inst.Save(1, True),
+    ]
+    optimized, stats = optimizer.optimize(code)
+    assert optimized == [inst.Literal(ord('a'), False), inst.Save(1, True)]
+    assert (stats.before, stats.after) == (6, 2)
+
+def test_inverted_sets_share_a_die():
+    # Sets that are everything but a single range need no Die, so leave out two of them.
+    plain = compiler.compile_regex("[^a_]x[^c_]", optimize=False)
+    optimized = compiler.compile_regex("[^a_]x[^c_]")
+    assert sum(i == inst.Die() for i in optimized) == 1
+    assert len(optimized) < len(plain)
+    for s in ["zxz", "axz", "zxc", "_x_", "bxd", "qqxq"]:
+        assert runner.search(s, optimized) == runner.search(s, plain)
+
+def test_nested_quantifiers_collapse():
+    assert compiler.compile_regex("(a?)*b") == compiler.compile_regex("a*b")
+    assert compiler.compile_regex("(a+)+b") == compiler.compile_regex("a+b")
+    assert runner.search("xaab", compiler.compile_regex("((a?)+)?b")) == "aab"
@@ -0,0 +1,78 @@
+import mmap
+import sys
+
+import pytest
+
+from recompile import compiler, main, runner
+from recompile.backend import assembler, packed
+from recompile.test.test_dfa import corpus
+
+@pytest.mark.parametrize("class_table", [False, True])
+@pytest.mark.parametrize("regex,inputs", corpus)
+def test_loaded_binary_runs_in_every_engine(regex: str, inputs: list[str], class_table: bool,
+                                            tmp_path):
+    path = tmp_path / "out.bin"
+    path.write_bytes(compiler.compile_bin(regex, class_table=class_table))
+    program = packed.load(str(path))
+    code = compiler.compile_regex(regex, class_table=class_table)
+
+    assert len(program) == len(code)
+    assert program.instructions() == code
+    assert program.to_bytes() == path.read_bytes()
+    for s in inputs:
+        expected = runner.search(s, code)
+        for engine in runner.ENGINES:
+            assert runner.search(s, program, engine=engine) == expected
+
+def test_fields_are_decoded():
+    program = packed.PackedProgram.from_instructions(compiler.compile_multi(["a", "[^b]"]))
+    assert program.slot_count() == 2
+    assert sorted(program.pattern[pc] for pc in range(len(program))
+                  if program.flags[pc] & packed.MATCH) == [0, 1]
+    inverted = [pc for pc in range(len(program)) if program.flags[pc] & packed.INVERTED]
+    assert [(program.c_min[pc], program.c_max[pc]) for pc in inverted] == [(ord('b'), ord('b'))]
+
+def test_load_empty_file(tmp_path):
+    path = tmp_path / "empty.bin"
+    path.write_bytes(b"")
+    assert len(packed.load(str(path))) == 0
+
+def test_class_tables_are_shared():
+    program = packed.PackedProgram.from_instructions(
+        compiler.compile_regex(r"\w+-\w+", class_table=True))
+    assert len(program.bitmaps) == 2
+    # Both classes point at the one table after the code.
+    assert len(program.words) == len(program) + assembler.TABLE_WORDS
+    assert len(set(program.bitmaps.values())) == 1
+
+def test_lists_are_packed_once():
+    code = compiler.compile_regex("ab+c")
+    program = packed.pack(code)
+    assert packed.pack(compiler.compile_regex("ab+c")) is program
+    assert packed.pack(code + [code[-1]]) is not program
+
+def test_binaries_are_not_copied(tmp_path):
+    binary = bytearray(compiler.compile_bin("ab+c"))
+    program = packed.PackedProgram.from_bytes(binary)
+    assert program.data.obj is binary
+    assert program.instructions() == compiler.compile_regex("ab+c")
+
+    path = tmp_path / "out.bin"
+    path.write_bytes(binary)
+    loaded = packed.load(str(path))
+    assert isinstance(loaded.data.obj, mmap.mmap)
+    assert runner.search("xabbc", loaded) == "abbc"
+
+def test_multi_binaries_keep_their_patterns(tmp_path, monkeypatch):
+    patterns = [r"\d+", "cat", "$Subject"]
+    (tmp_path / "patterns.txt").write_text('\n'.join(patterns) + '\n')
+    out = str(tmp_path / "multi.bin")
+    monkeypatch.setattr(sys, 'argv', ["recompiler", "-m", "-f", str(tmp_path / "patterns.txt"),
+                                      "-o", out])
+    main.main()
+    program, loaded = packed.load_multi(out)
+    assert loaded == patterns
+    text = "$Subject: 3 cats"
+    matches = runner.search_multi(text, program)
+    assert {loaded[i]: text[start:end] for i, (start, end) in matches.items()} == {
+        r"\d+": "3", "cat": "cat", "$Subject": "$Subject"}
@@ -0,0 +1,52 @@
+import pytest
+
+from recompile.frontend import parser, syntax as syn
+
+def test_alternatives_nest_to_the_right():
+    parsed = parser.parse("ab|c|(d|e)f")
+    assert parsed == syn.Alternatives(
+        syn.Sequence([syn.Literal('a'), syn.Literal('b')]),
+        syn.Alternatives(
+            syn.Literal('c'),
+            syn.Sequence([
+                syn.Alternatives(syn.Literal('d'), syn.Literal('e')),
+                syn.Literal('f')])))
+
+def test_source_positions():
+    parsed = parser.parse("ab|c[de]+")
+    assert parsed.pos == 0
+    assert parsed.alt2.pos == 3
+    some = parsed.alt2.val[1]
+    assert isinstance(some, syn.Some) and some.pos == 4 and some.val.pos == 4
+
+@pytest.mark.parametrize("regex,offset", [
+    ("ab)", 2),
+    ("a(b", 1),
+    ("a||b", 2),
+    ("a|", 2),
+    ("+a", 0),
+    ("x[a", 1),
+    ("a{2,1}", 1),
+    ("a{0}", 1),
+    ("[z-a]", 2),
+    ("ab\\", 2),
+])
+def test_errors_report_offsets(regex: str, offset: int):
+    with pytest.raises(parser.ParseError) as error:
+        parser.parse(regex)
+    assert error.value.offset == offset
+
+def test_large_alternation():
+    words = [f"word{i}" for i in range(20_000)]
+    parsed = parser.parse('|'.join(words))
+    depth = 0
+    while isinstance(parsed, syn.Alternatives):
+        parsed = parsed.alt2
+        depth += 1
+    assert depth == len(words) - 1
+
+def test_counts_parse_to_repeat():
+    assert parser.parse("a{3}") == syn.Repeat(syn.Literal('a'), 3, 3)
+    assert parser.parse("a{0,2}") == syn.Repeat(syn.Literal('a'), 0, 2)
+    assert parser.parse("(ab){2,}") == syn.Repeat(
+        syn.Sequence([syn.Literal('a'), syn.Literal('b')]), 2, None)
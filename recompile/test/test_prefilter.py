@@ -0,0 +1,62 @@
+import pytest
+
+from recompile import compiler, runner
+from recompile.test.test_dfa import corpus
+from recompile.test.test_regex import email_regex, uri_regex, ipv4_regex
+
+def test_prefilter_facts():
+    email = compiler.compile_prefilter(email_regex)
+    assert '@' in email.required
+    assert email.min_length == 5 and email.max_length is None
+
+    uri = compiler.compile_prefilter(uri_regex)
+    assert uri.required == ['://']
+
+    ip = compiler.compile_prefilter(ipv4_regex)
+    assert ip.first_chars == frozenset(map(ord, "0123456789"))
+    assert (ip.min_length, ip.max_length) == (7, 15)
+
+    assert compiler.compile_prefilter("ab(cd)+e").required == ['ab', 'cd', 'e']
+    assert compiler.compile_prefilter("ab|cd").required == []
+    # Alternations are factored first, so the shared prefix is required.
+    assert compiler.compile_prefilter("ab|ac").required == ['a']
+    assert compiler.compile_prefilter("x*").first_chars is None
+
+@pytest.mark.parametrize("regex,inputs", corpus + [
+    ("abc", ["abc", "xxabcxx", "ab", "aabbcc", "xabxabcab"]),
+    ("z+y", ["zzzzy", "zzxzzy", "yzy", "zzzz"]),
+])
+@pytest.mark.parametrize("engine", runner.ENGINES)
+def test_prefilter_gives_same_results(regex: str, inputs: list[str], engine: str):
+    program = compiler.compile_regex(regex)
+    prefilter = compiler.compile_prefilter(regex)
+    for s in inputs:
+        expected = runner.search(s, program)
+        assert runner.search(s, program, engine=engine, prefilter=prefilter) == expected
+        data = s.encode()
+        expected_span = runner.search_bytes(data, program)
+        for buffer in (data, bytearray(data), memoryview(data)):
+            assert runner.search_bytes(
+                buffer, program, engine=engine, prefilter=prefilter) == expected_span
+
+def test_prefilter_skips_long_runs():
+    program = compiler.compile_regex(uri_regex)
+    prefilter = compiler.compile_prefilter(uri_regex)
+    text = "no links here " * 1000 + "see https://example.com/x"
+    assert runner.search(text, program, prefilter=prefilter) == "https://example.com/x"
+    assert runner.search(text[:-22], program, prefilter=prefilter) is None
+
+def test_large_first_char_sets_are_not_skipped_to(monkeypatch):
+    # Checking for 60+ first characters one position at a time is slower than not skipping.
+    searched = []
+    original = runner._search_candidates
+    def search_candidates(*args):
+        searched.append(args[1])
+        return original(*args)
+    monkeypatch.setattr(runner, '_search_candidates', search_candidates)
+    for regex in [email_regex, uri_regex, r"@\w+"]:
+        program = compiler.compile_regex(regex)
+        prefilter = compiler.compile_prefilter(regex)
+        s = "mail joe@example.com or https://example.com"
+        assert runner.search(s, program, prefilter=prefilter) == runner.search(s, program)
+    assert len(searched) == 1
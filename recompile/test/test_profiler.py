@@ -0,0 +1,51 @@
+from recompile import compiler, profiler, runner
+from recompile.backend import instruction as inst, packed
+from recompile.bench import corpus
+from recompile.test.test_regex import email_regex, ipv4_regex, uri_regex
+
+def test_profile_counts_executions():
+    program = compiler.compile_regex("ab")
+    profile = profiler.Profile()
+    assert runner.search("xxab", program, profile=profile) == "ab"
+    # One position per character, plus the end of the input.
+    assert profile.positions == 5
+    assert profile.steps == sum(profile.executions)
+    assert profile.executions[program.index(inst.Save(1, True))] == 1
+    assert profile.peak_threads >= 1
+
+def test_profile_does_not_change_results():
+    program = compiler.compile_regex(email_regex)
+    for engine in runner.ENGINES:
+        profile = profiler.Profile()
+        s = "mail joe@example.com or ann@example.org"
+        assert runner.search(s, program, engine=engine, profile=profile) \
+            == runner.search(s, program, engine=engine)
+        assert (profile.dfa_stats is not None) == (engine == 'dfa')
+
+def test_annotated_listing():
+    program = compiler.compile_regex("a+b")
+    profile = profiler.Profile()
+    runner.search("aaab", program, profile=profile)
+    listing = profiler.annotate(program, profile).splitlines()
+    header = [line for line in listing if line.startswith('#')]
+    assert len(listing) - len(header) == len(program)
+    assert any("fan-out" in line for line in listing)
+
+def test_profiled_steps_match_unprofiled():
+    data = corpus.generate(2000, seed=4).encode()
+    for regex in (email_regex, uri_regex, ipv4_regex):
+        program = packed.pack(compiler.compile_regex(regex))
+        profile = profiler.Profile()
+        profile.prepare(program)
+        unset = (-1,) * program.slot_count()
+        plain, profiled = [(0, unset)], [(0, unset)]
+        seen, profiled_seen = [-1] * len(program), [-1] * len(program)
+        for sc, c in enumerate(list(data) + [inst.END_OF_INPUT]):
+            at_end = sc == len(data)
+            plain, matches = runner.pike_step(program, plain + [(0, unset)], c, sc, at_end, seen)
+            profiled, profiled_matches = runner.pike_step(
+                program, profiled + [(0, unset)], c, sc, at_end, profiled_seen, profile)
+            assert (profiled, profiled_matches) == (plain, matches)
+        assert profile.positions == len(data) + 1
+        assert runner.search_bytes(data, program, profile=profiler.Profile()) \
+            == runner.search_bytes(data, program)
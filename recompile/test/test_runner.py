@@ -0,0 +1,79 @@
+import pytest
+
+from recompile import compiler, runner
+from recompile.backend import code_gen
+from recompile.test.test_regex import email_regex, ipv4_regex
+
+def test_long_input_does_not_recurse():
+    program = compiler.compile_regex(email_regex)
+    text = "x" * 50_000 + " joe@example.com"
+    assert runner.search(text, program) == "joe@example.com"
+
+def test_longest_match_wins_ties_go_to_first():
+    program = compiler.compile_regex("ab|abc|bcd")
+    assert runner.search("xabcd", program) == "abc"
+    assert runner.search_span(map(ord, "xabcd"), program) == (1, 4)
+
+def test_nested_loops_terminate():
+    program = compiler.compile_regex("(a*)*b")
+    assert runner.search("aaaaaaaaaaaaaaaaaaaaaaaaaaaaac", program) is None
+    assert runner.search("aaab", program) == "aaab"
+
+def test_ip_regex_on_long_input():
+    program = compiler.compile_regex(ipv4_regex)
+    text = "1.2.3 " * 2_000 + "10.0.0.1"
+    assert runner.search(text, program) == "10.0.0.1"
+
+def test_multi_pattern_single_pass():
+    patterns = [email_regex, ipv4_regex, "$Subject", "z+"]
+    program = compiler.compile_multi(patterns)
+    text = "$Subject: ping joe@example.com from 10.0.0.1"
+    matches = runner.search_multi(text, program)
+    assert {i: text[start:end] for i, (start, end) in matches.items()} == {
+        0: "joe@example.com", 1: "10.0.0.1", 2: "$Subject"}
+    assert runner.search_multi(text.encode(), program) == matches
+    assert runner.search_multi("nothing", program) == {}
+
+@pytest.mark.parametrize("regex,test_input,expected", [
+    ("x{3}", "xxxxx", "xxx"),
+    ("x{0,3}y", "xxxxy", "xxxy"),
+    ("x{2,3}y", "xy", None),
+    ("(ab){2,}c", "abababc", "abababc"),
+    ("(ab){2,}c", "abc", None),
+    ("(a{2}b){2}", "aabaab", "aabaab"),
+])
+def test_counted_repetition(regex: str, test_input: str, expected: str | None):
+    assert runner.search(test_input, compiler.compile_regex(regex)) == expected
+
+def test_nested_counts_stay_small():
+    program = compiler.compile_regex("(a{10}){10}", optimize=False)
+    assert len(program) < 120
+    with pytest.raises(code_gen.ProgramTooLarge):
+        compiler.compile_regex("((a{100}){100}){100}")
+
+@pytest.mark.parametrize("regex,test_input,expected", [
+    ("a+", "xaaxaxaaa", ["aa", "a", "aaa"]),
+    ("a*", "aab", ["aa", "", ""]),
+    ("ab|abc", "abcab", ["abc", "ab"]),
+    (email_regex, "joe@example.com, ann@example.org", ["joe@example.com", "ann@example.org"]),
+    ("x", "", []),
+])
+def test_findall(regex: str, test_input: str, expected: list[str]):
+    program = compiler.compile_regex(regex)
+    assert list(runner.findall(test_input, program)) == expected
+    assert list(runner.findall(test_input, program, compiler.compile_prefilter(regex))) == expected
+    assert list(runner.findall(test_input.encode(), program)) == [e.encode() for e in expected]
+
+def test_finditer_is_lazy():
+    program = compiler.compile_regex(ipv4_regex)
+    text = "1.2.3.4 " + "x" * 100_000 + " 5.6.7.8"
+    matches = runner.finditer(text, program)
+    assert next(matches) == (0, 7)
+    assert list(matches) == [(len(text) - 7, len(text))]
+
+def test_match_and_fullmatch():
+    program = compiler.compile_regex("a+b?")
+    assert runner.match("aabx", program) == "aab"
+    assert runner.match("xaab", program) is None
+    assert runner.fullmatch("aab", program) == "aab"
+    assert runner.fullmatch("aabx", program) is None
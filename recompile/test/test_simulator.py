@@ -0,0 +1,35 @@
+import pytest
+
+from recompile import compiler, profiler, runner, simulator
+from recompile.test.test_dfa import corpus
+
+@pytest.mark.parametrize("regex,inputs", corpus)
+def test_one_slot_matches_the_pike_vm(regex: str, inputs: list[str]):
+    binary = compiler.compile_bin(regex)
+    program = compiler.compile_regex(regex)
+    config = simulator.HardwareConfig(thread_slots=1, queue_capacity=1024)
+    for s in inputs:
+        data = s.encode()
+        report = simulator.simulate(binary, data, config)
+        profile = profiler.Profile()
+        assert report.match == runner.search_bytes(data, program, profile=profile)
+        assert report.exact
+        assert report.instructions == profile.steps
+        assert report.peak_slots == 1
+
+def test_more_slots_take_fewer_cycles():
+    program = compiler.compile_regex(r"[\w.+-]+@[\w.-]+\.[\w.-]+")
+    data = b"a.b.c.d@e.f.g.h " * 20
+    one = simulator.simulate(program, data, simulator.HardwareConfig(thread_slots=1))
+    four = simulator.simulate(program, data, simulator.HardwareConfig(thread_slots=4))
+    assert four.cycles < one.cycles
+    assert four.peak_slots > 1
+    assert one.cycles_per_byte >= 1
+    assert four.match is not None and four.exact
+
+def test_queue_overflow():
+    program = compiler.compile_regex("(a|aa|aaa)*b")
+    report = simulator.simulate(program, b"a" * 20 + b"b",
+                                simulator.HardwareConfig(queue_capacity=1))
+    assert report.overflows > 0
+    assert not report.exact
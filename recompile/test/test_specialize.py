@@ -0,0 +1,79 @@
+from collections import OrderedDict
+import random
+
+import pytest
+
+from recompile import compiler, runner
+from recompile.backend import specialize
+from recompile.test.test_dfa import corpus
+
+@pytest.mark.parametrize("class_table", [False, True])
+@pytest.mark.parametrize("regex,inputs", corpus)
+def test_specialized_agrees_with_pike_vm(regex: str, inputs: list[str], class_table: bool):
+    program = compiler.compile_regex(regex, class_table=class_table)
+    search = specialize.matcher(program)
+    for s in inputs:
+        assert search(map(ord, s)) == runner.search_span(map(ord, s), program)
+        assert search(s.encode()) == runner.search_span(s.encode(), program)
+
+def test_ties_and_wide_characters_agree_with_pike_vm():
+    rng = random.Random(0)
+    for regex in ["a*", "(a|ab)(c|bcd)?", "(a*)*b", "[^ab]x", "x.y", "[a-cx-z]+b"]:
+        program = compiler.compile_regex(regex)
+        search = specialize.matcher(program)
+        for _ in range(50):
+            s = ''.join(rng.choice("abcdxy€") for _ in range(rng.randrange(12)))
+            assert search(map(ord, s)) == runner.search_span(map(ord, s), program)
+
+def test_threads_left_at_the_end_do_not_run_again():
+    # Each of these leaves threads just after a consuming instruction when the input runs out.
+    for regex in [r"\W", "ab", "[^a]b", "b.c"]:
+        program = compiler.compile_regex(regex)
+        search = specialize.matcher(program)
+        for s in ["bb", "b", "ab!a", ""]:
+            assert search(s.encode()) == runner.search_span(s.encode(), program)
+    assert runner.search("bb", compiler.compile_regex(r"\W"), engine='specialized') is None
+
+def test_deep_programs_are_split_into_functions():
+    # Each of the ranges is a non-consuming Branch nested in the one before.
+    chars = [chr(c) for c in range(ord('!'), ord('~'), 2) if chr(c) not in "]\\^-"]
+    regex = "[" + "".join(chars) + "]z"
+    search = specialize.matcher(compiler.compile_regex(regex))
+    assert search(b"..Kz..") == (2, 4)
+
+def test_long_chains_of_empty_matches_do_not_recurse():
+    program = compiler.compile_regex("(a?){1000}b")
+    assert specialize.matcher(program)(b"xaab") == runner.search_span(b"xaab", program) == (1, 4)
+    assert runner.search("b", program, engine='specialized') == "b"
+
+@pytest.mark.parametrize("regex,inputs", corpus)
+def test_stack_based_code_agrees_with_pike_vm(regex: str, inputs: list[str], monkeypatch):
+    monkeypatch.setattr(specialize, 'MAX_RECURSION', 0)
+    # Don't pick up the matchers other tests compiled with calls.
+    monkeypatch.setattr(specialize, '_matchers', OrderedDict())
+    program = compiler.compile_regex(regex)
+    search = specialize.matcher(program)
+    assert "push(" in specialize.source(program)
+    for s in inputs:
+        assert search(map(ord, s)) == runner.search_span(map(ord, s), program)
+
+def test_code_is_stored_next_to_the_cache(tmp_path):
+    program = compiler.compile_regex("ab+c")
+    specialize._matchers.clear()
+    search = specialize.matcher(program, str(tmp_path))
+    assert len(list(tmp_path.glob("*.marshal"))) == 1
+
+    # Another process would load the code object instead of generating the source again.
+    specialize._matchers.clear()
+    loaded = specialize.matcher(program, str(tmp_path))
+    assert loaded is not search
+    assert loaded(b"xabbbc") == search(b"xabbbc") == (1, 6)
+
+def test_stored_code_from_other_generators_is_ignored(tmp_path, monkeypatch):
+    program = compiler.compile_regex("ab+c")
+    specialize._matchers.clear()
+    specialize.matcher(program, str(tmp_path))
+    monkeypatch.setattr(specialize, 'GENERATOR_VERSION', specialize.GENERATOR_VERSION + 1)
+    specialize._matchers.clear()
+    specialize.matcher(program, str(tmp_path))
+    assert len(list(tmp_path.glob("*.marshal"))) == 2
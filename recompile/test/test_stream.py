@@ -0,0 +1,34 @@
+import io
+import mmap
+
+from recompile import compiler, runner
+from recompile.test.test_regex import email_regex, ipv4_regex
+
+def test_search_bytes_accepts_buffers():
+    program = compiler.compile_regex(email_regex)
+    data = b"\xff\x00 contact: joe@example.com \xfe"
+    expected = (12, 27)
+    assert runner.search_bytes(data, program) == expected
+    assert runner.search_bytes(bytearray(data), program) == expected
+    assert runner.search_bytes(memoryview(data), program) == expected
+    assert runner.search_bytes(data, program, engine='dfa') == expected
+    assert runner.search_bytes(b"nothing here", program, engine='dfa') is None
+
+def test_search_bytes_accepts_mmap(tmp_path):
+    program = compiler.compile_regex(ipv4_regex)
+    path = tmp_path / "log.txt"
+    path.write_bytes(b"x" * 10_000 + b" 192.168.0.1 ")
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        assert runner.search_bytes(mm, program) == (10_001, 10_012)
+
+def test_stream_match_across_chunks():
+    program = compiler.compile_regex(email_regex)
+    data = b"padding " * 3 + b"someone@example.com and more"
+    start = data.index(b"someone")
+    for chunk_size in (1, 3, 7, 16, 4096):
+        span = runner.search_stream(io.BytesIO(data), program, chunk_size=chunk_size)
+        assert span == (start, start + len("someone@example.com"))
+
+def test_stream_without_match():
+    program = compiler.compile_regex(email_regex)
+    assert runner.search_stream(io.BytesIO(b"no email " * 100), program, chunk_size=64) is None